@@ -6,194 +6,188 @@
 ##### Description: Tool to set Siena batteries into SHUTDOWN mode for shipment. 
 ##### (2023-JAN-26) REV3
 """
-import time
-import pywinusb
+import queue
+import traceback
+try:
+    import pywinusb  # Windows HID backend; Linux uses /dev/hidraw
+except ImportError:
+    pywinusb = None
 import six
 import bqcomm
 from bqcomm import adapter
+from bqcomm import bq40z50, monitor, retry
+from bqcomm.cache import RegisterCache
+from bqcomm.pacing import Pacer
+from bqcomm.shared import IOWorker
 import tkinter as ttk
 import tkinter.messagebox
 from tkinter import *
 
-# Setup constants
-BQ40Z50_ADDR = 0x17
-
-# Commands
-VOLT_CMD = 0x09
-TEMP_CMD = 0x08
-CURR_CMD = 0x0A
-MAXE_CMD = 0x0C
-RSOC_CMD = 0x0D
-RCAP_CMD = 0x0F
-CCNT_CMD = 0x17
-SN_CMD = 0x1C
-FCC_CMD = 0x10
-SHUTDOWN_CMD = [0x10,0x00]
-MFR_BLK_ACC_ADDR = 0x44
+from inspection import BQ40Z50_ADDR, VOLT_CMD
+import inspection
 
 # --------------------------------------- MAIN GUI -------------------------------------------
 
 #################   Main GUI ###########################################################################################################
 class MainApplication(ttk.Frame):
     
-    def CheckAdapter(self):
-      if  self.bq_adapter == None:
-         #print("Nothing has been connected yet")
-         try:
-            self.bq_adapter = adapter.Adapter()
-            time.sleep(0.1)
-            self.bq_adapter.open()
-            time.sleep(0.1)
-            #fwversion = self.bq_adapter.device.get_version()
-            #time.sleep(0.1)
-            #adaptername = type(self.bq_adapter.device).__name__
-            self.info4.config(text="Connected", bg="green" )
-            #self.info6.config(text=str(fwversion), bg="green" )
-            #print("Succesfullly Established First Connection with 2400")
-         except:
-            self.bq_adapter == None
-            print(" Could not Establish First Connection")
-      else:
-         try:
-            fwversion = self.bq_adapter.device.get_version()
-            #print("Connection still 2400 works")
-         except:
-            self.bq_adapter = None
-            self.info4.config(text="Not Connected", bg="red" )
-            #self.info6.config(text="Not Connected", bg="red" )
-            #print("Connection was broken")
-
-      self.after(1000, self.CheckAdapter)
-
-    def CheckValues(self):
-    
-    #Is the Voltage between 8V and 12.3  
-      voltage = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, VOLT_CMD)
-      time.sleep(0.1)
-      self.l2.config(text=str(voltage))
-      if 8000 <= voltage <= 12300:
-         self.OKlabel1.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel1.config(bg="red" , text='Fail')
-
-   # Is the current= 0 ?
-      current = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, CURR_CMD)
-      time.sleep(0.1)
-      self.l4.config(text=str(current))
-      if current==0:
-         self.OKlabel2.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel2.config(bg="red" , text='Fail')
-
-   # Is the temperature between 10 and 40 degrees ?
-      temperature = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, TEMP_CMD)/100
-      time.sleep(0.1) 
-      self.l6.config(text=str(temperature)) 
-      if 10 <= temperature <= 40:
-         self.OKlabel3.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel3.config(bg="red" , text='Fail')
-
-   # Is the max error equal or lower to  2 ?
-      maxerror = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, MAXE_CMD)
-      time.sleep(0.1)
-      self.l8.config(text=str(maxerror)) 
-      if 0 <= maxerror <= 2:
-         self.OKlabel4.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel4.config(bg="red" , text='Fail')
-
-   # Is the relative state of charge between 5 and 30% ?
-      rsoc = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, RSOC_CMD)
-      time.sleep(0.1)
-      self.l10.config(text=str(rsoc)) 
-      if 5 <= rsoc <= 30:
-         self.OKlabel5.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel5.config(bg="red" , text='Fail')
-
-   # Is the remaining capacity between 500 and 3000 ?
-      rcap = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, RCAP_CMD)
-      time.sleep(0.1)
-      self.l12.config(text=str(rcap))   
-      if 500 <= rcap <= 3000:
-         self.OKlabel6.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel6.config(bg="red" , text='Fail')
-
-   # Is the cycle count lower or equal to 5
-      cyclecount = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, CCNT_CMD)
-      time.sleep(0.1)
-      self.l14.config(text=str(cyclecount))    
-      if 0 <= cyclecount <= 5:
-         self.OKlabel7.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel7.config(bg="red" , text='Fail')
-
-   # Is the Full Charge Capacity higher than 5820
-      fcc = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, FCC_CMD)
-      time.sleep(0.1)
-      self.l16.config(text=str(fcc))    
-      if 5820 < fcc :
-         self.OKlabel8.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel8.config(bg="red" , text='Fail')
+    # All bus I/O runs on self.io, one request at a time and in order. The
+    # Tk thread only queues work and updates widgets from PollResults().
 
+    def RunInBackground(self, fn, callback):
+      future = self.io.submit(fn)
+      future.add_done_callback(lambda f: self.results.put((callback, f)))
 
-   # Is the Serial Number higher than 0004
-      serialnumber = self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, SN_CMD)
-      time.sleep(0.1)
-      self.l18.config(text=str(serialnumber))    
-      if 4 <= serialnumber :
-         self.OKlabel9.config(bg="green" , text='Pass')
-      else:
-         self.OKlabel9.config(bg="red" , text='Fail')
-      
-      time.sleep(0.1)
-      self.Shutdown()
-         
-   
-    def CheckConnection(self):
+    def PollResults(self):
+      # Results and monitor events are queued as (callback, argument) pairs
+      try:
+         while True:
+            try:
+               callback, arg = self.results.get_nowait()
+            except queue.Empty:
+               break
+            try:
+               callback(arg)
+            except Exception as e:
+               # One failed update must not stop the GUI from updating
+               traceback.print_exc()
+               self.info9.config(text=str(e) or type(e).__name__, bg="red")
+      finally:
+         self.after(50, self.PollResults)
+
+    def ConnectAdapter(self):
+      # Runs on the I/O worker, when the monitor finds no adapter. All bus
+      # I/O already goes through self.io, so the plain Adapter is enough.
+      bq_adapter = adapter.Adapter(pacer=self.pacer, cache=self.cache, retry=self.retry)
       try:
-         # some test
-         x= self.bq_adapter.device.smb_read_word(BQ40Z50_ADDR, VOLT_CMD)
+         bq_adapter.open()
+      except Exception:
+         bq_adapter.close()
+         raise
+      #fwversion = bq_adapter.device.get_version()
+      #adaptername = type(bq_adapter.device).__name__
+      return bq_adapter
+
+    def OnMonitorEvent(self, event):
+      # Runs on the monitor thread; widgets are updated from PollResults()
+      self.results.put((self.ShowEvent, event))
+
+    def ShowEvent(self, event):
+      if event.kind == monitor.ADAPTER_UP:
+         self.info4.config(text="Connected", bg="green" )
+      elif event.kind == monitor.ADAPTER_DOWN:
+         self.info4.config(text="Not Connected", bg="red" )
+         self.battery = False
+         self.live.config(text="")
+      elif event.kind == monitor.BATTERY_INSERTED:
          self.info7.config(text="Connected", bg="green")
-      except:
+         # Another battery may support other blocks
+         self.telemetry = None
+         self.battery = True
+      elif event.kind == monitor.BATTERY_REMOVED:
          self.info7.config(text="Disconnected", bg="red")
-         self.l2.config(text=str(0))
-         self.OKlabel1.config(bg="gray" , text="Check")
-         self.l4.config(text=str(0))
-         self.OKlabel2.config(bg="gray" , text="Check")
-         self.l6.config(text=str(0))
-         self.OKlabel3.config(bg="gray" , text="Check")      
-         self.l8.config(text=str(0))
-         self.OKlabel4.config(bg="gray" , text="Check")
-         self.l10.config(text=str(0))
-         self.OKlabel5.config(bg="gray" , text="Check")
-         self.l12.config(text=str(0))
-         self.OKlabel6.config(bg="gray" , text="Check")
-         self.l14.config(text=str(0))
-         self.OKlabel7.config(bg="gray" , text="Check")
-         self.l16.config(text=str(0))
-         self.OKlabel8.config(bg="gray" , text="Check")
-         self.l18.config(text=str(0))
-         self.OKlabel9.config(bg="gray" , text="Check")
-
-      # This will run the function in every 1000ms (1 secs).
-      self.after(1000, self.CheckConnection)    
-
-    def Shutdown(self):
-       self.bq_adapter.device.smb_write_block(BQ40Z50_ADDR, MFR_BLK_ACC_ADDR, SHUTDOWN_CMD)
-       time.sleep(0.5)
-       self.bq_adapter.device.smb_write_block(BQ40Z50_ADDR, MFR_BLK_ACC_ADDR, SHUTDOWN_CMD)
-       #print("Shutdown disabled")
+         self.battery = False
+         self.live.config(text="")
+         for value_label, ok_label in zip(self.value_labels, self.ok_labels):
+            value_label.config(text=str(0))
+            ok_label.config(bg="gray" , text="Check")
+
+    def PollTelemetry(self):
+      # Live readout while a battery is present and no inspection is queued
+      try:
+         if self.battery and not self.queued and not self.reading:
+            self.reading = True
+            self.RunInBackground(self.ReadTelemetry, self.ShowTelemetry)
+      finally:
+         self.after(1000, self.PollTelemetry)
+
+    def ReadTelemetry(self):
+      # Runs on the I/O worker: one DAStatus1 block, two transactions for
+      # what would otherwise be five word reads
+      bq_adapter = self.monitor.adapter
+      if bq_adapter == None:
+         return None
+      telemetry = self.telemetry
+      if telemetry == None or telemetry.device is not bq_adapter.device:
+         telemetry = bq40z50.Telemetry(bq_adapter.device, BQ40Z50_ADDR)
+         self.telemetry = telemetry
+      return telemetry.snapshot()
+
+    def ShowTelemetry(self, future):
+      self.reading = False
+      try:
+         values = future.result()
+      except Exception:
+         # Battery removal etc. are reported by the monitor
+         values = None
+      if values == None or not self.battery:
+         self.live.config(text="")
+         return
+      cells = [values["cell_voltage_{0}".format(i)] for i in range(1, 5)]
+      text = "Pack {0} mV, cells {1} mV".format(
+         values["bat_voltage"], "/".join(str(c) for c in cells))
+      if values["power"] != None:
+         # DAStatus1 reports power in units of 10 mW
+         text += ", {0:.2f} W".format(values["power"] / 100.0)
+      self.live.config(text=text)
+
+    def InspectUnit(self):
+      # Runs on the I/O worker: checks, then shutdown
+      bq_adapter = self.monitor.adapter
+      if bq_adapter == None:
+         return {"checks": [], "passed": False, "shutdown": False,
+                 "error": "No adapter connected"}
+      # No fixed pauses: the pacer finds the gap the gauge needs
+      return inspection.inspect(bq_adapter.device, delay=0)
+
+    def CheckValues(self):
+      # Returns at once; pressing Start again queues the next unit
+      self.queued += 1
+      self.ShowQueue()
+      self.RunInBackground(self.InspectUnit, self.ShowValues)
+
+    def ShowValues(self, future):
+      self.queued -= 1
+      self.ShowQueue()
+      result = future.result()
+      if "bus_gap" in result and not self.queued:
+         self.info9.config(text="Ready (bus gap {0:.1f} ms)".format(result["bus_gap"] * 1000))
+      if result["error"]:
+         self.info9.config(text=result["error"], bg="red")
+      checks = result["checks"]
+      for check, value_label, ok_label in zip(checks, self.value_labels, self.ok_labels):
+         value_label.config(text=str(check["value"]))
+         if check["passed"]:
+            ok_label.config(bg="green" , text='Pass')
+         else:
+            ok_label.config(bg="red" , text='Fail')
+
+    def ShowQueue(self):
+      if self.queued:
+         self.info9.config(text="Running, {0} queued".format(self.queued - 1), bg="yellow")
+      else:
+         self.info9.config(text="Ready", bg="gray")
 
     def __init__(self, master, *args, **kwargs):
         ttk.Frame.__init__(self, master, *args, **kwargs)
         #parent = parent
         #self = ttk.Tk()
 
-        self.bq_adapter = None
+        self.io = IOWorker("inspector-io")
+        self.results = queue.Queue()
+        self.queued = 0
+        # Live telemetry: battery present, a read in flight, the reader
+        self.battery = False
+        self.reading = False
+        self.telemetry = None
+        # Kept across reconnects, so the gap learned for the gauge survives
+        self.pacer = Pacer()
+        # Cleared at the start of every inspection, so one battery's
+        # serial number etc. are never reported for the next
+        self.cache = RegisterCache(bq40z50.CACHE_POLICIES)
+        # A transient NACK or bad PEC is retried within milliseconds
+        # instead of failing the unit or the battery presence poll
+        self.retry = retry.default_policies()
         voltage = 0
         current = 0
         temperature = 0
@@ -285,6 +279,11 @@ class MainApplication(ttk.Frame):
         self.OKlabel9.grid(row=13,column=5)
 
 
+        # Value and Pass/Fail labels in the order of the plan's checks
+        self.value_labels = [self.l2, self.l4, self.l6, self.l8, self.l10, self.l12, self.l14, self.l16, self.l18]
+        self.ok_labels = [self.OKlabel1, self.OKlabel2, self.OKlabel3, self.OKlabel4, self.OKlabel5,
+                          self.OKlabel6, self.OKlabel7, self.OKlabel8, self.OKlabel9]
+
         lspace = ttk.Label(self, text="        ")
         lspace.grid(row=5,column=4)
         lspace2 = ttk.Label(self, text="        ")
@@ -293,8 +292,23 @@ class MainApplication(ttk.Frame):
         B1 = ttk.Button(self, text ="Start", command = self.CheckValues , font=("Calibri", 30))
         B1.grid(row=15,column=2, columnspan=5) 
 
-        self.CheckAdapter()
-        self.CheckConnection()
+    # Inspection status: running, queued units and the last error
+        self.info9 = ttk.Label(self, text="Ready", bg="gray")
+        self.info9.grid(row=16,column=2, columnspan=5)
+
+    # Live pack and cell voltages between inspections
+        self.live = ttk.Label(self, text="")
+        self.live.grid(row=17,column=2, columnspan=5)
+
+        # One poll for adapter and battery, backing off while nothing
+        # changes; its probes share the I/O worker with the inspections
+        self.monitor = monitor.HealthMonitor(
+            self.ConnectAdapter, BQ40Z50_ADDR, VOLT_CMD, call=self.io.call)
+        self.monitor.subscribe(self.OnMonitorEvent)
+
+        self.PollResults()
+        self.PollTelemetry()
+        self.monitor.start()
         
   
 
@@ -8,7 +8,7 @@ a = Analysis(
     ['Inspector2.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('plans/*.json', 'plans')],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
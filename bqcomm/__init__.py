@@ -32,8 +32,10 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from __future__ import absolute_import
 import logging
+import os
 
-from .adapter import Adapter, CommDevice, Error
+from .adapter import (Adapter, Batch, BatchResult, CommDevice, Error,
+                      ResponseTimeout, WriteError)
 
 # Adapter types
 from .aardvark import Aardvark
@@ -45,3 +47,9 @@ __version__ = '0.0.7'
 logging.basicConfig(level=logging.WARN)
 CommDevice.register(EV2400)
 CommDevice.register(Aardvark)
+
+# BQCOMM_SIM=device[:N] or ev2400[:N] swaps the real adapters for N
+# simulated ones (bqcomm.sim), so the tools run with no hardware attached
+if os.environ.get("BQCOMM_SIM"):
+    from . import sim
+    sim.install(os.environ["BQCOMM_SIM"])
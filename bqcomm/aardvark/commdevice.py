@@ -36,6 +36,7 @@ import atexit
 import logging
 
 import bqcomm
+from bqcomm import trace
 
 try:
     import aardvark_py
@@ -79,6 +80,9 @@ class Aardvark(bqcomm.CommDevice):
         self._bitrate = bitrate
         self._aa_mode = aardvark_py.AA_CONFIG_GPIO_I2C
 
+        # TraceRecorder for the bytes of every I2C transaction, or None
+        self.trace = None
+
         if not no_open:
             self.open()
 
@@ -105,8 +109,35 @@ class Aardvark(bqcomm.CommDevice):
         if self.handle is not None:
             aardvark_py.aa_close(self.handle)
             self.handle = None
+            if self.trace is not None:
+                self.trace.close()
+
+    def enable_tracing(self, enable=True, path=None, capacity=4096):
+        """
+        Record the target address and bytes written, and the bytes read, of
+        every I2C transaction in a bqcomm.trace.TraceRecorder kept in `trace`
+        """
+        if self.trace is not None:
+            self.trace.close()
+        self.trace = None
+        if enable:
+            self.trace = trace.TraceRecorder(path, capacity)
+        return self.trace
 
     def i2c_transaction(self, target, wr, read_len):
+        if self.trace is None:
+            return self._i2c_transaction(target, wr, read_len)
+
+        try:
+            written = [target] + list(wr)
+        except TypeError:
+            written = [target] + ([] if wr is None else [wr])
+        self.trace.record(True, bytearray(written), trace.RAW)
+        data = self._i2c_transaction(target, wr, read_len)
+        self.trace.record(False, bytearray(data), trace.RAW)
+        return data
+
+    def _i2c_transaction(self, target, wr, read_len):
         # Make sure Aardvark is in I2C mode
         i2c_mode = self._aa_mode & aardvark_py.AA_CONFIG_I2C_MASK
         if not i2c_mode:
@@ -193,7 +224,6 @@ class Aardvark(bqcomm.CommDevice):
                 )
 
             data = list(data_in)
-            print("RD: " + ' '.join(map('{0:02X}'.format, data)))
             if smb_block:
                 data = data[1:]
 
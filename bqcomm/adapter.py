@@ -31,13 +31,54 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 """
 
 from __future__ import absolute_import
+import collections
 import time
+from concurrent import futures
 
 
 class Error(Exception):
     pass
 
 
+class ResponseTimeout(Error):
+    """The comm device did not answer a request in time"""
+
+    def __init__(self, message="Timeout waiting for response"):
+        super(ResponseTimeout, self).__init__(message)
+
+
+class WriteError(Error):
+    """
+    An earlier asynchronous write failed. It is raised by the next call
+    that waits on the device (or by flush()), either before that call is
+    sent or after it has been carried out, so it says nothing about
+    whether that call itself succeeded.
+    """
+
+
+# Error code -> name, for errors raised as Error(message, code). Adapter
+# drivers add their codes with register_error_names().
+_error_names = {}
+
+
+def register_error_names(names):
+    """Name the error codes in {code: name} for error_name()"""
+    _error_names.update(names)
+
+
+def error_name(exc):
+    """
+    Name of the error code carried by an error from the adapter (NACK,
+    BAD_PEC, ...), "HOST_TIMEOUT" for a ResponseTimeout, or "OTHER" for
+    other errors raised on the host side
+    """
+    if isinstance(exc, ResponseTimeout):
+        return "HOST_TIMEOUT"
+    if len(exc.args) > 1 and isinstance(exc.args[1], int):
+        return _error_names.get(exc.args[1], "UNKNOWN")
+    return "OTHER"
+
+
 class UnsupportedOperation(Error):
     def __init__(self, op):
         msg = "Comm device does not support {operation}".format(operation=op)
@@ -65,6 +106,10 @@ class CommDevice(object):
     I2C_100KHZ = 100
     I2C_400KHZ = 400
 
+    # True if submit_i2c_transaction() returns before the transaction is
+    # done, so several can be in flight at once
+    PIPELINED = False
+
     @classmethod
     def enumerate(cls):
         """Return a list of IDs that can be used to open the adapter"""
@@ -99,6 +144,26 @@ class CommDevice(object):
         """
         raise UnsupportedOperation("I2C")
 
+    def submit_i2c_transaction(self, target, wr, read_len):
+        """
+        Start an I2C transaction and return a Future for its result.
+
+        Devices that cannot pipeline run the transaction before returning.
+        """
+        future = futures.Future()
+        try:
+            future.set_result(self.i2c_transaction(target, wr, read_len))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def flush(self):
+        """
+        Wait for any writes still in progress and raise their errors.
+        Devices whose writes complete before returning have nothing to do.
+        """
+        pass
+
     def enable_pullups(self, enabled):
         raise UnsupportedOperation("pullup control")
 
@@ -128,6 +193,72 @@ class CommDevice(object):
         return type(self).__name__
 
 
+class DeviceWrapper(CommDevice):
+    """
+    Base for CommDevices that wrap another one and change some of its
+    behaviour. Everything not overridden goes to the wrapped `device`.
+    """
+
+    def __init__(self, device):
+        self.device = device
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    # CommDevice defines these, so __getattr__ would never see them
+
+    @property
+    def PIPELINED(self):
+        return self.device.PIPELINED
+
+    def open(self):
+        self.device.open()
+
+    def close(self):
+        self.device.close()
+
+    def i2c_transaction(self, target, wr, read_len):
+        return self.device.i2c_transaction(target, wr, read_len)
+
+    def submit_i2c_transaction(self, target, wr, read_len):
+        return self.device.submit_i2c_transaction(target, wr, read_len)
+
+    def flush(self):
+        self.device.flush()
+
+    def enable_pullups(self, enabled):
+        self.device.enable_pullups(enabled)
+
+    def delay_ms(self, milliseconds):
+        self.device.delay_ms(milliseconds)
+
+    def hdq_read_block(self, addr, length):
+        return self.device.hdq_read_block(addr, length)
+
+    def hdq_write_block(self, addr, data):
+        return self.device.hdq_write_block(addr, data)
+
+    def hdq_break(self):
+        return self.device.hdq_break()
+
+    def dq_read_byte(self, reg_addr):
+        return self.device.dq_read_byte(reg_addr)
+
+    def dq_write_byte(self, reg_addr, data):
+        return self.device.dq_write_byte(reg_addr, data)
+
+    @property
+    def bitrate(self):
+        return self.device.bitrate
+
+    @bitrate.setter
+    def bitrate(self, value):
+        self.device.bitrate = value
+
+    def __repr__(self):
+        return "{0}<{1!r}>".format(type(self).__name__, self.device)
+
+
 class Adapter(object):
 
     @classmethod
@@ -135,7 +266,8 @@ class Adapter(object):
         for dev in CommDevice.enumerate():
             yield Adapter(dev, no_open=True)
 
-    def __init__(self, device=None, no_open=False):
+    def __init__(self, device=None, no_open=False, pacer=None, cache=None,
+                 retry=None):
 
         if device is None:
             devices = CommDevice.enumerate()
@@ -146,6 +278,23 @@ class Adapter(object):
             if not no_open:
                 device.open()
 
+        # Imported here; pacing, retries and caching build on this module
+        if pacer is not None:
+            # With retry policies the pacer leaves retrying to them, so a
+            # read is never retried by both layers
+            from .pacing import PacedDevice
+            device = PacedDevice(
+                device, pacer, retries=0 if retry is not None else None)
+        if retry is not None:
+            # Outside the pacer, which sees and backs off on every failure.
+            # `retry` is {method name: RetryPolicy}, or True for the defaults
+            from .retry import RetryingDevice
+            device = RetryingDevice(device, None if retry is True else retry)
+        if cache is not None:
+            # Outside the pacer, so cache hits are not paced
+            from .cache import CachedDevice
+            device = CachedDevice(device, cache)
+
         self.device = device
 
         self.i2c_transaction = self.device.i2c_transaction
@@ -162,6 +311,9 @@ class Adapter(object):
     def delay_ms(self, milliseconds):
         self.device.delay_ms(milliseconds)
 
+    def flush(self):
+        self.device.flush()
+
     def smb_cmd(self, target_addr, cmd):
         self.i2c_transaction(target_addr, [cmd], 0)
 
@@ -169,8 +321,7 @@ class Adapter(object):
         return self.i2c_transaction(target_addr, [cmd], 1)
 
     def smb_read_word(self, target_addr, cmd):
-        res = self.i2c_transaction(target_addr, [cmd], 2)
-        return res[0] + (res[1] << 8)
+        return _decode_word(self.i2c_transaction(target_addr, [cmd], 2))
 
     def smb_read_block(self, target_addr, cmd):
         return self.i2c_transaction(target_addr, [cmd], None)
@@ -206,3 +357,174 @@ class Adapter(object):
 
     def i2c_write_block(self, target_addr, reg_addr, data):
         self.i2c_transaction(target_addr, [reg_addr] + list(data), 0)
+
+    def batch(self):
+        """
+        Return a Batch for queueing SMBus/I2C operations to run back to back.
+
+        Used as a context manager the batch runs when the block exits and the
+        results are left in `batch.result`:
+
+            with adapter.batch() as b:
+                b.smb_read_word(addr, 0x09)
+                b.smb_read_word(addr, 0x0A)
+            voltage, current = b.result
+
+        On devices that can pipeline (EV2400) up to the device's `window`
+        operations are sent before waiting on the first response; others
+        run them one at a time.
+        """
+        return Batch(self)
+
+
+def _decode_word(res):
+    return res[0] + (res[1] << 8)
+
+
+def _no_result(res):
+    return None
+
+
+class BatchResult(object):
+    """
+    Outcome of a Batch, one entry per operation in the order queued.
+
+    Indexing or iterating gives the values and raises the error of any
+    operation that failed; `values` and `errors` give both without raising.
+    """
+
+    def __init__(self, values, errors):
+        self.values = values
+        self.errors = errors
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if self.errors[index] is not None:
+            raise self.errors[index]
+        return self.values[index]
+
+    def __iter__(self):
+        for index in range(len(self.values)):
+            yield self[index]
+
+    @property
+    def ok(self):
+        return all(e is None for e in self.errors)
+
+    def raise_for_error(self):
+        for e in self.errors:
+            if e is not None:
+                raise e
+
+    def __repr__(self):
+        items = (
+            repr(v) if e is None else "<{0}>".format(e)
+            for v, e in zip(self.values, self.errors)
+        )
+        return "BatchResult([{0}])".format(", ".join(items))
+
+
+class Batch(object):
+    """
+    Queue of SMBus/I2C operations for Adapter.batch(). The queueing methods
+    mirror Adapter's and return the batch, so calls can be chained.
+    """
+
+    def __init__(self, adapter):
+        self.adapter = adapter
+        self.ops = []
+        self.result = None
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def i2c_transaction(self, target_addr, wr, read_len, decode=None):
+        self.ops.append((target_addr, list(wr), read_len, decode))
+        return self
+
+    def smb_cmd(self, target_addr, cmd):
+        return self.i2c_transaction(target_addr, [cmd], 0, _no_result)
+
+    def smb_read_byte(self, target_addr, cmd):
+        return self.i2c_transaction(target_addr, [cmd], 1)
+
+    def smb_read_word(self, target_addr, cmd):
+        return self.i2c_transaction(target_addr, [cmd], 2, _decode_word)
+
+    def smb_read_block(self, target_addr, cmd):
+        return self.i2c_transaction(target_addr, [cmd], None)
+
+    def smb_write_byte(self, target_addr, cmd, data):
+        return self.i2c_transaction(target_addr, [cmd, data], 0, _no_result)
+
+    def smb_write_word(self, target_addr, cmd, data):
+        data = [cmd, data & 0xFF, (data >> 8) & 0xFF]
+        return self.i2c_transaction(target_addr, data, 0, _no_result)
+
+    def smb_write_block(self, target_addr, cmd, data):
+        data = [cmd, len(data)] + list(data)
+        return self.i2c_transaction(target_addr, data, 0, _no_result)
+
+    def i2c_read_block(self, target_addr, reg_addr, length):
+        return self.i2c_transaction(target_addr, [reg_addr], length)
+
+    def i2c_write_block(self, target_addr, reg_addr, data):
+        data = [reg_addr] + list(data)
+        return self.i2c_transaction(target_addr, data, 0, _no_result)
+
+    def execute(self):
+        """Run the queued operations and return a BatchResult"""
+        device = self.adapter.device
+        timeout = getattr(device, "timeout", None)
+
+        # Keep at most a window of operations in flight, collecting the
+        # oldest before sending more, so that a silent adapter times them
+        # out one by one instead of blocking the next send. Non-pipelined
+        # devices complete each operation inside submit_i2c_transaction().
+        window = max(getattr(device, "window", None) or len(self.ops), 1)
+        pending = collections.deque()
+        values = []
+        errors = []
+        for target, wr, read_len, decode in self.ops:
+            if len(pending) >= window:
+                self._collect(pending.popleft(), timeout, values, errors)
+            try:
+                future = device.submit_i2c_transaction(target, wr, read_len)
+            except Exception as e:
+                future = futures.Future()
+                future.set_exception(e)
+            pending.append((future, decode))
+        while pending:
+            self._collect(pending.popleft(), timeout, values, errors)
+
+        self.ops = []
+        self.result = BatchResult(values, errors)
+        return self.result
+
+    @staticmethod
+    def _collect(entry, timeout, values, errors):
+        # Wait for one operation and add its value and error to the lists
+        future, decode = entry
+        try:
+            try:
+                value = future.result(timeout)
+            except futures.TimeoutError:
+                # If the response won the race, cancel() fails and we use it
+                if future.cancel():
+                    raise ResponseTimeout(
+                        "Timeout waiting for batch operation")
+                value = future.result()
+            values.append(decode(value) if decode else value)
+            errors.append(None)
+        except Exception as e:
+            values.append(None)
+            errors.append(e)
@@ -0,0 +1,137 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import asyncio
+import functools
+from concurrent import futures
+
+from .adapter import Adapter, CommDevice, _decode_word
+
+
+class AsyncAdapter(object):
+    """
+    asyncio front end for an Adapter.
+
+    On devices that can pipeline (EV2400) each operation is submitted to the
+    device and its Future is handed to the event loop, so any number of
+    operations, on any number of adapters, can be awaited from one thread.
+    Other devices run operations one at a time on a worker thread.
+
+    Every operation is bounded by `timeout` seconds (default: the device's
+    own timeout) and can be cancelled like any other awaitable.
+    """
+
+    def __init__(self, adapter=None, timeout=None):
+        if adapter is None:
+            adapter = Adapter()
+        elif isinstance(adapter, CommDevice):
+            adapter = Adapter(adapter)
+
+        self.adapter = adapter
+        self.device = adapter.device
+        if timeout is None:
+            timeout = getattr(self.device, "timeout", None)
+        self.timeout = timeout
+
+        self._executor = futures.ThreadPoolExecutor(max_workers=1)
+        self._window = None
+
+    def __repr__(self):
+        return "{0}<{1}>".format(type(self).__name__, repr(self.device))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a blocking call (e.g. `device.get_version`) on the worker"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        return await asyncio.wait_for(
+            loop.run_in_executor(self._executor, call), self.timeout)
+
+    async def open(self):
+        await self.run(self.adapter.open)
+
+    async def close(self):
+        try:
+            await self.run(self.adapter.close)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    async def i2c_transaction(self, target_addr, wr, read_len):
+        if not self.device.PIPELINED:
+            return await self.run(
+                self.device.i2c_transaction, target_addr, wr, read_len)
+
+        # Don't let a full device window block the event loop in submit
+        if self._window is None:
+            self._window = asyncio.Semaphore(
+                max(getattr(self.device, "window", 1), 1))
+
+        async with self._window:
+            future = self.device.submit_i2c_transaction(
+                target_addr, wr, read_len)
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), self.timeout)
+
+    async def smb_cmd(self, target_addr, cmd):
+        await self.i2c_transaction(target_addr, [cmd], 0)
+
+    async def smb_read_byte(self, target_addr, cmd):
+        return await self.i2c_transaction(target_addr, [cmd], 1)
+
+    async def smb_read_word(self, target_addr, cmd):
+        return _decode_word(await self.i2c_transaction(target_addr, [cmd], 2))
+
+    async def smb_read_block(self, target_addr, cmd):
+        return await self.i2c_transaction(target_addr, [cmd], None)
+
+    async def smb_write_byte(self, target_addr, cmd, data):
+        await self.i2c_transaction(target_addr, [cmd, data], 0)
+
+    async def smb_write_word(self, target_addr, cmd, data):
+        data = [cmd, data & 0xFF, (data >> 8) & 0xFF]
+        await self.i2c_transaction(target_addr, data, 0)
+
+    async def smb_write_block(self, target_addr, cmd, data):
+        data = [cmd, len(data)] + list(data)
+        await self.i2c_transaction(target_addr, data, 0)
+
+    async def i2c_read_block(self, target_addr, reg_addr, length):
+        return await self.i2c_transaction(target_addr, [reg_addr], length)
+
+    async def i2c_write_block(self, target_addr, reg_addr, data):
+        await self.i2c_transaction(target_addr, [reg_addr] + list(data), 0)
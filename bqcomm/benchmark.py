@@ -0,0 +1,389 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+
+# Benchmarks for the bqcomm host-side code paths. Run with
+# `python -m bqcomm.benchmark [name ...]`; with no names every benchmark runs.
+# --json prints one JSON document instead of tables, for comparing runs
+# across commits.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import bqcomm
+from .adapter import Adapter
+from .ev2400 import EV2400
+from .ev2400.packet import EV2400Packet, PacketStream, crc8
+from .replay import ReplayDevice
+from . import sim
+
+
+def _crc8_bitwise(data):
+    # Original bit-by-bit EV2400 routine, kept as the reference point
+    crc = data[0]
+    for c in data[1:]:
+        for j in range(8):
+            carry = crc & 0x80
+            crc = (crc << 1) | (c >> 7)
+            crc &= 0xFF
+            if carry:
+                crc ^= 0x07
+            c <<= 1
+            c &= 0xFF
+
+    for j in range(8):
+        carry = crc & 0x80
+        crc <<= 1
+        crc &= 0xFF
+        if carry:
+            crc ^= 0x07
+
+    return crc
+
+
+def _best_us(fn, number, repeat=5):
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def _percentile(ordered, fraction):
+    # Nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1,
+                       int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _latency_row(latencies, elapsed):
+    """Throughput and latency percentiles (us) for a list of call times (s)"""
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "tps": len(ordered) / elapsed if elapsed else 0.0,
+        "p50_us": _percentile(ordered, 0.50) * 1e6,
+        "p95_us": _percentile(ordered, 0.95) * 1e6,
+        "p99_us": _percentile(ordered, 0.99) * 1e6,
+        "max_us": ordered[-1] * 1e6 if ordered else 0.0,
+    }
+
+
+def _time_calls(fn, count):
+    latencies = []
+    clock = time.perf_counter
+    start = clock()
+    for i in range(count):
+        t = clock()
+        fn()
+        latencies.append(clock() - t)
+    return _latency_row(latencies, clock() - start)
+
+
+def bench_crc(sizes=(0, 1, 8, 32, 64, 128, 255), number=2000):
+    """
+    Compare the table-driven CRC against the bit-by-bit routine over the CRC
+    span of packets (tag, ID, retry and length plus the payload) with payloads
+    of `sizes` bytes.
+    """
+    rows = []
+    for size in sizes:
+        data = [0x41, 0x01, 0x00, 0x00, size] + [i & 0xFF for i in range(size)]
+        buf = bytearray(data)
+        assert crc8(buf) == _crc8_bitwise(data)
+
+        old = _best_us(lambda: _crc8_bitwise(data), number)
+        new = _best_us(lambda: crc8(buf), number)
+        rows.append({
+            "payload": size, "bitwise_us": old, "table_us": new,
+            "speedup": old / new,
+        })
+    return rows
+
+
+def bench_packets(count=10000, payload_size=32, chunk=62):
+    """
+    Cost per packet of each EV2400Packet step (build, pack, validate, parse
+    from `chunk`-byte HID reports) and of the whole send and receive paths,
+    with the peak memory of each path over `count` packets.
+    """
+    tag = EV2400Packet.Tags.I2C_TRANSACTION
+    payload = [i & 0xFF for i in range(payload_size)]
+    wire = bytes(EV2400Packet(tag, payload, 1).raw_bytes)
+    reports = [wire[i:i + chunk] for i in range(0, len(wire), chunk)]
+    packed = EV2400Packet(tag, payload, 1)
+    packed.pack()
+
+    def parse():
+        packet = EV2400Packet()
+        for report in reports:
+            packet.add_bytes(report)
+        return packet
+
+    steps = (
+        ("build", lambda: EV2400Packet(tag, payload, 1)),
+        ("pack", packed.pack),
+        ("validate", packed.validate),
+        ("parse", parse),
+    )
+    rows = []
+    for name, fn in steps:
+        rows.append({"step": name, "us_per_packet": _best_us(fn, count // 10),
+                     "peak_kib": None})
+
+    def send():
+        for i in range(count):
+            packet = EV2400Packet(tag, payload)
+            packet.packet_id = i & 0xFFFF
+            packet.pack()
+            packet.validate()
+            packet.raw_bytes
+
+    def receive():
+        for i in range(count):
+            packet = parse()
+            assert packet.complete
+            packet.validate()
+
+    for name, fn in (("send", send), ("receive", receive)):
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # Timing without tracemalloc overhead
+        elapsed = min(timeit.repeat(fn, number=1, repeat=3))
+        rows.append({"step": name, "us_per_packet": elapsed / count * 1e6,
+                     "peak_kib": peak / 1024.0})
+    return rows
+
+
+def bench_send(count=10000, payload_size=255):
+    """
+    Push a `payload_size` byte packet through PacketStream.send_packet
+    `count` times, with a report sink that does nothing.
+    """
+    reports = [0]
+
+    def sink(report):
+        reports[0] += 1
+
+    stream = PacketStream(sink, None)
+    packet = EV2400Packet(
+        EV2400Packet.Tags.SMB_WR_BLOCK, [i & 0xFF for i in range(payload_size)])
+
+    def send():
+        for i in range(count):
+            stream.send_packet(packet)
+
+    best = min(timeit.repeat(send, number=1, repeat=5))
+    return [{
+        "payload": payload_size,
+        "us_per_packet": best / count * 1e6,
+        "reports_per_packet": reports[0] // (5 * count),
+    }]
+
+
+def bench_framing(count=10000, payload_size=8):
+    """
+    PacketStream receive framing: HID reports, each carrying several
+    back-to-back response packets, split into packets and CRC checked.
+    """
+    tag = EV2400Packet.Tags.SMB_RD_WORD[EV2400Packet.Tags.RSP]
+    wire = bytearray()
+    for i in range(count):
+        wire += EV2400Packet(tag, [i & 0xFF] * payload_size, i & 0xFFFF).raw_bytes
+    size = PacketStream.REPORT_SIZE - 2
+    reports = [
+        bytes(bytearray([PacketStream.REPORT_ID, len(wire[i:i + size])]))
+        + bytes(wire[i:i + size]) for i in range(0, len(wire), size)
+    ]
+
+    received = [0]
+
+    def on_packet(packet):
+        received[0] += 1
+
+    def run():
+        stream = PacketStream(None, on_packet)
+        for report in reports:
+            stream.on_data_received(report)
+
+    best = min(timeit.repeat(run, number=1, repeat=5))
+    assert received[0] == 5 * count
+    return [{
+        "packets": count,
+        "reports": len(reports),
+        "us_per_packet": best / count * 1e6,
+        "us_per_report": best / len(reports) * 1e6,
+    }]
+
+
+_GAUGE = sim.Bq40z50.ADDRESS
+_MAC = sim.Bq40z50.MANUFACTURER_BLOCK_ACCESS
+
+
+def _adapter_ops(adapter):
+    # The operations measured by bench_adapter, as (name, callable)
+    block = [0x71, 0x00]
+    return (
+        ("smb_read_word", lambda: adapter.smb_read_word(_GAUGE, 0x09)),
+        ("smb_read_block", lambda: adapter.smb_read_block(_GAUGE, 0x21)),
+        ("smb_write_block",
+         lambda: adapter.smb_write_block(_GAUGE, _MAC, block)),
+        ("i2c_transaction",
+         lambda: adapter.i2c_transaction(_GAUGE, [0x0D], 2)),
+    )
+
+
+def bench_adapter(count=2000):
+    """
+    Transactions per second and p50/p95/p99 latency of Adapter calls on
+    the simulated adapter, the real EV2400 driver over the simulated
+    firmware, and a ReplayDevice answering from a capture of the EV2400
+    run (which is traced while it is measured).
+    """
+    sim_device = sim.SimDevice()
+    sim_device.open()
+
+    ev2400 = EV2400(sim.SimTransport(), no_open=True)
+    ev2400.open()
+
+    capture = tempfile.NamedTemporaryFile(suffix=".bqt", delete=False)
+    capture.close()
+    ev2400.enable_tracing(path=capture.name)
+
+    def replay():
+        ev2400.close()
+        return ReplayDevice(capture.name)
+
+    rows = []
+    try:
+        for device_name, device in (
+            ("sim", lambda: sim_device), ("ev2400-sim", lambda: ev2400),
+            ("replay", replay),
+        ):
+            device = device()
+            adapter = Adapter(device)
+            for op_name, fn in _adapter_ops(adapter):
+                fn()  # warm up
+                row = {"device": device_name, "op": op_name}
+                row.update(_time_calls(fn, count))
+                rows.append(row)
+            device.flush()
+    finally:
+        ev2400.close()
+        os.remove(capture.name)
+    return rows
+
+
+BENCHMARKS = {
+    "crc": bench_crc,
+    "packets": bench_packets,
+    "send": bench_send,
+    "framing": bench_framing,
+    "adapter": bench_adapter,
+}
+
+
+def _format(value):
+    if isinstance(value, float):
+        return "{0:.2f}".format(value)
+    if value is None:
+        return "-"
+    return str(value)
+
+
+def print_table(rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    cells = [[_format(row.get(c)) for c in columns] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells))
+              for i, c in enumerate(columns)]
+    print(" ".join(c.rjust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print(" ".join(v.rjust(w) for v, w in zip(r, widths)))
+
+
+def run(names=None):
+    """Run the named benchmarks (default: all) and return their results"""
+    results = {}
+    for name in names or sorted(BENCHMARKS):
+        results[name] = BENCHMARKS[name]()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="bqcomm benchmarks")
+    parser.add_argument(
+        "names", nargs="*", metavar="name",
+        help="benchmarks to run: {0} (default: all)".format(
+            ", ".join(sorted(BENCHMARKS))))
+    parser.add_argument(
+        "--json", action="store_true",
+        help="print the results as one JSON document")
+    parser.add_argument(
+        "--label", default=None,
+        help="free-form label stored with --json results, e.g. a commit")
+    args = parser.parse_args(argv)
+
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark {0!r}".format(name))
+
+    if args.json:
+        document = {
+            "label": args.label,
+            "time": time.time(),
+            "bqcomm": bqcomm.__version__,
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "results": run(args.names),
+        }
+        json.dump(document, sys.stdout, indent=1, sort_keys=True)
+        print()
+        return
+
+    for name in args.names or sorted(BENCHMARKS):
+        print("== {0} ==".format(name))
+        print_table(BENCHMARKS[name]())
+
+
+if __name__ == "__main__":
+    main()
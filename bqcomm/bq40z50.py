@@ -0,0 +1,235 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import collections
+import struct
+
+from .adapter import Error
+from .cache import STATIC
+
+# SBS command for ManufacturerBlockAccess(): write the 16-bit subcommand as a
+# block, then read the block back as [subcommand LSB, MSB, data...]
+MANUFACTURER_BLOCK_ACCESS = 0x44
+
+# SBS word registers: name -> (command, signed)
+SBS_WORDS = collections.OrderedDict([
+    ("temperature", (0x08, False)),
+    ("voltage", (0x09, False)),
+    ("current", (0x0A, True)),
+    ("average_current", (0x0B, True)),
+    ("max_error", (0x0C, False)),
+    ("rsoc", (0x0D, False)),
+    ("remaining_capacity", (0x0F, False)),
+    ("full_charge_capacity", (0x10, False)),
+    ("cycle_count", (0x17, False)),
+    ("serial_number", (0x1C, False)),
+    ("cell_voltage_4", (0x3C, False)),
+    ("cell_voltage_3", (0x3D, False)),
+    ("cell_voltage_2", (0x3E, False)),
+    ("cell_voltage_1", (0x3F, False)),
+])
+
+# RegisterCache policies for values that only change over charge cycles:
+# serial number, cycle count, full charge capacity and max error. They are
+# only valid for one battery; invalidate the cache when it may have been
+# swapped.
+CACHE_POLICIES = {
+    0x1C: STATIC,
+    0x17: 60,
+    0x10: 60,
+    0x0C: 60,
+}
+
+# `fields` are (name, SBS_WORDS name to read instead, or None) in the order
+# they are packed according to `fmt`
+MacBlock = collections.namedtuple("MacBlock", "subcommand name fmt fields")
+
+DA_STATUS_1 = MacBlock(0x0071, "DAStatus1", "<6H10h", (
+    ("cell_voltage_1", "cell_voltage_1"),
+    ("cell_voltage_2", "cell_voltage_2"),
+    ("cell_voltage_3", "cell_voltage_3"),
+    ("cell_voltage_4", "cell_voltage_4"),
+    ("bat_voltage", "voltage"),
+    ("pack_voltage", None),
+    ("cell_current_1", None),
+    ("cell_current_2", None),
+    ("cell_current_3", None),
+    ("cell_current_4", None),
+    ("cell_power_1", None),
+    ("cell_power_2", None),
+    ("cell_power_3", None),
+    ("cell_power_4", None),
+    ("power", None),
+    ("average_power", None),
+))
+
+# Temperatures in 0.1 K, like SBS Temperature()
+DA_STATUS_2 = MacBlock(0x0072, "DAStatus2", "<7H", (
+    ("int_temperature", None),
+    ("ts1_temperature", None),
+    ("ts2_temperature", None),
+    ("ts3_temperature", None),
+    ("ts4_temperature", None),
+    ("cell_temperature", "temperature"),
+    ("fet_temperature", None),
+))
+
+GAUGE_STATUS_1 = MacBlock(0x0073, "GaugeStatus1", "<16H", (
+    ("true_remaining_capacity", "remaining_capacity"),
+    ("true_remaining_energy", None),
+    ("initial_capacity", None),
+    ("initial_energy", None),
+    ("true_full_charge_capacity", "full_charge_capacity"),
+    ("true_full_charge_energy", None),
+    ("t_sim", None),
+    ("t_ambient", None),
+    ("ra_scale_0", None),
+    ("ra_scale_1", None),
+    ("ra_scale_2", None),
+    ("ra_scale_3", None),
+    ("comp_res_1", None),
+    ("comp_res_2", None),
+    ("comp_res_3", None),
+    ("comp_res_4", None),
+))
+
+BLOCKS = dict((b.name, b) for b in (DA_STATUS_1, DA_STATUS_2, GAUGE_STATUS_1))
+
+
+class UnsupportedBlock(Error):
+    pass
+
+
+def _word(value, signed):
+    if signed and value & 0x8000:
+        value -= 0x10000
+    return value
+
+
+def mac_read(device, address, subcommand):
+    """
+    Read a ManufacturerBlockAccess() block: one block write of the
+    subcommand, one block read. Returns the data after the subcommand echo.
+    """
+    device.smb_write_block(
+        address, MANUFACTURER_BLOCK_ACCESS,
+        [subcommand & 0xFF, (subcommand >> 8) & 0xFF])
+    data = device.smb_read_block(address, MANUFACTURER_BLOCK_ACCESS)
+    if len(data) < 2 or data[0] + (data[1] << 8) != subcommand:
+        raise UnsupportedBlock(
+            "MAC 0x{0:04X} not supported".format(subcommand))
+    return bytes(bytearray(data[2:]))
+
+
+def decode_block(block, data):
+    """Named fields of a MacBlock from its data bytes"""
+    size = struct.calcsize(block.fmt)
+    if len(data) < size:
+        raise UnsupportedBlock("{0} block too short: {1} of {2} bytes".format(
+            block.name, len(data), size))
+    values = struct.unpack_from(block.fmt, data)
+    return collections.OrderedDict(
+        (name, value) for (name, _), value in zip(block.fields, values))
+
+
+class Telemetry(object):
+    """
+    Telemetry snapshots from a bq40z50 at `address` on `device` (a
+    CommDevice or Adapter).
+
+    Each MAC block costs one block write and one block read, however many
+    fields it holds. The default, DAStatus1 alone, is two transactions for
+    the pack and cell voltages and the power; every further block or word
+    adds to that. If the gauge does not support a block (wrong echo or
+    too short), the fields that have an SBS equivalent are read word by word
+    instead and the rest are None; the block is not tried again on this
+    Telemetry. Bus errors are raised as usual. Extra SBS words are read
+    back to back, pipelined where the device allows it.
+    """
+
+    def __init__(self, device, address, blocks=(DA_STATUS_1,), words=()):
+        self.device = device
+        self.address = address
+        self.blocks = [BLOCKS[b] if isinstance(b, str) else b for b in blocks]
+        self.words = list(words)
+        self.unsupported = set()
+
+    def read_words(self, names):
+        """{name: value} for SBS_WORDS `names`"""
+        cmds = [SBS_WORDS[name] for name in names]
+        submit = getattr(self.device, "submit_smb_read_word", None)
+        if submit is not None:
+            timeout = getattr(self.device, "timeout", None)
+            pending = [submit(self.address, cmd) for cmd, _ in cmds]
+            raw = [future.result(timeout) for future in pending]
+        else:
+            raw = [self.device.smb_read_word(self.address, cmd)
+                   for cmd, _ in cmds]
+        return collections.OrderedDict(
+            (name, _word(value, signed))
+            for name, (_, signed), value in zip(names, cmds, raw))
+
+    def read_block(self, block, words=None):
+        """
+        Fields of one MacBlock, falling back to SBS words if unsupported.
+        Words read for the fallback are added to the `words` dict if given.
+        """
+        if block.subcommand not in self.unsupported:
+            try:
+                data = mac_read(self.device, self.address, block.subcommand)
+                return decode_block(block, data)
+            except UnsupportedBlock:
+                self.unsupported.add(block.subcommand)
+
+        if words is None:
+            words = {}
+        fallback = [sbs for _, sbs in block.fields
+                    if sbs is not None and sbs not in words]
+        if fallback:
+            words.update(self.read_words(fallback))
+        return collections.OrderedDict(
+            (name, words.get(sbs) if sbs is not None else None)
+            for name, sbs in block.fields)
+
+    def snapshot(self):
+        """One dict with the fields of every block and the extra words"""
+        result = collections.OrderedDict()
+        words = {}
+        for block in self.blocks:
+            result.update(self.read_block(block, words))
+        missing = [name for name in self.words if name not in words]
+        if missing:
+            words.update(self.read_words(missing))
+        for name in self.words:
+            result[name] = words[name]
+        return result
@@ -0,0 +1,287 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import threading
+import time
+from concurrent import futures
+
+from .adapter import DeviceWrapper, Error
+
+# Cache policies; any number is a time to live in seconds
+STATIC = "static"
+NEVER = "never"
+
+# Writes to these registers (ManufacturerAccess and ManufacturerBlockAccess
+# on TI gauges) can reset or shut down the gauge, so they clear everything
+# cached for the target. They are never cached themselves.
+CONTROL_REGISTERS = frozenset([0x00, 0x44])
+
+# Device read methods taking (target, register, ...): name -> kind of read,
+# which with any further arguments is part of the cache key
+_READS = {
+    "smb_read_byte": "byte",
+    "smb_read_word": "word",
+    "smb_read_block": "block",
+    "i2c_read_block": "i2c",
+}
+
+_WRITES = frozenset([
+    "smb_cmd", "smb_write_byte", "smb_write_word", "smb_write_block",
+    "i2c_write_block",
+])
+
+
+def _copy(value):
+    return list(value) if isinstance(value, list) else value
+
+
+class RegisterCache(object):
+    """
+    Cached register values with a policy per register: STATIC (kept until
+    invalidated), NEVER, or a time to live in seconds.
+
+    `policies` maps a register, or a (target, register) pair, to its policy;
+    other registers get `default`. A write to a register drops what is
+    cached for it, a write to one of `control_registers` or a failed read
+    drops everything cached for that target (the battery may have been
+    reset, shut down or swapped).
+
+    inspection.inspect() clears the gauge's entries before it starts, so
+    an inspection always reads the battery in front of it; the cache only
+    saves bus time for reads made between inspections.
+    """
+
+    def __init__(self, policies=None, default=NEVER,
+                 control_registers=CONTROL_REGISTERS):
+        self.default = default
+        self.control_registers = frozenset(control_registers)
+        self._policies = dict(policies or {})
+        # (target, register) -> {kind: (value, expiry or None)}
+        self._entries = {}
+        # Bumped on every invalidation, so a read that was in flight across
+        # one does not store a stale value
+        self._generation = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.by_register = {}
+
+    def set_policy(self, register, policy, target=None):
+        key = register if target is None else (target, register)
+        with self._lock:
+            self._policies[key] = policy
+            self._drop(target, register)
+
+    def policy(self, target, register):
+        if register in self.control_registers:
+            return NEVER
+        policy = self._policies.get((target, register))
+        if policy is None:
+            policy = self._policies.get(register, self.default)
+        return policy
+
+    def _count(self, target, register, hit):
+        counts = self.by_register.setdefault((target, register), [0, 0])
+        counts[0 if hit else 1] += 1
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def get(self, target, register, kind):
+        """(True, value) on a hit, (False, generation) on a miss"""
+        with self._lock:
+            if self.policy(target, register) != NEVER:
+                entry = self._entries.get((target, register), {}).get(kind)
+                if entry is not None:
+                    value, expiry = entry
+                    if expiry is None or time.monotonic() < expiry:
+                        self._count(target, register, True)
+                        return True, _copy(value)
+                self._count(target, register, False)
+            return False, self._generation
+
+    def put(self, target, register, kind, value, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            policy = self.policy(target, register)
+            if policy == NEVER:
+                return
+            expiry = None if policy == STATIC else time.monotonic() + policy
+            self._entries.setdefault((target, register), {})[kind] = (
+                _copy(value), expiry)
+
+    def _drop(self, target, register=None):
+        self._generation += 1
+        self.invalidations += 1
+        if target is None:
+            keys = [k for k in self._entries if k[1] == register]
+        elif register is None:
+            keys = [k for k in self._entries if k[0] == target]
+        else:
+            keys = [(target, register)]
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def invalidate(self, target=None, register=None):
+        """
+        Drop cached values: one register of a target, all of a target, a
+        register on every target, or everything if neither is given.
+        """
+        with self._lock:
+            if target is None and register is None:
+                self._generation += 1
+                self.invalidations += 1
+                self._entries.clear()
+            else:
+                self._drop(target, register)
+
+    def written(self, target, register):
+        """Note a write to `register` of `target`"""
+        if register in self.control_registers:
+            self.invalidate(target)
+        else:
+            self.invalidate(target, register)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": sum(len(e) for e in self._entries.values()),
+            }
+
+
+class CachedDevice(DeviceWrapper):
+    """
+    CommDevice wrapper that answers register reads from a RegisterCache.
+
+    Reads are plain register reads: i2c_transaction() writing one byte and
+    reading back, and the smb_read_* methods. Any transaction that writes
+    data invalidates the register it writes to.
+    """
+
+    def __init__(self, device, cache=None):
+        super(CachedDevice, self).__init__(device)
+        self.cache = cache if cache is not None else RegisterCache()
+
+    def _read(self, fn, target, register, kind, *args):
+        hit, value = self.cache.get(target, register, kind)
+        if hit:
+            return value
+        generation = value
+        try:
+            value = fn(target, *args)
+        except Error:
+            self.cache.invalidate(target)
+            raise
+        self.cache.put(target, register, kind, value, generation)
+        return value
+
+    def __getattr__(self, name):
+        attr = super(CachedDevice, self).__getattr__(name)
+        cache = self.cache
+
+        if name in _READS:
+            def read(target, cmd, *args):
+                kind = (_READS[name],) + args
+                return self._read(attr, target, cmd, kind, cmd, *args)
+            read.__name__ = name
+            return read
+
+        if name in _WRITES:
+            def write(target, cmd, *args):
+                try:
+                    return attr(target, cmd, *args)
+                finally:
+                    cache.written(target, cmd)
+            write.__name__ = name
+            return write
+
+        if name == "submit_smb_read_word":
+            def submit(target, cmd):
+                hit, value = cache.get(target, cmd, ("word",))
+                if hit:
+                    future = futures.Future()
+                    future.set_result(value)
+                    return future
+                future = attr(target, cmd)
+                self._store_when_done(future, target, cmd, ("word",), value)
+                return future
+            submit.__name__ = name
+            return submit
+
+        return attr
+
+    def _store_when_done(self, future, target, register, kind, generation):
+        def done(f):
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                if isinstance(f.exception(), Error):
+                    self.cache.invalidate(target)
+                return
+            self.cache.put(target, register, kind, f.result(), generation)
+        future.add_done_callback(done)
+
+    def i2c_transaction(self, target, wr, read_len):
+        if read_len != 0 and len(wr) == 1:
+            return self._read(self.device.i2c_transaction, target, wr[0],
+                              read_len, [wr[0]], read_len)
+        try:
+            return self.device.i2c_transaction(target, wr, read_len)
+        finally:
+            if wr:
+                self.cache.written(target, wr[0])
+
+    def submit_i2c_transaction(self, target, wr, read_len):
+        if read_len != 0 and len(wr) == 1:
+            hit, value = self.cache.get(target, wr[0], read_len)
+            if hit:
+                future = futures.Future()
+                future.set_result(value)
+                return future
+            future = self.device.submit_i2c_transaction(target, wr, read_len)
+            self._store_when_done(future, target, wr[0], read_len, value)
+            return future
+
+        future = self.device.submit_i2c_transaction(target, wr, read_len)
+        if wr:
+            self.cache.written(target, wr[0])
+        return future
@@ -35,21 +35,47 @@ from __future__ import print_function
 
 from __future__ import absolute_import
 import atexit
+import collections
+import threading
+import time
+from concurrent import futures
 
 import bqcomm
+from bqcomm import metrics, trace
+from bqcomm.adapter import (ResponseTimeout, WriteError, error_name,
+                            register_error_names)
 
-from pywinusb import hid
-
+from . import transport
 from .packet import EV2400Packet, PacketStream
 import six
 
-try:
-    import queue
-except ImportError:
-    import six.moves.queue as queue
-
 Tags = EV2400Packet.Tags
 
+
+def _chain(future, fn):
+    # Future for fn(result of `future`); cancelling it cancels `future`
+    chained = futures.Future()
+
+    def done(f):
+        if f.cancelled():
+            chained.cancel()
+            return
+        try:
+            result = fn(f.result())
+        except Exception as e:
+            EV2400._resolve(chained, exc=e)
+        else:
+            EV2400._resolve(chained, result)
+
+    chained.add_done_callback(lambda c: c.cancelled() and future.cancel())
+    future.add_done_callback(done)
+    return chained
+
+
+# Errors from the EV2400 carry a Tags.Err code
+register_error_names(Tags.Err.names)
+
+
 class EV2400(bqcomm.CommDevice):
 
     USB_VID_PID = (0x0451, 0x0037)
@@ -57,15 +83,28 @@ class EV2400(bqcomm.CommDevice):
 
     I2C_CLK_BASE_KHZ = 4000
 
+    PIPELINED = True
+
+    # Default number of requests that may be awaiting a response at once
+    WINDOW = 8
+
+    # How many timed out packet IDs to remember, to tell late responses
+    # apart from ones we never asked for
+    EXPIRED_HISTORY = 64
+
+    # Asynchronous writes allowed before a write waits for the earlier
+    # ones to complete
+    MAX_UNACKED_WRITES = 64
+
     @classmethod
     def list_hid_devices(cls, bsl=False):
+        """Transports for the attached EV2400s, from every HID backend"""
         if bsl:
             vid, pid = cls.USB_BSL_VID_PID
         else:
             vid, pid = cls.USB_VID_PID
 
-        fil = hid.HidDeviceFilter(vendor_id=vid, product_id=pid)
-        return fil.get_devices()
+        return transport.find_devices(vid, pid)
 
     @classmethod
     def enumerate(cls):
@@ -73,6 +112,10 @@ class EV2400(bqcomm.CommDevice):
             yield cls(dev, no_open=True)
 
     def __init__(self, device=None, no_open=False):
+        """
+        `device` is an index into list_hid_devices(), a Transport, a
+        /dev/hidrawN path or a pywinusb HID device.
+        """
 
         if device is None:
             device = 0
@@ -82,13 +125,50 @@ class EV2400(bqcomm.CommDevice):
                 device = EV2400.list_hid_devices()[device]
             except IndexError:
                 raise bqcomm.Error("No EV2400 at index {0}".format(device))
+        elif isinstance(device, six.string_types):
+            device = transport.HidrawTransport(device)
+        elif not isinstance(device, transport.Transport):
+            device = transport.PyWinUsbTransport(device)
 
         self.device = device
         self.is_open = False
         atexit.register(self.close)
 
-        self.resp_queue = queue.Queue()
         self.timeout = 2.0
+        self.window = EV2400.WINDOW
+
+        # Writes that expect no response return at once and report any
+        # error at the next synchronous transaction or flush()
+        self.async_writes = True
+
+        # Value for the RETRY field of packets that do not set their own:
+        # how many times the EV2400 firmware retries a failed bus
+        # transaction before answering with an error
+        self.firmware_retries = 0
+
+        # Outstanding requests: packet ID -> (Future, send sequence number),
+        # with asynchronous writes kept apart, in send order, in _unacked.
+        # _lock guards the tables and is shared with the HID receive thread;
+        # _send_lock keeps each packet's reports together on the wire.
+        self._pending = {}
+        self._unacked = collections.OrderedDict()
+        self._write_errors = []
+        self._send_seq = 0
+        self._expired = collections.deque(maxlen=EV2400.EXPIRED_HISTORY)
+        self._lock = threading.Lock()
+        self._slot_free = threading.Condition(self._lock)
+        self._send_lock = threading.Lock()
+
+        self.timeouts = 0
+        self.late_responses = 0
+        self.orphaned_responses = 0
+
+        # DeviceMetrics, or None for no per-transaction metrics. open()
+        # picks up the process-wide registry if bqcomm.metrics is enabled.
+        self.metrics = None
+
+        # TraceRecorder for every packet sent and received, or None
+        self.trace = None
 
         self._last_packet_id = 0
         self._bitrate = None
@@ -97,8 +177,12 @@ class EV2400(bqcomm.CommDevice):
             self.open()
 
     def _next_packet_id(self):
-        self._last_packet_id = (self._last_packet_id + 1) & 0xFFFF
-        return self._last_packet_id
+        # Called with _lock held
+        packet_id = (self._last_packet_id + 1) & 0xFFFF
+        while packet_id in self._pending or packet_id in self._unacked:
+            packet_id = (packet_id + 1) & 0xFFFF
+        self._last_packet_id = packet_id
+        return packet_id
 
     @property
     def bitrate(self):
@@ -117,11 +201,19 @@ class EV2400(bqcomm.CommDevice):
         if self.is_open:
             return
 
-        self.device.open(shared=False)
+        self.device.open()
         self.is_open = True
 
-        out_report = self.device.find_output_reports()[0]
-        self.packetstream = PacketStream(out_report.send, self.packet_received)
+        if self.metrics is None:
+            self.metrics = metrics.for_device(
+                "ev2400", self.device.serial_number)
+
+        self.packetstream = PacketStream(
+            self.device.send,
+            self.packet_received,
+            self.device.report_size
+        )
+        self.packetstream.trace = self.trace
         self.device.set_raw_data_handler(self.packetstream)
 
         if self._bitrate is None:
@@ -131,37 +223,225 @@ class EV2400(bqcomm.CommDevice):
         if self.is_open:
             self.device.close()
             self.is_open = False
+            if self.trace is not None:
+                self.trace.close()
+
+        with self._lock:
+            pending = [f for f, seq in self._pending.values()]
+            pending += [f for f, seq in self._unacked.values()]
+            self._pending.clear()
+            self._unacked.clear()
+            self._slot_free.notify_all()
+        for future in pending:
+            self._resolve(future, exc=bqcomm.Error("EV2400 was closed"))
+
+    @property
+    def in_flight(self):
+        """Number of requests awaiting a response"""
+        return len(self._pending)
+
+    @property
+    def unacked_writes(self):
+        """Number of asynchronous writes not yet known to have completed"""
+        return len(self._unacked)
+
+    def _ack_writes(self, seq):
+        # Called with _lock held. The EV2400 handles packets in order, so
+        # once something sent at `seq` is answered every write sent before
+        # it has been done.
+        acked = []
+        while self._unacked:
+            packet_id, (future, write_seq) = next(iter(self._unacked.items()))
+            if write_seq >= seq:
+                break
+            del self._unacked[packet_id]
+            acked.append(future)
+        return acked
 
     def packet_received(self, packet):
-        self.resp_queue.put_nowait(packet)
+        with self._lock:
+            entry = self._pending.pop(packet.packet_id, None)
+            if entry is not None:
+                self._slot_free.notify()
+            else:
+                entry = self._unacked.pop(packet.packet_id, None)
+
+            if entry is None:
+                if packet.packet_id in self._expired:
+                    self.late_responses += 1
+                    reason = "late"
+                else:
+                    self.orphaned_responses += 1
+                    reason = "orphaned"
+                if self.metrics is not None:
+                    self.metrics.unmatched(reason)
+                return
+
+            future, seq = entry
+            acked = self._ack_writes(seq)
+
+        for write in acked:
+            self._resolve(write)
+
+        if packet.ok:
+            self._resolve(future, packet)
+        else:
+            # The error code is last; SMB_ERROR puts the address before it
+            try:
+                code = packet.payload[-1]
+            except IndexError:
+                code = -1
+            self._resolve(future, exc=bqcomm.Error(packet.error, code))
 
-    def do_transaction(self, packet, get_resp=True):
-        # Future Improvement: Use packet IDs and be smarter about the queue
-        # Should at least check response tag
-        packet.packet_id = self._next_packet_id()
-        packet.pack()
-        packet.validate()
-        self.packetstream.send_packet(packet)
+    @staticmethod
+    def _resolve(future, result=None, exc=None):
+        # The waiter may have given up and cancelled the future already
         try:
-            resp = self.resp_queue.get(
-                True, self.timeout if get_resp else 0.025)
-            resp.payload = list(resp.payload)  # Don't use ReadOnlyList type
-        except queue.Empty:
-            if get_resp:
-                raise bqcomm.Error("Timeout waiting for EV2400 response")
+            if exc is None:
+                future.set_result(result)
             else:
-                return None
+                future.set_exception(exc)
+        except futures.InvalidStateError:
+            pass
+
+    def _retire(self, packet_id, future):
+        with self._lock:
+            entry = self._pending.get(packet_id)
+            if entry is not None and entry[0] is future:
+                del self._pending[packet_id]
+                self._expired.append(packet_id)
+                self._slot_free.notify()
+
+    def _track(self, packet, future, expect_response):
+        # Count the request and, when it completes, its latency or error
+        device_metrics = self.metrics
+        tag = Tags.get_name(packet.tag)
+        device_metrics.request(tag)
+        sent = time.monotonic()
+
+        def done(f):
+            if f.cancelled():
+                return
+            exc = f.exception()
+            if exc is None:
+                if expect_response:
+                    device_metrics.response(tag, time.monotonic() - sent)
+            else:
+                device_metrics.error(tag, error_name(exc))
 
-        assert resp.packet_id == packet.packet_id
-        resp.validate()
+        future.add_done_callback(done)
 
-        if resp.error:
+    def _write_done(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        with self._lock:
+            self._write_errors.append(future.exception())
+
+    def submit(self, packet, expect_response=True):
+        """
+        Send `packet` and return a Future for its response packet.
+
+        Up to `window` requests can be outstanding; past that this blocks
+        until a response (or a cancellation) frees a slot, and raises
+        ResponseTimeout if none does within `timeout`. Cancelling the
+        Future abandons the request, and a response that arrives afterwards
+        is dropped and counted in `late_responses`.
+
+        With `expect_response=False` the packet is a write that only gets an
+        answer if it fails. It does not take a window slot; its Future
+        resolves to None once a later packet is answered, or to the error.
+        """
+        future = futures.Future()
+        with self._send_lock:
+            with self._lock:
+                deadline = None
+                while (
+                    expect_response
+                    and len(self._pending) >= max(self.window, 1)
+                ):
+                    # A silent adapter never frees a slot; don't hang on it
+                    if deadline is None:
+                        deadline = time.monotonic() + self.timeout
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise ResponseTimeout(
+                            "Timeout waiting for a free EV2400 request slot")
+                    self._slot_free.wait(remaining)
+                packet_id = self._next_packet_id()
+                self._send_seq += 1
+                if expect_response:
+                    self._pending[packet_id] = (future, self._send_seq)
+                else:
+                    self._unacked[packet_id] = (future, self._send_seq)
+
+            if expect_response:
+                future.add_done_callback(
+                    lambda f: self._retire(packet_id, f))
+            else:
+                future.add_done_callback(self._write_done)
+            packet.packet_id = packet_id
+            if self.firmware_retries and not packet.retry_count:
+                packet.retry_count = self.firmware_retries
+            packet.pack()
+            if self.metrics is not None:
+                self._track(packet, future, expect_response)
             try:
-                code = resp.payload[0]
-            except IndexError:
-                code = -1
-            raise bqcomm.Error(resp.error, code)
+                self.packetstream.send_packet(packet)
+            except Exception:
+                with self._lock:
+                    self._pending.pop(packet_id, None)
+                    self._unacked.pop(packet_id, None)
+                    self._slot_free.notify()
+                future.cancel()
+                raise
+
+        return future
+
+    def _raise_write_errors(self):
+        with self._lock:
+            errors = self._write_errors
+            self._write_errors = []
+        if errors:
+            # Report the first failure; the rest most likely followed from it
+            raise WriteError(*errors[0].args)
+
+    def flush(self):
+        """
+        Wait until every asynchronous write has been carried out, then raise
+        the first error any of them reported since the last check.
+        """
+        if self._unacked:
+            # Anything answered after the writes proves they are done
+            self.do_transaction(EV2400Packet(Tags.GET_VERSION))
+        self._raise_write_errors()
+
+    def do_transaction(self, packet, get_resp=True):
+        if not get_resp and self.async_writes:
+            self.submit(packet, expect_response=False)
+            if len(self._unacked) >= EV2400.MAX_UNACKED_WRITES:
+                self.flush()
+            return None
+
+        # Errors from earlier asynchronous writes belong to the caller
+        self._raise_write_errors()
 
+        future = self.submit(packet)
+        try:
+            resp = future.result(self.timeout if get_resp else 0.025)
+        except futures.TimeoutError:
+            # If the response won the race, cancel() fails and we use it
+            if not future.cancel():
+                resp = future.result()
+            elif get_resp:
+                self.timeouts += 1
+                if self.metrics is not None:
+                    self.metrics.timeout(Tags.get_name(packet.tag))
+                raise ResponseTimeout("Timeout waiting for EV2400 response")
+            else:
+                return None
+
+        self._raise_write_errors()
         return resp
 
     def get_version(self):
@@ -188,7 +468,7 @@ class EV2400(bqcomm.CommDevice):
 
     def get_board_name(self):
         resp = self.do_transaction(EV2400Packet(Tags.BOARD_NAME))
-        return resp.payload
+        return list(resp.payload)
 
     def set_board_name(self, name, auto=True):
         if auto:
@@ -224,16 +504,25 @@ class EV2400(bqcomm.CommDevice):
             get_resp=False
         )
 
-    def smb_read(self, tag, address, cmd):
-        # Untested
-        r = self.do_transaction(EV2400Packet(tag, [address, cmd]))
+    @staticmethod
+    def _smb_read_data(r):
         if len(r.payload) < 3:
             raise bqcomm.Error("Malformed response packet")
         if r.payload[-1] == 0:
-            return r.payload[1:-1]
+            return list(r.payload[1:-1])
         else:
             raise bqcomm.Error("SMB Error Status " + str(r.payload[2]))
 
+    def smb_read(self, tag, address, cmd):
+        # Untested
+        r = self.do_transaction(EV2400Packet(tag, [address, cmd]))
+        return self._smb_read_data(r)
+
+    def submit_smb_read(self, tag, address, cmd):
+        """Pipelined smb_read(); returns a Future for the data bytes"""
+        future = self.submit(EV2400Packet(tag, [address, cmd]))
+        return _chain(future, self._smb_read_data)
+
     def smb_read_byte(self, address, cmd):
         # Untested
         return self.smb_read(Tags.SMB_RD_BYTE, address, cmd)[0]
@@ -243,6 +532,11 @@ class EV2400(bqcomm.CommDevice):
         data = self.smb_read(Tags.SMB_RD_WORD, address, cmd)
         return data[0] + data[1] * 0x100
 
+    def submit_smb_read_word(self, address, cmd):
+        """Pipelined smb_read_word(); returns a Future for the word"""
+        future = self.submit_smb_read(Tags.SMB_RD_WORD, address, cmd)
+        return _chain(future, lambda data: data[0] + data[1] * 0x100)
+
     def smb_read_block(self, address, cmd):
         return self.smb_read(Tags.SMB_RD_BLOCK, address, cmd)[1:]
 
@@ -288,20 +582,28 @@ class EV2400(bqcomm.CommDevice):
             raise bqcomm.Error("Malformed response packet")
 
         if r.payload[-1] == 0:
-            return r.payload[2:-1]
+            return list(r.payload[2:-1])
         else:
             raise bqcomm.Error("I2C Error Status " + str(r.payload[-1]))
 
-    def i2c_transaction(self, target_addr, wr, read_len):
+    @staticmethod
+    def _i2c_transaction_packet(target_addr, wr, read_len):
         flags = 0
         if read_len is None:
             read_len = 0
             flags |= 0x01
-        r = self.do_transaction(EV2400Packet(
+        return EV2400Packet(
             Tags.I2C_TRANSACTION,
-            [target_addr, flags, read_len, len(wr)] + wr
-        ))
-        return r.payload
+            [target_addr, flags, read_len, len(wr)] + list(wr)
+        )
+
+    def i2c_transaction(self, target_addr, wr, read_len):
+        packet = self._i2c_transaction_packet(target_addr, wr, read_len)
+        return list(self.do_transaction(packet).payload)
+
+    def submit_i2c_transaction(self, target_addr, wr, read_len):
+        packet = self._i2c_transaction_packet(target_addr, wr, read_len)
+        return _chain(self.submit(packet), lambda r: list(r.payload))
 
     def i2c_write_block(self, target_addr, reg_addr, data):
         # Untested
@@ -322,7 +624,7 @@ class EV2400(bqcomm.CommDevice):
             raise bqcomm.Error("Malformed response packet")
 
         if len(r.payload):
-            return r.payload[1:r.payload[0]+1]
+            return list(r.payload[1:r.payload[0]+1])
         else:
             raise bqcomm.Error("HDQ Read returned no bytes")
 
@@ -355,8 +657,21 @@ class EV2400(bqcomm.CommDevice):
         ), False)
         return True
 
-    def enable_tracing(self, enable=True):
-        self.packetstream.enable_tracing = enable
+    def enable_tracing(self, enable=True, path=None, capacity=4096):
+        """
+        Record the packets sent and received in a bqcomm.trace.TraceRecorder,
+        kept in `trace`. With a `path` they go to that capture file (read it
+        back with bqcomm.trace.Capture); otherwise the last `capacity` stay
+        in memory.
+        """
+        if self.trace is not None:
+            self.trace.close()
+        self.trace = None
+        if enable:
+            self.trace = trace.TraceRecorder(path, capacity)
+        if self.is_open:
+            self.packetstream.trace = self.trace
+        return self.trace
 
     def set_pwm(self, duty, period=None):
         settings = []
@@ -379,4 +694,4 @@ class EV2400(bqcomm.CommDevice):
 
     def get_board_type(self):
         resp = self.do_transaction(EV2400Packet(Tags.BOARD_TYPE))
-        return resp.payload
+        return list(resp.payload)
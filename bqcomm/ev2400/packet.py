@@ -33,10 +33,11 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 from __future__ import print_function
 
 from __future__ import absolute_import
-import datetime
 import struct
 import sys
 
+from .. import trace
+
 
 def struct_pack_list(*args, **kwargs):
     ret = struct.pack(*args, **kwargs)
@@ -47,6 +48,58 @@ def struct_pack_list(*args, **kwargs):
     return list(ord(x) for x in ret)
 
 
+CRC8_POLY = 0x07  # Poly for EV2400
+
+
+def _make_crc8_table(poly):
+    table = bytearray(256)
+    for i in range(256):
+        crc = i
+        for j in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ poly) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+
+_CRC8_TABLE = _make_crc8_table(CRC8_POLY)
+
+
+def crc8(data, crc=0):
+    """
+    Return the EV2400 CRC-8 of `data`, continuing from `crc`.
+
+    `data` may be a list of ints, `bytes`, `bytearray` or `memoryview`. This
+    is the same value the bit-by-bit EV2400 routine produces (the message is
+    shifted through the register and flushed with 8 zero bits), computed one
+    table lookup per byte.
+    """
+    table = _CRC8_TABLE
+    for c in data:
+        crc = table[crc ^ c]
+    return crc
+
+
+class Crc8(object):
+    """Incremental EV2400 CRC-8, for updating a CRC as bytes arrive"""
+
+    __slots__ = ("value",)
+
+    def __init__(self, data=None, crc=0):
+        self.value = crc
+        if data is not None:
+            self.update(data)
+
+    def update(self, data):
+        self.value = crc8(data, self.value)
+        return self
+
+    def copy(self):
+        return Crc8(crc=self.value)
+
+
 class InvalidPacketException(Exception):
     pass
 
@@ -67,6 +120,10 @@ class EV2400Packet(object):
     PREAMBLE_SIZE = PLEN + 1
     POSTAMBLE_SIZE = 2
     METADATA_SIZE = PREAMBLE_SIZE + POSTAMBLE_SIZE
+    MAX_PAYLOAD_SIZE = 0xFF
+    MAX_SIZE = METADATA_SIZE + MAX_PAYLOAD_SIZE
+
+    __slots__ = ("_buf", "_view", "_len", "total_length", "complete")
 
     class Tags:
 
@@ -159,6 +216,9 @@ class EV2400Packet(object):
                 UNSPECIFIED: "Unspecified error occurred",
             }
 
+            # Error code -> name, filled in by Tags.build_registry()
+            names = {}
+
             @classmethod
             def get_name(cls, tag, payload):
                 if tag == EV2400Packet.Tags.SMB_ERROR[EV2400Packet.Tags.RSP]:
@@ -166,42 +226,52 @@ class EV2400Packet(object):
                 else:
                     idx = 0
                 if idx < len(payload):
-                    code = payload[idx]
-                    for name, err_code in cls.__dict__.items():
-                        if name == name.upper() and err_code == code:
-                            return name
+                    return cls.names.get(payload[idx], "UNKNOWN")
                 return "UNKNOWN"
 
+        # Lookup tables, filled in once at import by build_registry()
+        by_tag = {}  # int tag -> (tag, response_tag)
+        tuple_names = {}  # (tag, response_tag) -> name
+        names = {}  # int tag -> name
+        responses = {}  # command tag -> response tag
+        error_tags = frozenset()
+
         @classmethod
-        def get_tag(cls, int_tag):
-            for name, item in cls.__dict__.items():
+        def build_registry(cls):
+            """Index the tag and error code definitions for O(1) lookups"""
+            for name, item in list(cls.__dict__.items()):
                 if (
                     isinstance(item, tuple)
                     and len(item) == 2
                     and name == name.upper()
                 ):
-                    match = None
+                    # First definition wins, as with the old linear scan
+                    cls.tuple_names.setdefault(item, name)
                     for x in item:
-                        if x == int_tag and match is None:
-                            match = True
-                        elif (
-                            not isinstance(x, int)
-                            and not isinstance(x, type(None))
-                        ):
-                            match = False
+                        if x is not None:
+                            cls.by_tag.setdefault(x, item)
+                    if item[cls.CMD] is not None:
+                        cls.responses[item[cls.CMD]] = item[cls.RSP]
+
+            for int_tag, item in cls.by_tag.items():
+                cls.names[int_tag] = cls.tuple_names[item]
 
-                    if match:
-                        return item
+            cls.error_tags = frozenset(
+                (cls.ERROR[cls.RSP], cls.SMB_ERROR[cls.RSP]))
+
+            for name, code in cls.Err.__dict__.items():
+                if name == name.upper() and isinstance(code, int):
+                    cls.Err.names.setdefault(code, name)
+
+        @classmethod
+        def get_tag(cls, int_tag):
+            return cls.by_tag.get(int_tag)
 
         @classmethod
         def get_name(cls, tag):
-            if not isinstance(tag, tuple):
-                tag = cls.get_tag(tag)
-            if tag is not None:
-                for name, item in cls.__dict__.items():
-                    if name == name.upper() and tag == item:
-                        return name
-            return "UNKNOWN"
+            if isinstance(tag, tuple):
+                return cls.tuple_names.get(tag, "UNKNOWN")
+            return cls.names.get(tag, "UNKNOWN")
 
     class Handler(object):
         def __init__(self, cmd_or_resp):
@@ -231,24 +301,19 @@ class EV2400Packet(object):
                 self.handlers[tag] = lambda x, y: None
 
     def __init__(self, tag=None, payload=None, packet_id=None, retry=None):
-        self.raw_bytes = []
+        # One buffer sized for the largest packet holds the whole wire image;
+        # the fields below are read from and written to it in place.
+        self._buf = bytearray(EV2400Packet.MAX_SIZE)
+        self._view = memoryview(self._buf)
+        self._len = 0
         self.total_length = None
         self.complete = False
         if (
-            tag is None
-            and payload is None
-            and packet_id is None
-            and retry is None
+            tag is not None
+            or payload is not None
+            or packet_id is not None
+            or retry is not None
         ):
-            self.header = None
-            self.tag = None
-            self.packet_id = None
-            self.retry_count = None
-            self.payload_length = None
-            self.payload = None
-            self.crc = None
-            self.trailer = None
-        else:
             if payload is None:
                 payload = []
             if packet_id is None:
@@ -257,133 +322,164 @@ class EV2400Packet(object):
                 retry = 0
             self.set(tag, payload, packet_id, retry)
 
+    def _get_byte(self, index):
+        if self._len > index:
+            return self._buf[index]
+        return None
+
+    def _put_byte(self, index, value, name):
+        if value is None or value < 0 or value > 0xFF:
+            raise InvalidPacketException(
+                "{0} {1} must be in the range 0-255".format(name, value))
+        self._buf[index] = value
+
+    @property
+    def header(self):
+        return self._get_byte(EV2400Packet.HDR)
+
+    @property
+    def tag(self):
+        return self._get_byte(EV2400Packet.TAG)
+
+    @tag.setter
+    def tag(self, tag):
+        self._put_byte(EV2400Packet.TAG, tag, "Tag")
+
+    @property
+    def packet_id(self):
+        if self._len > EV2400Packet.PID_H:
+            buf = self._buf
+            return buf[EV2400Packet.PID_L] | (buf[EV2400Packet.PID_H] << 8)
+        return None
+
+    @packet_id.setter
+    def packet_id(self, packet_id):
+        if packet_id is None or packet_id < 0 or packet_id > 0xFFFF:
+            msg = "Packet ID {0} must be in the range 0-65535"
+            raise InvalidPacketException(msg.format(packet_id))
+        self._buf[EV2400Packet.PID_L] = packet_id & 0xFF
+        self._buf[EV2400Packet.PID_H] = packet_id >> 8
+
+    @property
+    def retry_count(self):
+        return self._get_byte(EV2400Packet.RETRY)
+
+    @retry_count.setter
+    def retry_count(self, retry):
+        self._put_byte(EV2400Packet.RETRY, retry, "Retry Count")
+
+    @property
+    def payload_length(self):
+        return self._get_byte(EV2400Packet.PLEN)
+
+    @property
+    def payload(self):
+        """Read-only view of the payload bytes (None until complete)"""
+        if self.total_length is None or self._len != self.total_length:
+            return None
+        end = self._len - EV2400Packet.POSTAMBLE_SIZE
+        return self._view[EV2400Packet.PAYLD:end].toreadonly()
+
+    @payload.setter
+    def payload(self, payload):
+        length = len(payload)
+        if length > EV2400Packet.MAX_PAYLOAD_SIZE:
+            raise InvalidPacketException("Max payload size is 255 bytes")
+        end = EV2400Packet.PAYLD + length
+        try:
+            self._buf[EV2400Packet.PAYLD:end] = payload
+        except (TypeError, ValueError):
+            raise InvalidPacketException(
+                "Payload values must be in range 0-255")
+        self._buf[EV2400Packet.PLEN] = length
+        self._buf[end + 1] = EV2400Packet.TRAILER
+        self.total_length = self._len = end + EV2400Packet.POSTAMBLE_SIZE
+
+    @property
+    def crc(self):
+        if self.total_length is None or self._len != self.total_length:
+            return None
+        return self._buf[self._len + EV2400Packet.CRC]
+
+    @property
+    def trailer(self):
+        if self.total_length is None or self._len != self.total_length:
+            return None
+        return self._buf[self._len + EV2400Packet.TLR]
+
+    @property
+    def raw_bytes(self):
+        """View of the bytes that make up the packet so far"""
+        return self._view[:self._len]
+
     def set(self, tag, payload=[], packet_id=0, retry=0):
-        self.header = EV2400Packet.HEADER
         if isinstance(tag, tuple):
             tag = tag[EV2400Packet.Tags.CMD]
-        self.tag = tag
-        self.packet_id = packet_id
-        self.retry_count = retry
-        self.payload_length = len(payload)
-        self.payload = payload[:]
-        self.crc = 0
-        self.trailer = EV2400Packet.TRAILER
+        try:
+            struct.pack_into(
+                "<BBHB", self._buf, 0,
+                EV2400Packet.HEADER, tag, packet_id, retry
+            )
+        except struct.error:
+            # Go through the setters to report which field was bad
+            self.tag = tag
+            self.packet_id = packet_id
+            self.retry_count = retry
+            raise
+        self.payload = payload
+        self.complete = False
         self.pack()
-        self.validate()
         return self
 
     def pack(self, no_crc_recalc=False):
-        self.raw_bytes = struct_pack_list(
-            "<BBHBB",
-            self.header,
-            self.tag,
-            self.packet_id,
-            self.retry_count,
-            self.payload_length
-        )
-
-        self.raw_bytes += self.payload + [self.crc, self.trailer]
         if not no_crc_recalc:
-            self.crc = self.calc_crc()
-            self.raw_bytes[EV2400Packet.CRC] = self.crc
-        self.total_length = len(self.raw_bytes)
+            self._buf[self._len + EV2400Packet.CRC] = self.calc_crc()
 
     def add_bytes(self, data):
-        pre_bytes = max(0, EV2400Packet.PREAMBLE_SIZE - len(self.raw_bytes))
-        self.raw_bytes.extend(data[:pre_bytes])
-        if len(self.raw_bytes) >= EV2400Packet.PREAMBLE_SIZE:
-            self.total_length = EV2400Packet.METADATA_SIZE + \
-                self.raw_bytes[EV2400Packet.PLEN]
-        self.raw_bytes = (
-            self.raw_bytes + data[pre_bytes:])[:self.total_length]
-        if len(self.raw_bytes) == self.total_length:
-            self.complete = True
-            self.header = self.raw_bytes[EV2400Packet.HDR]
-            self.tag = self.raw_bytes[EV2400Packet.TAG]
-            self.packet_id = self.raw_bytes[EV2400Packet.PID_L]
-            self.packet_id += self.raw_bytes[EV2400Packet.PID_H] << 8
-            self.retry_count = self.raw_bytes[EV2400Packet.RETRY]
-            self.payload_length = self.raw_bytes[EV2400Packet.PLEN]
-            self.payload = self.raw_bytes[EV2400Packet.PAYLD:EV2400Packet.CRC]
-            self.crc = self.raw_bytes[EV2400Packet.CRC]
-            self.trailer = self.raw_bytes[EV2400Packet.TLR]
-
-            # TODO: This does not fail gracefully
-            # self.validate()
+        """
+        Append received bytes until the packet is complete. Returns the number
+        of bytes consumed from `data`; anything past the end of the packet is
+        left for the caller.
+        """
+        used = 0
+        avail = len(data)
+        while not self.complete and used < avail:
+            end = self.total_length or EV2400Packet.PREAMBLE_SIZE
+            n = min(end - self._len, avail - used)
+            self._buf[self._len:self._len + n] = data[used:used + n]
+            self._len += n
+            used += n
+            if self.total_length is None:
+                if self._len == EV2400Packet.PREAMBLE_SIZE:
+                    self.total_length = EV2400Packet.METADATA_SIZE + \
+                        self._buf[EV2400Packet.PLEN]
+            elif self._len == self.total_length:
+                self.complete = True
+
+        return used
 
     def validate(self):
-        if self.header != EV2400Packet.HEADER:
+        if self.total_length is None or self._len != self.total_length:
+            raise InvalidPacketException("Packet is incomplete")
+
+        buf = self._buf
+        if buf[EV2400Packet.HDR] != EV2400Packet.HEADER:
             raise InvalidPacketException(
                 "Header was not " + hex(EV2400Packet.HEADER))
 
-        if self.trailer != EV2400Packet.TRAILER:
+        if buf[self._len + EV2400Packet.TLR] != EV2400Packet.TRAILER:
             raise InvalidPacketException(
                 "Trailer was not " + hex(EV2400Packet.TRAILER))
 
-        if (
-            self.retry_count is None
-            or self.retry_count < 0
-            or self.retry_count > 0xFF
-        ):
-            raise InvalidPacketException("Retry Count must be in range 0-255")
-
-        if self.payload is None:
-            raise InvalidPacketException("Payload was None")
-
-        if len(self.payload):
-            if max(self.payload) > 0xFF or min(self.payload) < 0:
-                raise InvalidPacketException(
-                    "Payload values must be in range 0-255")
-
-        if len(self.payload) > 0xFF:
-            raise InvalidPacketException("Max payload size is 255 bytes")
-
-        if self.payload_length != len(self.payload or []):
-            raise InvalidPacketException(
-                "Payload length ({0}) did not match actual ({1})".format(
-                    self.payload_length, len(self.payload or [])
-                )
-            )
-
-        if self.tag is None or self.tag < 0 or self.tag > 0xFF:
-            raise InvalidPacketException(
-                "Tag {0} must be in the range 0-255".format(self.tag))
-
-        if (
-            self.packet_id is None
-            or self.packet_id < 0
-            or self.packet_id > 0xFFFF
-        ):
-            msg = "Packet ID {0} must be in the range 0-65535"
-            raise InvalidPacketException(msg.format(self.packet_id))
-
-        if self.crc != self.calc_crc():
+        crc = self.calc_crc()
+        if buf[self._len + EV2400Packet.CRC] != crc:
             msg = "CRC ({0}) is incorrect (shoule be {1})"
             raise InvalidPacketException(
-                msg.format(self.crc, self.calc_crc())
-            )
+                msg.format(buf[self._len + EV2400Packet.CRC], crc))
 
     def calc_crc(self):
-        data = self.raw_bytes[EV2400Packet.TAG:EV2400Packet.CRC]
-        crc = data[0]
-        for c in data[1:]:
-            for j in range(8):
-                carry = crc & 0x80
-                crc = (crc << 1) | (c >> 7)
-                crc &= 0xFF
-                if carry:
-                    crc ^= 0x07  # Poly for EV2400
-                c <<= 1
-                c &= 0xFF
-
-        for j in range(8):
-            carry = crc & 0x80
-            crc <<= 1
-            crc &= 0xFF
-            if carry:
-                crc ^= 0x07
-
-        return crc
+        end = self._len - EV2400Packet.POSTAMBLE_SIZE
+        return crc8(self._view[EV2400Packet.TAG:end])
 
     def __str__(self):
         tag_len = 21
@@ -409,11 +505,8 @@ class EV2400Packet(object):
 
     @property
     def ok(self):
-        error_tags = [
-            EV2400Packet.Tags.ERROR[EV2400Packet.Tags.RSP],
-            EV2400Packet.Tags.SMB_ERROR[EV2400Packet.Tags.RSP]
-        ]
-        return self.tag is not None and self.tag not in error_tags
+        tag = self.tag
+        return tag is not None and tag not in EV2400Packet.Tags.error_tags
 
     @property
     def error(self):
@@ -422,80 +515,239 @@ class EV2400Packet(object):
         if not len(self.payload):
             raise InvalidPacketException("Error packet had no error code")
         error_code = self.payload[-1]
-        try:
-            return EV2400Packet.Tags.Err.message[error_code]
-        except KeyError:
+        message = EV2400Packet.Tags.Err.message.get(error_code)
+        if message is None:
             return "Unknown error code {0:02X}".format(error_code)
+        return message
 
     def response(self, payload):
-        tags = EV2400Packet.Tags
-        resp_tag = tags.get_tag(self.tag)[tags.RSP]
+        resp_tag = EV2400Packet.Tags.responses[self.tag]
         return EV2400Packet(resp_tag, payload, self.packet_id)
 
 
+EV2400Packet.Tags.build_registry()
+
+
 class PacketStream(object):
 
-    def __init__(self, send_raw_data, on_packet_received):
+    REPORT_ID = 0x3F
+
+    # Room for a maximum size packet that is still arriving plus the reports
+    # that follow it
+    RX_BUFFER_SIZE = 2 * EV2400Packet.MAX_SIZE
+
+    # HID report size including the report ID and byte count
+    REPORT_SIZE = 64
+
+    def __init__(self, send_raw_data, on_packet_received, report_size=None):
         self.on_packet_received = on_packet_received
-        self.partial_packet = None
         self.send_raw_data = send_raw_data
-        self.enable_tracing = False
 
-    def on_data_received(self, data):
-        if not len(data):
-            return
+        # TraceRecorder for the packets in both directions, or None
+        self.trace = None
 
-        if self.partial_packet is None:
-            self.partial_packet = EV2400Packet()
+        if report_size is None:
+            report_size = PacketStream.REPORT_SIZE
+        self.report_size = report_size
 
-        assert data[0] == 0x3F
-        assert data[1] <= len(data) - 2
+        # Outgoing report, refilled for every chunk. send_raw_data must be
+        # done with it (pywinusb copies it) by the time it returns.
+        self._tx_report = bytearray(report_size)
+        self._tx_report[0] = PacketStream.REPORT_ID
+        self._tx_zeros = memoryview(bytes(report_size))
 
-        if data[1] == 0:
-            if self.enable_tracing:
-                print("GOT EMPTY USB PACKET")
-            return
+        # Receive buffer. Unparsed bytes live in [_rx_start, _rx_end); the
+        # buffer is rewound whenever it drains and compacted when a report
+        # would run off the end.
+        self._rx = bytearray(PacketStream.RX_BUFFER_SIZE)
+        self._rx_view = memoryview(self._rx)
+        self._rx_start = 0
+        self._rx_end = 0
 
-        if len(self.partial_packet.raw_bytes) == 0:
-            if data[2] != EV2400Packet.HEADER:
-                if self.enable_tracing:
-                    print("GOT GARBAGE DATA (don't see header)")
-                return
+        self.rx_packets = 0
+        self.rx_bad_reports = 0
+        self.rx_discarded_bytes = 0
+        self.rx_resyncs = 0
 
-        self.partial_packet.add_bytes(data[2:data[1] + 2])
-        if self.partial_packet.complete:
+    @property
+    def enable_tracing(self):
+        return self.trace is not None
+
+    @enable_tracing.setter
+    def enable_tracing(self, enable):
+        # Kept for old callers; an in-memory recorder of the latest packets
+        if not enable:
+            self.trace = None
+        elif self.trace is None:
+            self.trace = trace.TraceRecorder()
+
+    def reset(self):
+        """Drop any partially received data"""
+        self._discard(self._rx_start, self._rx_end - self._rx_start)
+        self._rx_start = self._rx_end = 0
+
+    def on_data_received(self, data):
+        """
+        Handle one HID input report. Every packet completed by the report is
+        passed to `on_packet_received` and returned as a list.
+        """
+        if not len(data):
+            return []
 
-            packet = self.partial_packet
-            self.log_packet(packet, False)
-            self.partial_packet = None
+        if (
+            len(data) < 2
+            or data[0] != PacketStream.REPORT_ID
+            or data[1] > len(data) - 2
+        ):
+            self.rx_bad_reports += 1
+            if self.trace is not None:
+                self.trace.record(False, data, trace.BAD_REPORT)
+            return []
+
+        count = data[1]
+        if count == 0:
+            return []
+
+        self._rx_append(data[2:count + 2])
+        packets = self._parse()
+
+        for packet in packets:
+            if self.trace is not None:
+                self.trace.record(False, packet.raw_bytes)
             if self.on_packet_received:
                 self.on_packet_received(packet)
 
-    def send_packet(self, packet):
+        return packets
+
+    def _rx_append(self, data):
+        count = len(data)
+        if self._rx_end + count > PacketStream.RX_BUFFER_SIZE:
+            pending = self._rx_end - self._rx_start
+            if pending + count > PacketStream.RX_BUFFER_SIZE:
+                # Can only happen if we are stuck waiting on a bogus header;
+                # give up on the oldest bytes.
+                drop = pending + count - PacketStream.RX_BUFFER_SIZE
+                self._discard(self._rx_start, drop)
+                self._rx_start += drop
+                pending -= drop
+            self._rx[:pending] = self._rx[self._rx_start:self._rx_end]
+            self._rx_start = 0
+            self._rx_end = pending
+
+        self._rx[self._rx_end:self._rx_end + count] = data
+        self._rx_end += count
+
+    def _discard(self, start, count):
+        if count <= 0:
+            return
+        self.rx_discarded_bytes += count
+        self.rx_resyncs += 1
+        if self.trace is not None:
+            self.trace.record(
+                False, self._rx_view[start:start + count], trace.DISCARD)
+
+    def _check_frame(self, start, end):
+        """
+        Look for a packet at `start`. Returns its length if a complete packet
+        with a good trailer and CRC is there, 0 if one may be there but has not
+        fully arrived yet, or -1 if there is none.
+        """
+        buf = self._rx
+        avail = end - start
+        if buf[start] != EV2400Packet.HEADER:
+            return -1
 
-        psz = 62
+        if (
+            avail > EV2400Packet.TAG
+            and buf[start + EV2400Packet.TAG] not in EV2400Packet.Tags.names
+        ):
+            return -1
+
+        if avail < EV2400Packet.PREAMBLE_SIZE:
+            return 0
+
+        length = EV2400Packet.METADATA_SIZE + buf[start + EV2400Packet.PLEN]
+        if avail < length:
+            return 0
+
+        if buf[start + length + EV2400Packet.TLR] != EV2400Packet.TRAILER:
+            return -1
+
+        crc_end = start + length + EV2400Packet.CRC
+        crc = crc8(self._rx_view[start + EV2400Packet.TAG:crc_end])
+        if buf[crc_end] != crc:
+            return -1
+
+        return length
+
+    def _find_frame(self, start, end):
+        # Index of the first complete, valid packet in [start, end), or -1
+        buf = self._rx
+        while True:
+            start = buf.find(EV2400Packet.HEADER, start, end)
+            if start < 0 or self._check_frame(start, end) > 0:
+                return start
+            start += 1
+
+    def _parse(self):
+        packets = []
+        buf = self._rx
+        start = self._rx_start
+        end = self._rx_end
+
+        while start < end:
+            length = self._check_frame(start, end)
+            if length > 0:
+                packet = EV2400Packet()
+                packet.add_bytes(self._rx_view[start:start + length])
+                packets.append(packet)
+                start += length
+                continue
+
+            if length == 0:
+                # Incomplete. Normally we wait for the rest, but if a complete
+                # packet already follows, this was a false header.
+                nxt = self._find_frame(start + 1, end)
+                if nxt < 0:
+                    break
+            else:
+                nxt = buf.find(EV2400Packet.HEADER, start + 1, end)
+                if nxt < 0:
+                    nxt = end
+
+            self._discard(start, nxt - start)
+            start = nxt
+
+        if start == end:
+            start = end = 0
+        self._rx_start = start
+        self._rx_end = end
+        self.rx_packets += len(packets)
+        return packets
+
+    def send_packet(self, packet):
         data = packet.raw_bytes
-        if not data:
+        size = len(data)
+        if not size:
             return
 
-        self.log_packet(packet, True)
+        if self.trace is not None:
+            self.trace.record(True, data)
 
-        while len(data):
-            buf = data[:psz]
-            data = data[psz:]
-            buf = [0x3f, len(buf)] + buf + [0] * (psz - len(buf))
-            if self.enable_tracing:
-                print("sending data: ", ' '.join('%02X' % x for x in buf))
-            self.send_raw_data(buf)
+        # Fill the one report buffer from slices of the packet's memoryview
+        report = self._tx_report
+        chunk = self.report_size - 2
+        for offset in range(0, size, chunk):
+            n = min(chunk, size - offset)
+            report[1] = n
+            report[2:2 + n] = data[offset:offset + n]
+            if n < chunk:
+                report[2 + n:] = self._tx_zeros[2 + n:]
+            self.send_raw_data(report)
 
     def log_packet(self, packet, outgoing):
-        if not self.enable_tracing:
-            return
-
-        log = datetime.datetime.now().strftime("%m/%d/%y %H:%M:%S.%f ")
-        log += "--> " if outgoing else "<-- "
-        log += str(packet)
-        print(log)
+        if self.trace is not None:
+            self.trace.record(outgoing, packet.raw_bytes)
 
     # Map call of this to data handler
     __call__ = on_data_received
@@ -0,0 +1,279 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import errno
+import glob
+import logging
+import os
+import selectors
+import threading
+
+import bqcomm
+
+try:
+    from pywinusb import hid
+except ImportError:
+    hid = None
+
+_LOGGER = logging.getLogger("bqcomm")
+
+
+class Transport(object):
+    """
+    Carries HID reports between the EV2400 driver and the adapter.
+
+    Input reports, report ID first, go to the handler given to
+    set_raw_data_handler(); send() writes one output report.
+    """
+
+    report_size = 64
+    serial_number = None
+
+    @classmethod
+    def find(cls, vid, pid):
+        """Transports for every attached device with this VID/PID"""
+        return []
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def set_raw_data_handler(self, handler):
+        raise NotImplementedError
+
+    def send(self, report):
+        raise NotImplementedError
+
+
+class PyWinUsbTransport(Transport):
+    """Windows HID through pywinusb"""
+
+    def __init__(self, device):
+        self.device = device
+        self.serial_number = device.serial_number
+        self._out_report = None
+
+    @classmethod
+    def find(cls, vid, pid):
+        if hid is None:
+            return []
+        fil = hid.HidDeviceFilter(vendor_id=vid, product_id=pid)
+        return [cls(device) for device in fil.get_devices()]
+
+    @property
+    def report_size(self):
+        return self.device.hid_caps.output_report_byte_length
+
+    def open(self):
+        self.device.open(shared=False)
+        self._out_report = self.device.find_output_reports()[0]
+
+    def close(self):
+        self.device.close()
+
+    def set_raw_data_handler(self, handler):
+        self.device.set_raw_data_handler(handler)
+
+    def send(self, report):
+        self._out_report.send(report)
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self.serial_number)
+
+
+class HidrawTransport(Transport):
+    """
+    Linux HID through /dev/hidrawN.
+
+    The node is opened non-blocking and a single thread waits on it with a
+    selector (epoll on Linux), handing each report straight to the handler.
+    `device` may also be an open file descriptor, such as one end of a
+    SOCK_SEQPACKET socketpair standing in for the adapter; it is closed
+    with the transport.
+    """
+
+    SYSFS_ROOT = "/sys/class/hidraw"
+
+    # Largest read; hidraw returns one report per read()
+    READ_SIZE = 4096
+
+    # Seconds a send waits for the node to accept a report
+    SEND_TIMEOUT = 1.0
+
+    def __init__(self, device, serial_number=None, report_size=None):
+        self.device = device
+        self.serial_number = serial_number
+        if report_size is not None:
+            self.report_size = report_size
+
+        self.fd = None
+        self.error = None
+        self._handler = None
+        self._wake_r = self._wake_w = None
+        self._thread = None
+        self._send_selector = None
+
+    @classmethod
+    def find(cls, vid, pid):
+        found = []
+        for node in sorted(glob.glob(os.path.join(cls.SYSFS_ROOT, "hidraw*"))):
+            ids = cls._read_uevent(os.path.join(node, "device", "uevent"))
+            hid_id = ids.get("HID_ID", "").split(":")
+            try:
+                if int(hid_id[1], 16) != vid or int(hid_id[2], 16) != pid:
+                    continue
+            except (IndexError, ValueError):
+                continue
+            path = os.path.join("/dev", os.path.basename(node))
+            found.append(cls(path, ids.get("HID_UNIQ") or None))
+        return found
+
+    @staticmethod
+    def _read_uevent(path):
+        values = {}
+        try:
+            with open(path) as f:
+                for line in f:
+                    key, _, value = line.strip().partition("=")
+                    values[key] = value
+        except (IOError, OSError):
+            pass
+        return values
+
+    def open(self):
+        if isinstance(self.device, int):
+            self.fd = self.device
+            os.set_blocking(self.fd, False)
+        else:
+            try:
+                self.fd = os.open(self.device, os.O_RDWR | os.O_NONBLOCK)
+            except OSError as e:
+                raise bqcomm.Error("Cannot open {0}: {1}".format(
+                    self.device, e.strerror))
+
+        self.error = None
+        self._wake_r, self._wake_w = os.pipe()
+        self._send_selector = selectors.DefaultSelector()
+        self._send_selector.register(self.fd, selectors.EVENT_WRITE)
+        self._thread = threading.Thread(
+            target=self._run, name="bqcomm-hidraw-{0}".format(self.device))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        if self.fd is None:
+            return
+        os.write(self._wake_w, b"x")
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._send_selector.close()
+        for fd in (self.fd, self._wake_r, self._wake_w):
+            os.close(fd)
+        self.fd = None
+
+    def set_raw_data_handler(self, handler):
+        self._handler = handler
+
+    def send(self, report):
+        if self.fd is None:
+            raise bqcomm.Error("hidraw transport is not open")
+        if self.error is not None:
+            raise bqcomm.Error("hidraw device failed: {0}".format(self.error))
+
+        data = bytes(report)
+        while True:
+            try:
+                os.write(self.fd, data)
+                return
+            except BlockingIOError:
+                if not self._send_selector.select(self.SEND_TIMEOUT):
+                    raise bqcomm.Error("Timeout writing to {0}".format(
+                        self.device))
+            except OSError as e:
+                raise bqcomm.Error("hidraw write failed: {0}".format(
+                    e.strerror))
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self.fd, selectors.EVENT_READ)
+        selector.register(self._wake_r, selectors.EVENT_READ)
+        try:
+            while True:
+                for key, _ in selector.select():
+                    if key.fd == self._wake_r:
+                        return
+                    if not self._read_reports():
+                        return
+        finally:
+            selector.close()
+
+    def _read_reports(self):
+        # Drain the node; False once it is gone (unplugged)
+        while True:
+            try:
+                report = os.read(self.fd, self.READ_SIZE)
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                self.error = e.strerror
+                _LOGGER.warning("hidraw read failed on %s: %s",
+                                self.device, e.strerror)
+                return False
+
+            if not report:
+                self.error = "end of file"
+                return False
+            handler = self._handler
+            if handler is not None:
+                try:
+                    handler(report)
+                except Exception:
+                    _LOGGER.exception("EV2400 report handler failed")
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self.device)
+
+
+# Backends tried by find_devices(), in order
+TRANSPORTS = [PyWinUsbTransport, HidrawTransport]
+
+
+def find_devices(vid, pid):
+    devices = []
+    for transport in TRANSPORTS:
+        devices.extend(transport.find(vid, pid))
+    return devices
@@ -0,0 +1,287 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import bisect
+import os
+import threading
+
+# Round-trip time buckets in seconds; +Inf is implied
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+)
+
+# The process-wide registry; None while metrics are disabled
+_registry = None
+
+
+def enable():
+    """Turn metrics on for adapters opened from now on; returns the registry"""
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
+
+
+def disable():
+    global _registry
+    _registry = None
+
+
+def registry():
+    """The process-wide Registry, or None if metrics are disabled"""
+    return _registry
+
+
+def for_device(kind, adapter):
+    """DeviceMetrics for one adapter, or None if metrics are disabled"""
+    if _registry is None:
+        return None
+    return _registry.device(kind, adapter)
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return (str(value).replace("\\", "\\\\").replace("\n", "\\n")
+            .replace('"', '\\"'))
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(
+        '{0}="{1}"'.format(k, _escape(v)) for k, v in items) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Counter(object):
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram(object):
+    """Fixed-bucket histogram; `buckets` are the upper bounds, ascending"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """
+        Cumulative counts per finite upper bound, as in the Prometheus
+        format; the +Inf bucket is "count"
+        """
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        cumulative = []
+        running = 0
+        for bound, n in zip(self.buckets, counts):
+            running += n
+            cumulative.append((bound, running))
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+
+class Registry(object):
+    """
+    Named counters and histograms, each kept per set of labels.
+
+    Instruments are created on first use and live as long as the registry.
+    """
+
+    def __init__(self, prefix="bqcomm_"):
+        self.prefix = prefix
+        self._metrics = {}  # name -> (type, help, {labels: instrument})
+        self._lock = threading.Lock()
+
+    def _get(self, kind, name, help, labels, factory):
+        key = _labels(labels)
+        with self._lock:
+            entry = self._metrics.get(name)
+            if entry is None:
+                entry = self._metrics[name] = (kind, help, {})
+            elif entry[0] != kind:
+                raise ValueError(
+                    "{0} is a {1}, not a {2}".format(name, entry[0], kind))
+            instrument = entry[2].get(key)
+            if instrument is None:
+                instrument = entry[2][key] = factory()
+            return instrument
+
+    def counter(self, name, help="", **labels):
+        return self._get("counter", name, help, labels, Counter)
+
+    def histogram(self, name, help="", buckets=LATENCY_BUCKETS, **labels):
+        return self._get(
+            "histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def device(self, kind, adapter):
+        return DeviceMetrics(self, kind, adapter)
+
+    def snapshot(self):
+        """
+        {name: [{"labels": {...}, "value": n}]} for counters, and the
+        Histogram.snapshot() fields in place of "value" for histograms
+        """
+        with self._lock:
+            metrics = [(name, dict(entry[2]))
+                       for name, entry in self._metrics.items()]
+        result = {}
+        for name, instruments in sorted(metrics):
+            samples = []
+            for labels, instrument in sorted(instruments.items()):
+                sample = {"labels": dict(labels)}
+                value = instrument.snapshot()
+                if isinstance(value, dict):
+                    sample.update(value)
+                else:
+                    sample["value"] = value
+                samples.append(sample)
+            result[self.prefix + name] = samples
+        return result
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = [(name, entry[0], entry[1], dict(entry[2]))
+                       for name, entry in self._metrics.items()]
+        lines = []
+        for name, kind, help, instruments in sorted(metrics):
+            name = self.prefix + name
+            if help:
+                lines.append("# HELP {0} {1}".format(name, help))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            for labels, instrument in sorted(instruments.items()):
+                value = instrument.snapshot()
+                if kind == "counter":
+                    lines.append("{0}{1} {2}".format(
+                        name, _format_labels(labels), value))
+                    continue
+                buckets = value["buckets"] + [(float("inf"), value["count"])]
+                for bound, count in buckets:
+                    lines.append("{0}_bucket{1} {2}".format(
+                        name,
+                        _format_labels(labels, [("le", _format_value(bound))]),
+                        count))
+                lines.append("{0}_sum{1} {2}".format(
+                    name, _format_labels(labels), _format_value(value["sum"])))
+                lines.append("{0}_count{1} {2}".format(
+                    name, _format_labels(labels), value["count"]))
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Write prometheus() to `path`, replacing it in one step so a
+        node_exporter textfile collector never reads half a file
+        """
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmp, "w") as f:
+            f.write(self.prometheus())
+        os.rename(tmp, path)
+
+
+class DeviceMetrics(object):
+    """
+    The per-transaction metrics of one adapter, labelled with its `kind`
+    (e.g. "ev2400") and `adapter` (its serial number), and with the packet
+    tag name of each request.
+    """
+
+    def __init__(self, registry, kind, adapter):
+        self.registry = registry
+        self.labels = {"kind": kind, "adapter": adapter or "unknown"}
+        self._requests = {}
+        self._latency = {}
+
+    def request(self, tag):
+        counter = self._requests.get(tag)
+        if counter is None:
+            counter = self._requests[tag] = self.registry.counter(
+                "requests_total", "Requests sent to the adapter",
+                tag=tag, **self.labels)
+        counter.inc()
+
+    def response(self, tag, seconds):
+        histogram = self._latency.get(tag)
+        if histogram is None:
+            histogram = self._latency[tag] = self.registry.histogram(
+                "round_trip_seconds",
+                "Time from sending a request to its response",
+                tag=tag, **self.labels)
+        histogram.observe(seconds)
+
+    def error(self, tag, error):
+        """A request answered with an error; `error` names its class"""
+        self.registry.counter(
+            "errors_total", "Requests answered with an error",
+            tag=tag, error=error, **self.labels).inc()
+
+    def timeout(self, tag):
+        self.registry.counter(
+            "timeouts_total", "Requests given up on with no response",
+            tag=tag, **self.labels).inc()
+
+    def unmatched(self, reason):
+        """A response for no outstanding request: "late" or "orphaned" """
+        self.registry.counter(
+            "unmatched_responses_total", "Responses to no pending request",
+            reason=reason, **self.labels).inc()
@@ -0,0 +1,225 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import collections
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Event kinds
+ADAPTER_UP = "adapter_up"
+ADAPTER_DOWN = "adapter_down"
+BATTERY_INSERTED = "battery_inserted"
+BATTERY_REMOVED = "battery_removed"
+
+Event = collections.namedtuple("Event", "kind time detail")
+
+
+def _direct(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+def _disconnect(handle):
+    # SharedAdapters are released, so other users of the device carry on
+    release = getattr(handle, "release", None)
+    try:
+        if release is not None:
+            release()
+        else:
+            handle.close()
+    except Exception:
+        pass
+
+
+class HealthMonitor(object):
+    """
+    One poll loop for adapter liveness and battery presence.
+
+    Each tick costs a single bus transaction while things are healthy: a
+    word read of `register` from the gauge at `address`, whose success
+    also proves the adapter is alive. Only when that read fails is the
+    adapter itself probed (get_version() where the device has one). With
+    no adapter, `connect()` is called to open one; it should return an
+    Adapter, SharedAdapter or CommDevice, or raise.
+
+    The interval starts at `min_interval` and is multiplied by `backoff`
+    after every tick that changed nothing, up to `max_interval`. Any change
+    of state, or poke(), brings it back to `min_interval`.
+
+    Subscribers are called with an Event on the monitor's thread for every
+    change: ADAPTER_UP, ADAPTER_DOWN, BATTERY_INSERTED or BATTERY_REMOVED.
+    Probes run through `call(fn, *args)`, e.g. an IOWorker's call, so they
+    can be serialised with other bus traffic.
+    """
+
+    def __init__(self, connect, address, register=0x09, min_interval=0.5,
+                 max_interval=4.0, backoff=2.0, call=None,
+                 disconnect=_disconnect):
+        self.connect = connect
+        self.address = address
+        self.register = register
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.call = call if call is not None else _direct
+        self.disconnect = disconnect
+
+        self.adapter = None
+        self.battery_present = False
+        self.interval = min_interval
+        self.ticks = 0
+        self.transactions = 0
+
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    @property
+    def adapter_up(self):
+        return self.adapter is not None
+
+    def subscribe(self, callback):
+        """Call `callback(event)` on every change; returns an unsubscriber"""
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+        return unsubscribe
+
+    def _publish(self, kind, detail=None):
+        event = Event(kind, time.time(), detail)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("Monitor subscriber failed on %s", kind)
+
+    @staticmethod
+    def _device(handle):
+        return getattr(handle, "device", handle)
+
+    def _read_battery(self):
+        self.transactions += 1
+        self._device(self.adapter).smb_read_word(self.address, self.register)
+
+    def _adapter_alive(self):
+        get_version = getattr(self._device(self.adapter), "get_version", None)
+        if get_version is None:
+            return True
+        self.transactions += 1
+        try:
+            get_version()
+            return True
+        except Exception:
+            return False
+
+    def _probe(self):
+        # Runs through self.call; returns the list of (kind, detail) changes
+        changes = []
+        if self.adapter is None:
+            try:
+                self.adapter = self.connect()
+            except Exception as e:
+                logger.debug("Monitor could not connect: %s", e)
+                return changes
+            changes.append((ADAPTER_UP, repr(self.adapter)))
+
+        try:
+            self._read_battery()
+            present = True
+        except Exception:
+            present = False
+            if not self._adapter_alive():
+                adapter, self.adapter = self.adapter, None
+                self.disconnect(adapter)
+                changes.append((ADAPTER_DOWN, repr(adapter)))
+
+        if present != self.battery_present:
+            self.battery_present = present
+            changes.append(
+                (BATTERY_INSERTED if present else BATTERY_REMOVED, None))
+        return changes
+
+    def tick(self):
+        """Probe once, publish any changes and return the next interval"""
+        self.ticks += 1
+        changes = self.call(self._probe)
+        for kind, detail in changes:
+            self._publish(kind, detail)
+
+        if changes:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+        return self.interval
+
+    def poke(self):
+        """Probe again now and poll quickly until things settle"""
+        self.interval = self.min_interval
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                interval = self.tick()
+            except Exception:
+                logger.exception("Monitor tick failed")
+                interval = self.max_interval
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="bqcomm-monitor")
+            self._thread.daemon = True
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
@@ -0,0 +1,287 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import threading
+import time
+
+from .adapter import CommDevice, DeviceWrapper, Error, WriteError
+
+# Device methods that put a transaction on the bus; the first argument of
+# each is the target address
+PACED_METHODS = frozenset([
+    "i2c_transaction", "i2c_read_block", "i2c_write_block",
+    "smb_cmd", "smb_read_byte", "smb_read_word", "smb_read_block",
+    "smb_write_byte", "smb_write_word", "smb_write_block",
+])
+
+# The paced methods that write; a failed write may have been carried out,
+# so these are never retried
+PACED_WRITES = frozenset([
+    "i2c_write_block",
+    "smb_cmd", "smb_write_byte", "smb_write_word", "smb_write_block",
+])
+
+
+class _Target(object):
+    __slots__ = ("gap", "floor", "last", "transactions", "failures",
+                 "retries", "max_gap")
+
+    def __init__(self, gap):
+        self.gap = gap
+        self.floor = 0.0
+        self.last = None
+        self.transactions = 0
+        self.failures = 0
+        self.retries = 0
+        self.max_gap = gap
+
+
+class Pacer(object):
+    """
+    Adaptive bus-idle time between transactions to the same target.
+
+    Each target (gauge address) starts at `initial_gap` seconds of idle bus
+    before every transaction. A failed transaction (NACK, timeout or any
+    other bqcomm.Error) multiplies the gap by `backoff`, and each success
+    shrinks it by `shrink`. The gap never leaves [`min_gap`, `max_gap`].
+
+    Failed transactions are retried up to `retries` times once the longer
+    gap has passed. When a retry succeeds, the gap was evidently too short,
+    so a floor just above it is kept for that target; the floor decays by
+    `floor_decay` on each success so the pacer keeps probing for a shorter
+    gap. Failures that no retry cures (e.g. no battery attached) back off
+    but teach nothing. Writes that failed may have been carried out, so
+    they go through run_write(), which never retries them.
+    """
+
+    # Floor is set this far above a gap that failed
+    FLOOR_MARGIN = 1.5
+    # Gap to back off to from 0
+    BACKOFF_STEP = 0.002
+
+    def __init__(self, min_gap=0.0, max_gap=0.1, initial_gap=0.005,
+                 backoff=2.0, shrink=0.8, floor_decay=0.98, retries=1):
+        self.min_gap = min_gap
+        self.max_gap = max_gap
+        self.initial_gap = initial_gap
+        self.backoff = backoff
+        self.shrink = shrink
+        self.floor_decay = floor_decay
+        self.retries = retries
+
+        self._min_gaps = {}
+        self._targets = {}
+        self._lock = threading.Lock()
+
+    def set_min_gap(self, target, seconds):
+        """Never go below `seconds` of idle bus for `target`"""
+        with self._lock:
+            self._min_gaps[target] = seconds
+            state = self._targets.get(target)
+            if state is not None:
+                state.gap = max(state.gap, seconds)
+
+    def _target(self, target):
+        state = self._targets.get(target)
+        if state is None:
+            gap = max(self.initial_gap, self._min_gaps.get(target, self.min_gap))
+            state = self._targets[target] = _Target(gap)
+        return state
+
+    def gap(self, target):
+        """Current idle time before a transaction to `target`"""
+        with self._lock:
+            return self._target(target).gap
+
+    def wait(self, target):
+        with self._lock:
+            state = self._target(target)
+            if state.last is None:
+                return
+            remaining = state.last + state.gap - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def success(self, target):
+        with self._lock:
+            state = self._target(target)
+            state.last = time.monotonic()
+            state.transactions += 1
+            low = max(self._min_gaps.get(target, self.min_gap), state.floor)
+            state.gap = max(low, state.gap * self.shrink)
+            state.floor *= self.floor_decay
+
+    def failure(self, target):
+        """Back off after a failed transaction; returns the gap that failed"""
+        with self._lock:
+            state = self._target(target)
+            failed = state.gap
+            state.last = time.monotonic()
+            state.transactions += 1
+            state.failures += 1
+            state.gap = min(self.max_gap,
+                            max(state.gap * self.backoff, self.BACKOFF_STEP))
+            state.max_gap = max(state.max_gap, state.gap)
+            return failed
+
+    def _touch(self, target):
+        # The bus was used, but the outcome says nothing about the gap
+        with self._lock:
+            state = self._target(target)
+            state.last = time.monotonic()
+            state.transactions += 1
+
+    def _learn(self, target, failed_gap):
+        with self._lock:
+            state = self._target(target)
+            floor = min(self.max_gap, failed_gap * self.FLOOR_MARGIN)
+            state.floor = max(state.floor, floor)
+            state.gap = max(state.gap, state.floor)
+
+    def run(self, target, fn, *args, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` as a read from `target`, retried up to
+        `retries` times
+        """
+        return self._run(target, self.retries, fn, args, kwargs)
+
+    def _run(self, target, retries, fn, args, kwargs):
+        attempt = 0
+        failed_gap = None
+        while True:
+            self.wait(target)
+            try:
+                result = fn(*args, **kwargs)
+            except WriteError:
+                # An earlier write failed; this read may not even have run,
+                # and retrying it would lose the write's error
+                self._touch(target)
+                raise
+            except Error:
+                gap = self.failure(target)
+                if failed_gap is None:
+                    failed_gap = gap
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                with self._lock:
+                    self._target(target).retries += 1
+                continue
+            self.success(target)
+            if failed_gap is not None:
+                self._learn(target, failed_gap)
+            return result
+
+    def run_write(self, target, fn, *args, **kwargs):
+        """
+        Call `fn(*args, **kwargs)` as a write to `target`. It is paced but
+        never retried, and a failure does not count against the gap.
+        """
+        self.wait(target)
+        try:
+            result = fn(*args, **kwargs)
+        except Error:
+            self._touch(target)
+            raise
+        self.success(target)
+        return result
+
+    def settled(self):
+        """{target: gap} the pacer has settled on for each target"""
+        with self._lock:
+            return dict((t, s.gap) for t, s in self._targets.items())
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                (t, {
+                    "gap": s.gap,
+                    "floor": s.floor,
+                    "max_gap": s.max_gap,
+                    "transactions": s.transactions,
+                    "failures": s.failures,
+                    "retries": s.retries,
+                })
+                for t, s in self._targets.items()
+            )
+
+
+class PacedDevice(DeviceWrapper):
+    """
+    CommDevice wrapper that runs every bus transaction through a Pacer.
+
+    Pipelined submission is hidden, since it would bypass the pacing; all
+    other attributes are those of the wrapped device. `retries`, if given,
+    replaces the pacer's own for reads through this device; 0 leaves the
+    retrying to a RetryingDevice stacked outside.
+    """
+
+    PIPELINED = False
+    submit_i2c_transaction = CommDevice.submit_i2c_transaction
+
+    def __init__(self, device, pacer=None, retries=None):
+        super(PacedDevice, self).__init__(device)
+        self.pacer = pacer if pacer is not None else Pacer()
+        self.retries = retries
+
+    def _read(self, target, fn, *args, **kwargs):
+        retries = self.retries
+        if retries is None:
+            retries = self.pacer.retries
+        return self.pacer._run(target, retries, fn, args, kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith("submit_"):
+            raise AttributeError(name)
+
+        attr = super(PacedDevice, self).__getattr__(name)
+        if name not in PACED_METHODS:
+            return attr
+
+        if name in PACED_WRITES:
+            run = self.pacer.run_write
+        else:
+            run = self._read
+
+        def paced(target, *args, **kwargs):
+            return run(target, attr, target, *args, **kwargs)
+        paced.__name__ = name
+        return paced
+
+    def i2c_transaction(self, target, wr, read_len):
+        # Adapter sends every write as an I2C transaction with no read
+        if read_len == 0:
+            run = self.pacer.run_write
+        else:
+            run = self._read
+        return run(target, self.device.i2c_transaction, target, wr, read_len)
@@ -0,0 +1,239 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import threading
+from concurrent import futures
+
+from .adapter import Error
+from .ev2400 import EV2400, ResponseTimeout
+from .ev2400.packet import EV2400Packet
+from . import trace
+
+Tags = EV2400Packet.Tags
+
+# Adapter housekeeping the driver sends on its own schedule (bus speed at
+# open, GET_VERSION fences in flush()). These are not checked against the
+# recording; calls for them get the last recorded answer instead.
+HOUSEKEEPING_TAGS = frozenset(
+    tag[Tags.CMD] for tag in (
+        Tags.SET_I2C_SPEED, Tags.SET_SMB_SPEED, Tags.GET_VERSION,
+    )
+)
+
+
+class ReplayMismatch(Error):
+    """The requests made differ from the ones in the capture"""
+
+
+class Exchange(object):
+    """One recorded request and its response, if any"""
+
+    __slots__ = ("request", "response", "sent_ns", "answered_ns")
+
+    def __init__(self, request, sent_ns):
+        self.request = request
+        self.response = None
+        self.sent_ns = sent_ns
+        self.answered_ns = None
+
+    @property
+    def latency(self):
+        """Seconds the adapter took to answer, or None"""
+        if self.answered_ns is None:
+            return None
+        return (self.answered_ns - self.sent_ns) / 1e9
+
+
+def exchanges(capture):
+    """
+    Pair the packets of an EV2400 bqcomm.trace capture into Exchanges, in
+    the order the requests were sent
+    """
+    result = []
+    waiting = {}  # packet ID -> Exchange still waiting for its response
+    for record in capture:
+        if record.kind != trace.PACKET:
+            continue
+        packet = record.packet
+        if record.outgoing:
+            exchange = Exchange(packet, record.time_ns)
+            waiting[packet.packet_id] = exchange
+            result.append(exchange)
+        else:
+            exchange = waiting.pop(packet.packet_id, None)
+            if exchange is not None:
+                exchange.response = packet
+                exchange.answered_ns = record.time_ns
+    return result
+
+
+def _describe(packet):
+    return "{0} {1}".format(
+        Tags.get_name(packet.tag),
+        " ".join("{0:02X}".format(x) for x in packet.payload))
+
+
+class ReplayDevice(EV2400):
+    """
+    CommDevice that answers from a bqcomm.trace capture of an EV2400.
+
+    Every call is turned into the packet the EV2400 driver would send and
+    checked against the next request in the capture; a difference raises
+    ReplayMismatch. The recorded response is returned in place of the
+    adapter's, error responses and timeouts included.
+
+    `speed` None answers at once, as fast as the host code can go; 1
+    waits for each response as long as the adapter originally took, and
+    other values scale that (2 is twice as fast).
+    """
+
+    PIPELINED = True
+
+    def __init__(self, capture, speed=None, serial_number="REPLAY"):
+        if not isinstance(capture, trace.Capture):
+            capture = trace.Capture(capture)
+
+        self.exchanges = []
+        self._housekeeping = {}
+        for exchange in exchanges(capture):
+            if exchange.request.tag in HOUSEKEEPING_TAGS:
+                self._housekeeping[exchange.request.tag] = exchange
+            else:
+                self.exchanges.append(exchange)
+
+        self.speed = speed
+        self.serial_number = serial_number
+        self.position = 0
+        self._lock = threading.Lock()
+
+        self.is_open = False
+        self.timeout = 2.0
+        self.window = EV2400.WINDOW
+        self.async_writes = True
+        self.firmware_retries = 0
+        self.timeouts = 0
+        self.metrics = None
+        self.trace = None
+        self._bitrate = None
+
+    def __repr__(self):
+        return "ReplayDevice({0!r}, {1}/{2})".format(
+            self.serial_number, self.position, len(self.exchanges))
+
+    @property
+    def remaining(self):
+        """Recorded requests not yet replayed"""
+        return len(self.exchanges) - self.position
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    @property
+    def in_flight(self):
+        return 0
+
+    @property
+    def unacked_writes(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def get_serial_number(self):
+        return self.serial_number
+
+    def enable_tracing(self, enable=True, path=None, capacity=4096):
+        raise Error("A replay cannot be traced")
+
+    def _next(self, packet):
+        # The recorded exchange for `packet`, checked against the capture
+        if packet.tag in HOUSEKEEPING_TAGS:
+            exchange = self._housekeeping.get(packet.tag)
+            if exchange is None:
+                exchange = Exchange(packet, 0)
+                if Tags.responses.get(packet.tag) is not None:
+                    exchange.response = packet.response([])
+            return exchange
+
+        with self._lock:
+            if self.position >= len(self.exchanges):
+                raise ReplayMismatch(
+                    "Request {0} past the end of the capture: {1}".format(
+                        self.position, _describe(packet)))
+            exchange = self.exchanges[self.position]
+            expected = exchange.request
+            if (
+                expected.tag != packet.tag
+                or expected.payload != packet.payload
+            ):
+                raise ReplayMismatch(
+                    "Request {0} differs from the capture: expected {1}, "
+                    "got {2}".format(
+                        self.position, _describe(expected),
+                        _describe(packet)))
+            self.position += 1
+        return exchange
+
+    def _answer(self, future, exchange):
+        response = exchange.response
+        if response is None:
+            if Tags.responses.get(exchange.request.tag) is None:
+                future.set_result(None)  # A write that went through
+            else:
+                self.timeouts += 1
+                future.set_exception(
+                    ResponseTimeout("Timeout waiting for EV2400 response"))
+        elif response.ok:
+            future.set_result(response)
+        else:
+            code = response.payload[-1] if len(response.payload) else -1
+            future.set_exception(Error(response.error, code))
+
+    def submit(self, packet, expect_response=True):
+        exchange = self._next(packet)
+        future = futures.Future()
+        latency = exchange.latency
+        if self.speed and latency:
+            timer = threading.Timer(
+                latency / self.speed, self._answer, (future, exchange))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._answer(future, exchange)
+        return future
+
+    def do_transaction(self, packet, get_resp=True):
+        return self.submit(packet, get_resp).result()
@@ -0,0 +1,243 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import random
+import threading
+import time
+
+from .adapter import DeviceWrapper, Error, WriteError, error_name
+from . import metrics
+
+# Error classes, as named by error_class(): the EV2400 error codes, plus
+# the host-side ones
+NACK = "NACK"
+TIMEOUT = "TIMEOUT"  # Bus timeout, reported by the adapter
+BAD_PEC = "BAD_PEC"
+BAD_CRC = "BAD_CRC"  # The adapter got a corrupted packet from the host
+HOST_TIMEOUT = "HOST_TIMEOUT"  # No answer from the adapter at all
+DEFERRED_WRITE = "DEFERRED_WRITE"  # An earlier asynchronous write failed
+OTHER = "OTHER"
+
+# Errors a repeat of the same transaction can cure
+TRANSIENT = frozenset([NACK, TIMEOUT, BAD_PEC, BAD_CRC, HOST_TIMEOUT])
+
+# Errors after which a write certainly never reached the bus, so it is
+# safe to send again. A write that was NACKed or timed out may have been
+# carried out, and some (e.g. the two-part shutdown) must not be repeated.
+NOT_SENT = frozenset([BAD_CRC])
+
+READ_METHODS = frozenset([
+    "i2c_transaction", "i2c_read_block",
+    "smb_read_byte", "smb_read_word", "smb_read_block",
+])
+
+WRITE_METHODS = frozenset([
+    "i2c_write_block",
+    "smb_cmd", "smb_write_byte", "smb_write_word", "smb_write_block",
+])
+
+# Policy key for i2c_transaction() with no read (read_len 0), which is how
+# Adapter sends every write
+I2C_WRITE = "i2c_transaction:write"
+
+
+def error_class(exc):
+    """Name of the class of a bqcomm.Error, for RetryPolicy filters"""
+    if isinstance(exc, WriteError):
+        return DEFERRED_WRITE
+    return error_name(exc)
+
+
+class RetryPolicy(object):
+    """
+    How to retry one kind of operation.
+
+    At most `attempts` tries in all, and only after errors whose
+    error_class() is in `retry_on`. Before retry n the policy sleeps
+    `backoff` * `multiplier` ** (n - 1) seconds, capped at `max_backoff`,
+    less a random part of up to `jitter` of it, so several stations
+    retrying together do not stay in step.
+    """
+
+    def __init__(self, attempts=3, backoff=0.002, multiplier=2.0,
+                 max_backoff=0.05, jitter=0.5, retry_on=TRANSIENT):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_on = frozenset(retry_on)
+
+    def __repr__(self):
+        return "RetryPolicy(attempts={0}, retry_on={1})".format(
+            self.attempts, sorted(self.retry_on))
+
+    def should_retry(self, exc, attempt):
+        """Whether to try again after `exc` ended try number `attempt`"""
+        return attempt < self.attempts and error_class(exc) in self.retry_on
+
+    def delay(self, attempt):
+        """Seconds to wait after try number `attempt` failed"""
+        delay = min(self.max_backoff,
+                    self.backoff * self.multiplier ** (attempt - 1))
+        return delay * (1.0 - self.jitter * random.random())
+
+    def run(self, fn, *args, **kwargs):
+        return RetryingDevice.retry(self, None, fn, *args, **kwargs)
+
+
+NO_RETRY = RetryPolicy(attempts=1)
+
+
+def default_policies():
+    """
+    {method name: RetryPolicy}: reads retry on any transient error, writes
+    only when they never reached the bus
+    """
+    reads = RetryPolicy()
+    writes = RetryPolicy(retry_on=NOT_SENT)
+    policies = dict((name, reads) for name in READ_METHODS)
+    policies.update((name, writes) for name in WRITE_METHODS)
+    policies[I2C_WRITE] = writes
+    return policies
+
+
+class RetryingDevice(DeviceWrapper):
+    """
+    CommDevice wrapper that retries failed bus transactions.
+
+    `policies` maps method names to RetryPolicies (default_policies() if
+    None), with writes through i2c_transaction() under I2C_WRITE; other
+    methods are called once. Pipelined submit_* calls are not
+    retried. Retries are counted in `stats()`, and in bqcomm.metrics as
+    retries_total when metrics are enabled.
+
+    Once the retries for a target run out, its calls are tried only once
+    until one succeeds again, so e.g. polling for a battery that is not
+    there costs no more than it did without retries.
+    """
+
+    def __init__(self, device, policies=None):
+        super(RetryingDevice, self).__init__(device)
+        if policies is None:
+            policies = default_policies()
+        self.policies = policies
+        self.failing = set()  # Targets whose last call ran out of retries
+
+        self.retries = {}  # (method, error class) -> count
+        self.recovered = 0
+        self.exhausted = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = super(RetryingDevice, self).__getattr__(name)
+        policy = self.policies.get(name)
+        if policy is None:
+            return attr
+
+        def retried(target, *args, **kwargs):
+            return self._run(policy, attr, target, *args, **kwargs)
+        retried.__name__ = name
+        return retried
+
+    def i2c_transaction(self, target, wr, read_len):
+        if read_len == 0:
+            policy = self.policies.get(I2C_WRITE)
+        else:
+            policy = self.policies.get("i2c_transaction")
+        if policy is None:
+            return self.device.i2c_transaction(target, wr, read_len)
+        return self._run(
+            policy, self.device.i2c_transaction, target, wr, read_len)
+
+    def _run(self, policy, fn, target, *args, **kwargs):
+        if target in self.failing:
+            policy = NO_RETRY
+        try:
+            result = self.retry(policy, self, fn, target, *args, **kwargs)
+        except Error:
+            if policy is not NO_RETRY:
+                self.failing.add(target)
+            raise
+        self.failing.discard(target)
+        return result
+
+    @staticmethod
+    def retry(policy, device, fn, *args, **kwargs):
+        """Call `fn` under `policy`, counting retries on `device` if given"""
+        attempt = 1
+        while True:
+            try:
+                result = fn(*args, **kwargs)
+            except Error as e:
+                if not policy.should_retry(e, attempt):
+                    if device is not None and attempt > 1:
+                        device._count(fn, None)
+                    raise
+                if device is not None:
+                    device._count(fn, error_class(e))
+                time.sleep(policy.delay(attempt))
+                attempt += 1
+                continue
+            if device is not None and attempt > 1:
+                device._count(fn, True)
+            return result
+
+    def _count(self, fn, outcome):
+        # outcome: an error class for a retry, True once a retry succeeded,
+        # None when the retries ran out
+        name = getattr(fn, "__name__", "call")
+        with self._lock:
+            if outcome is True:
+                self.recovered += 1
+            elif outcome is None:
+                self.exhausted += 1
+            else:
+                key = (name, outcome)
+                self.retries[key] = self.retries.get(key, 0) + 1
+        registry = metrics.registry()
+        if registry is not None and outcome not in (True, None):
+            registry.counter(
+                "retries_total", "Operations retried after an error",
+                op=name, error=outcome).inc()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "retries": sum(self.retries.values()),
+                "recovered": self.recovered,
+                "exhausted": self.exhausted,
+                "by_error": dict(
+                    ("{0}:{1}".format(*key), n)
+                    for key, n in self.retries.items()),
+            }
@@ -0,0 +1,221 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import threading
+import time
+from concurrent import futures
+
+from six.moves import queue
+
+from .adapter import Adapter, CommDevice, DeviceWrapper, Error
+
+# One IOWorker per physical device, shared by every SharedAdapter on it,
+# whatever pacing, retry or cache wrappers each Adapter puts around it
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+class IOWorker(object):
+    """
+    Thread that runs every request for one device, in the order queued.
+
+    Requests can come from any thread; each gets a Future for its result.
+    """
+
+    def __init__(self, name="bqcomm-io"):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._users = 0
+        self._stopped = False
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        future = futures.Future()
+        with self._lock:
+            # Nothing would ever run it, and the caller would wait forever
+            if self._stopped:
+                raise Error("I/O worker {0} has stopped".format(
+                    self._thread.name))
+            self._queue.put((future, fn, args, kwargs, time.monotonic()))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        # Nested calls from the worker itself would deadlock waiting on it
+        if threading.current_thread() is self._thread:
+            return fn(*args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stop(self):
+        """Finish the requests already queued; any later ones raise Error"""
+        with self._lock:
+            if not self._stopped:
+                self._stopped = True
+                self._queue.put(None)
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """Queue depth and how long requests waited before running"""
+        mean = self.total_wait / self.requests if self.requests else 0.0
+        return {
+            "queue_depth": self.queue_depth,
+            "requests": self.requests,
+            "mean_wait": mean,
+            "max_wait": self.max_wait,
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            future, fn, args, kwargs, queued = item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            wait = time.monotonic() - queued
+            self.requests += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+
+def _base_device(device):
+    while isinstance(device, DeviceWrapper):
+        device = device.device
+    return device
+
+
+def _acquire_worker(device):
+    device = _base_device(device)
+    with _workers_lock:
+        worker = _workers.get(id(device))
+        if worker is None:
+            worker = IOWorker("bqcomm-io-{0!r}".format(device))
+            _workers[id(device)] = worker
+        worker._users += 1
+        return worker
+
+
+def _release_worker(device):
+    device = _base_device(device)
+    with _workers_lock:
+        worker = _workers.get(id(device))
+        if worker is None:
+            return
+        worker._users -= 1
+        if worker._users <= 0:
+            del _workers[id(device)]
+            worker.stop()
+
+
+class _WorkerProxy(object):
+    # Forwards method calls on `target` through `worker`
+
+    def __init__(self, target, worker):
+        self._target = target
+        self._worker = worker
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._worker.call(attr, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    def __repr__(self):
+        return "{0}<{1!r}>".format(type(self).__name__, self._target)
+
+
+class SharedAdapter(_WorkerProxy):
+    """
+    Thread-safe handle on an Adapter.
+
+    Every call on the SharedAdapter, or on its `device`, runs on the one I/O
+    worker thread that owns the physical device, so a background poll and
+    an operator action can never interleave their packets. Plain method
+    calls block until done; `submit()` returns a Future instead.
+    """
+
+    def __init__(self, adapter=None):
+        if adapter is None:
+            adapter = Adapter()
+        elif isinstance(adapter, CommDevice):
+            adapter = Adapter(adapter)
+
+        self.adapter = adapter
+        worker = _acquire_worker(adapter.device)
+        super(SharedAdapter, self).__init__(adapter, worker)
+        self.device = _WorkerProxy(adapter.device, worker)
+        self._released = False
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)` on the I/O worker and return a Future.
+        `fn` is usually a method of `adapter` or `adapter.device`.
+        """
+        return self._worker.submit(fn, *args, **kwargs)
+
+    def stats(self):
+        return self._worker.stats()
+
+    def release(self):
+        """Drop this handle's claim on the worker without closing the device"""
+        if not self._released:
+            self._released = True
+            _release_worker(self.adapter.device)
+
+    def close(self):
+        try:
+            self._worker.call(self.adapter.close)
+        finally:
+            self.release()
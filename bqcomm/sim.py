@@ -0,0 +1,523 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import collections
+import struct
+import threading
+import time
+
+from six.moves import queue
+
+from .adapter import CommDevice, Error
+from .ev2400 import EV2400
+from .ev2400.packet import EV2400Packet, PacketStream
+from .ev2400.transport import Transport
+
+Tags = EV2400Packet.Tags
+
+
+class Nack(Error):
+    """The simulated gauge did not acknowledge"""
+
+    def __init__(self, reason="Nack received"):
+        # Same arguments as the EV2400 driver's error for a NACK packet
+        super(Nack, self).__init__(reason, Tags.Err.NACK)
+
+
+class Bq40z50(object):
+    """
+    Software model of a bq40z50 gauge: SBS words and blocks,
+    ManufacturerAccess()/ManufacturerBlockAccess() subcommands and the
+    shutdown state.
+
+    Each access raises Nack while the battery is removed or shut down, or
+    if it comes less than `min_gap` seconds after the previous one, so
+    pacing and health monitoring can be exercised too.
+    """
+
+    ADDRESS = 0x17
+
+    MANUFACTURER_ACCESS = 0x00
+    MANUFACTURER_BLOCK_ACCESS = 0x44
+
+    # A 3-cell pack partway through shipping preparation; passes the REV3
+    # inspection limits
+    WORDS = collections.OrderedDict([
+        (0x03, 0x6001),   # BatteryMode
+        (0x08, 2981),     # Temperature, 0.1 K
+        (0x09, 11400),    # Voltage, mV
+        (0x0A, 0),        # Current, mA
+        (0x0B, 0),        # AverageCurrent, mA
+        (0x0C, 1),        # MaxError, %
+        (0x0D, 20),       # RelativeStateOfCharge, %
+        (0x0E, 20),       # AbsoluteStateOfCharge, %
+        (0x0F, 1250),     # RemainingCapacity, mAh
+        (0x10, 6000),     # FullChargeCapacity, mAh
+        (0x16, 0x00C0),   # BatteryStatus
+        (0x17, 1),        # CycleCount
+        (0x18, 6200),     # DesignCapacity, mAh
+        (0x19, 11100),    # DesignVoltage, mV
+        (0x1B, 0x5A21),   # ManufactureDate
+        (0x1C, 1234),     # SerialNumber
+        (0x3C, 0),        # CellVoltage4, unused
+        (0x3D, 3800),     # CellVoltage3
+        (0x3E, 3800),     # CellVoltage2
+        (0x3F, 3800),     # CellVoltage1
+    ])
+
+    BLOCKS = {
+        0x20: b"Texas Inst.",     # ManufacturerName
+        0x21: b"bq40z50-R2",      # DeviceName
+        0x22: b"LION",            # DeviceChemistry
+    }
+
+    # MAC subcommands
+    DEVICE_TYPE = 0x0001
+    FIRMWARE_VERSION = 0x0002
+    SHUTDOWN = 0x0010
+    DEVICE_RESET = 0x0041
+    DA_STATUS_1 = 0x0071
+    DA_STATUS_2 = 0x0072
+    GAUGE_STATUS_1 = 0x0073
+
+    def __init__(self, words=None, min_gap=0.0):
+        self.words = collections.OrderedDict(Bq40z50.WORDS)
+        if words:
+            self.words.update(words)
+        self.blocks = dict(Bq40z50.BLOCKS)
+        self.min_gap = min_gap
+
+        self.present = True
+        self.is_shutdown = False
+        self.accesses = 0
+        self.nacks = 0
+
+        self._mac = None
+        self._last_mac = None
+        self._last_access = None
+        self._lock = threading.Lock()
+
+    # Test controls
+
+    def remove(self):
+        self.present = False
+
+    def insert(self):
+        """Put a (fresh, awake) battery back"""
+        self.present = True
+        self.is_shutdown = False
+        self._mac = self._last_mac = None
+
+    def wake(self):
+        """Leave shutdown, as when a charger is attached"""
+        self.is_shutdown = False
+
+    # Bus side
+
+    def _access(self):
+        # Called with _lock held
+        now = time.time()
+        last, self._last_access = self._last_access, now
+        self.accesses += 1
+        if not self.present or self.is_shutdown:
+            self.nacks += 1
+            raise Nack()
+        if last is not None and now - last < self.min_gap:
+            self.nacks += 1
+            raise Nack("Nack received (bus busy)")
+
+    def read_word(self, cmd):
+        with self._lock:
+            self._access()
+            try:
+                return self.words[cmd] & 0xFFFF
+            except KeyError:
+                raise Nack()
+
+    def write_word(self, cmd, value):
+        with self._lock:
+            self._access()
+            if cmd == Bq40z50.MANUFACTURER_ACCESS:
+                self._subcommand(value & 0xFFFF)
+            elif cmd in self.words:
+                self.words[cmd] = value & 0xFFFF
+            else:
+                raise Nack()
+
+    def read_block(self, cmd):
+        with self._lock:
+            self._access()
+            if cmd == Bq40z50.MANUFACTURER_BLOCK_ACCESS:
+                subcommand = self._mac or 0
+                data = self._mac_data(subcommand)
+                return bytearray(struct.pack("<H", subcommand)) + data
+            try:
+                return bytearray(self.blocks[cmd])
+            except KeyError:
+                raise Nack()
+
+    def write_block(self, cmd, data):
+        with self._lock:
+            self._access()
+            if cmd != Bq40z50.MANUFACTURER_BLOCK_ACCESS or len(data) < 2:
+                raise Nack()
+            self._subcommand(data[0] + (data[1] << 8))
+
+    def is_block_register(self, cmd):
+        return cmd == Bq40z50.MANUFACTURER_BLOCK_ACCESS or cmd in self.blocks
+
+    def _subcommand(self, subcommand):
+        # Shutdown takes the same subcommand twice in a row
+        if subcommand == Bq40z50.SHUTDOWN and self._last_mac == subcommand:
+            self.is_shutdown = True
+            subcommand = None
+        elif subcommand == Bq40z50.DEVICE_RESET:
+            subcommand = None
+        self._mac = self._last_mac = subcommand
+
+    def _mac_data(self, subcommand):
+        w = self.words
+        if subcommand == Bq40z50.DEVICE_TYPE:
+            return bytearray(struct.pack("<H", 0x4500))
+        if subcommand == Bq40z50.FIRMWARE_VERSION:
+            return bytearray(struct.pack("<HHHBHB", 0x4500, 0x0106, 0x0034,
+                                         0x00, 0x0036, 0x01))
+        if subcommand == Bq40z50.DA_STATUS_1:
+            cells = [w[0x3F], w[0x3E], w[0x3D], w[0x3C]]
+            current = w[0x0A] - 0x10000 if w[0x0A] & 0x8000 else w[0x0A]
+            power = w[0x09] * current // 10000
+            return bytearray(struct.pack(
+                "<6H10h", *(cells + [w[0x09], w[0x09]] + [current] * 4
+                            + [c * current // 10000 for c in cells]
+                            + [power, power])))
+        if subcommand == Bq40z50.DA_STATUS_2:
+            return bytearray(struct.pack("<7H", *([w[0x08]] * 7)))
+        if subcommand == Bq40z50.GAUGE_STATUS_1:
+            return bytearray(struct.pack(
+                "<16H", w[0x0F], w[0x0F] * w[0x19] // 10000,
+                w[0x18], w[0x18] * w[0x19] // 10000,
+                w[0x10], w[0x10] * w[0x19] // 10000,
+                w[0x08], w[0x08], *([100] * 8)))
+        # Unknown subcommands echo with no data
+        return bytearray()
+
+
+class _Bus(object):
+    # Gauges by address, with the SMBus-level operations the adapters use
+
+    def __init__(self, gauges, latency):
+        self.gauges = gauges
+        self.latency = latency
+
+    def gauge(self, target):
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            return self.gauges[target]
+        except KeyError:
+            raise Nack()
+
+    def i2c_transaction(self, target, wr, read_len):
+        gauge = self.gauge(target)
+        wr = list(wr)
+        if not wr:
+            raise Nack()
+        cmd = wr[0]
+
+        if read_len == 0:
+            if len(wr) == 1:
+                return []
+            if gauge.is_block_register(cmd):
+                gauge.write_block(cmd, wr[2:2 + wr[1]])
+            else:
+                gauge.write_word(cmd, wr[1] + (wr[2] << 8 if len(wr) > 2 else 0))
+            return []
+
+        if gauge.is_block_register(cmd):
+            data = gauge.read_block(cmd)
+            if read_len is None:
+                return list(data)
+            return list((bytearray([len(data)]) + data)[:read_len])
+
+        value = gauge.read_word(cmd)
+        if read_len is None:
+            raise Nack()
+        return [value & 0xFF, value >> 8][:read_len] + [0] * max(0, read_len - 2)
+
+
+class SimDevice(CommDevice):
+    """
+    Simulated adapter with a bq40z50 at 0x17 (or the `gauges` given, by
+    address). Every transaction takes `latency` seconds.
+
+    CommDevice.register(SimDevice) makes enumerate() report `count` of
+    them, so Adapter(), the Inspector and the station runner work with no
+    hardware attached.
+    """
+
+    count = 1
+
+    def __init__(self, gauges=None, serial_number="SIM0", latency=0.0):
+        if gauges is None:
+            gauges = {Bq40z50.ADDRESS: Bq40z50()}
+        self.gauges = gauges
+        self.serial_number = serial_number
+        self.bus = _Bus(gauges, latency)
+        self.is_open = False
+        self.transactions = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def enumerate(cls):
+        return [cls(serial_number="SIM{0}".format(i)) for i in range(cls.count)]
+
+    @property
+    def gauge(self):
+        return self.gauges.get(Bq40z50.ADDRESS)
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def get_version(self):
+        return "v1.02"
+
+    def get_serial_number(self):
+        return self.serial_number
+
+    def i2c_transaction(self, target, wr, read_len):
+        if not self.is_open:
+            raise Error("Simulated adapter is not open")
+        with self._lock:
+            self.transactions += 1
+            return self.bus.i2c_transaction(target, wr, read_len)
+
+    # SMBus calls as the EV2400 driver offers them
+
+    def smb_read_byte(self, address, cmd):
+        return self.i2c_transaction(address, [cmd], 1)[0]
+
+    def smb_read_word(self, address, cmd):
+        data = self.i2c_transaction(address, [cmd], 2)
+        return data[0] + data[1] * 0x100
+
+    def smb_read_block(self, address, cmd):
+        return self.i2c_transaction(address, [cmd], None)
+
+    def smb_cmd(self, address, cmd, data=None):
+        self.i2c_transaction(address, [cmd], 0)
+        return True
+
+    def smb_write_byte(self, address, cmd, data):
+        self.i2c_transaction(address, [cmd, data], 0)
+        return True
+
+    def smb_write_word(self, address, cmd, data):
+        self.i2c_transaction(
+            address, [cmd, data & 0xFF, (data >> 8) & 0xFF], 0)
+        return True
+
+    def smb_write_block(self, address, cmd, data):
+        self.i2c_transaction(address, [cmd, len(data)] + list(data), 0)
+        return True
+
+    def i2c_read_block(self, target_addr, reg_addr, length):
+        return self.i2c_transaction(target_addr, [reg_addr], length)
+
+    def i2c_write_block(self, target_addr, reg_addr, data):
+        self.i2c_transaction(target_addr, [reg_addr] + list(data), 0)
+        return True
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self.serial_number)
+
+
+class SimTransport(Transport):
+    """
+    EV2400 firmware stand-in at the HID report level, for running the real
+    EV2400 driver and PacketStream with no adapter attached.
+
+    Reports are decoded, CRC checked and answered on a firmware thread,
+    like the adapter answering over USB; SMBus and I2C requests go to the
+    simulated gauges.
+    """
+
+    VERSION = (1, 2)
+
+    def __init__(self, gauges=None, serial_number="SIMEV0", latency=0.0):
+        if gauges is None:
+            gauges = {Bq40z50.ADDRESS: Bq40z50()}
+        self.gauges = gauges
+        self.serial_number = serial_number
+        self.bus = _Bus(gauges, latency)
+        self.packets = 0
+
+        self._handler = None
+        self._queue = None
+        self._thread = None
+        self._stream = PacketStream(self._deliver, self._handle)
+
+    @property
+    def gauge(self):
+        return self.gauges.get(Bq40z50.ADDRESS)
+
+    def open(self):
+        self._stream.reset()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="bqcomm-sim-{0}".format(self.serial_number))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        if self._queue is not None:
+            self._queue.put(None)
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._queue = None
+
+    def set_raw_data_handler(self, handler):
+        self._handler = handler
+
+    def send(self, report):
+        if self._queue is None:
+            raise Error("Simulated EV2400 is not open")
+        self._queue.put(bytes(bytearray(report)))
+
+    def _run(self):
+        while True:
+            report = self._queue.get()
+            if report is None:
+                return
+            self._stream(report)
+
+    def _deliver(self, report):
+        handler = self._handler
+        if handler is not None:
+            handler(bytes(report))
+
+    def _reply(self, request, tag, payload=()):
+        self._stream.send_packet(
+            EV2400Packet(tag, list(payload), request.packet_id))
+
+    def _handle(self, packet):
+        # One request packet from the driver
+        self.packets += 1
+        tag = packet.tag
+        p = list(packet.payload)
+        try:
+            if tag == Tags.GET_VERSION[Tags.CMD]:
+                self._reply(packet, Tags.GET_VERSION[Tags.RSP], self.VERSION)
+            elif tag == Tags.SMB_RD_WORD[Tags.CMD]:
+                data = self.bus.i2c_transaction(p[0], [p[1]], 2)
+                self._reply(packet, Tags.SMB_RD_WORD[Tags.RSP],
+                            [p[1]] + data + [0])
+            elif tag == Tags.SMB_RD_BYTE[Tags.CMD]:
+                data = self.bus.i2c_transaction(p[0], [p[1]], 1)
+                self._reply(packet, Tags.SMB_RD_BYTE[Tags.RSP],
+                            [p[1]] + data + [0])
+            elif tag == Tags.SMB_RD_BLOCK[Tags.CMD]:
+                data = self.bus.i2c_transaction(p[0], [p[1]], None)
+                self._reply(packet, Tags.SMB_RD_BLOCK[Tags.RSP],
+                            [p[1], len(data)] + data + [0])
+            elif tag == Tags.SMB_CMD[Tags.CMD]:
+                self.bus.i2c_transaction(p[0], [p[1]], 0)
+            elif tag in (Tags.SMB_WR_BYTE[Tags.CMD], Tags.SMB_WR_WORD[Tags.CMD]):
+                self.bus.i2c_transaction(p[0], p[1:], 0)
+            elif tag == Tags.SMB_WR_BLOCK[Tags.CMD]:
+                self.bus.i2c_transaction(p[0], p[1:3 + p[2]], 0)
+            elif tag == Tags.I2C_TRANSACTION[Tags.CMD]:
+                target, flags, read_len, count = p[:4]
+                read_len = None if flags & 0x01 else read_len
+                data = self.bus.i2c_transaction(
+                    target, p[4:4 + count], read_len)
+                self._reply(packet, Tags.I2C_TRANSACTION[Tags.RSP], data)
+            elif tag == Tags.I2C_RD_DATA[Tags.CMD]:
+                data = self.bus.i2c_transaction(p[0], [p[1]], p[2])
+                self._reply(packet, Tags.I2C_RD_DATA[Tags.RSP],
+                            [p[0], p[1]] + data + [0])
+            elif tag == Tags.I2C_WR_DATA[Tags.CMD]:
+                self.bus.i2c_transaction(p[0], [p[1]] + p[3:3 + p[2]], 0)
+            elif Tags.responses.get(tag, False) is None:
+                # Settings and other writes the firmware just accepts
+                pass
+            else:
+                self._reply(packet, Tags.ERROR[Tags.RSP],
+                            [Tags.Err.UNKNOWN_TAG])
+        except Nack:
+            self._reply(packet, Tags.SMB_ERROR[Tags.RSP],
+                        [p[1] if len(p) > 1 else 0, Tags.Err.NACK])
+        except (IndexError, ValueError):
+            self._reply(packet, Tags.ERROR[Tags.RSP], [Tags.Err.UNSPECIFIED])
+
+    def __repr__(self):
+        return "{0}({1!r})".format(type(self).__name__, self.serial_number)
+
+
+class SimEV2400(EV2400):
+    """
+    The real EV2400 driver over SimTransport. Register it with
+    CommDevice.register(SimEV2400) to exercise the packet path end to end;
+    enumerate() reports `count` adapters.
+    """
+
+    count = 1
+
+    @classmethod
+    def list_hid_devices(cls, bsl=False):
+        return [SimTransport(serial_number="SIMEV{0}".format(i))
+                for i in range(cls.count)]
+
+    @property
+    def gauge(self):
+        return self.device.gauge
+
+
+def install(spec="device"):
+    """
+    Make CommDevice.enumerate() report only simulated adapters. `spec` is
+    "device" (SimDevice) or "ev2400" (SimEV2400), optionally followed by
+    ":N" for N adapters.
+    """
+    kind, _, count = spec.partition(":")
+    types = {"device": SimDevice, "ev2400": SimEV2400}
+    try:
+        device_type = types[kind.strip().lower() or "device"]
+    except KeyError:
+        raise Error("Unknown simulated adapter {0!r}".format(kind))
+    device_type.count = int(count) if count else 1
+    del CommDevice.KNOWN_TYPES[:]
+    CommDevice.register(device_type)
+    return device_type
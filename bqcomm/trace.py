@@ -0,0 +1,272 @@
+"""
+Copyright (c) 2018-2021, Texas Instruments Incorporated
+All rights reserved.
+
+Redistribution and use in source and binary forms, with or without
+modification, are permitted provided that the following conditions are
+met:
+
+1. Redistributions of source code must retain the above copyright
+notice, this list of conditions and the following disclaimer.
+
+2. Redistributions in binary form must reproduce the above copyright
+notice, this list of conditions and the following disclaimer in the
+documentation and/or other materials provided with the distribution.
+
+3. Neither the name of the copyright holder nor the names of its
+contributors may be used to endorse or promote products derived from
+this software without specific prior written permission.
+
+THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+"AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+(INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+
+from __future__ import absolute_import
+import collections
+import datetime
+import struct
+import threading
+import time
+
+# Capture file layout: a header of magic, wall-clock ns and monotonic ns at
+# the start of the capture, then one record per traced item: monotonic ns,
+# flags and length, followed by the raw bytes.
+MAGIC = b"BQTRACE1"
+_HEADER = struct.Struct("<8sQQ")
+_RECORD = struct.Struct("<QBH")
+
+# Record kinds, in the upper bits of the flags byte; bit 0 is the direction
+PACKET = 0  # A whole EV2400 packet
+BAD_REPORT = 1  # A HID report that could not be used
+DISCARD = 2  # Received bytes thrown away while looking for a packet
+RAW = 3  # Bus bytes from an adapter without packets (Aardvark)
+
+_OUTGOING = 0x01
+_KIND_SHIFT = 4
+
+KIND_NAMES = {
+    PACKET: "packet",
+    BAD_REPORT: "bad report",
+    DISCARD: "discarded",
+    RAW: "raw",
+}
+
+try:
+    _now_ns = time.monotonic_ns
+except AttributeError:  # Python < 3.7
+    def _now_ns():
+        return int(time.time() * 1e9)
+
+
+def _wall_ns():
+    return int(time.time() * 1e9)
+
+
+class TraceRecord(collections.namedtuple(
+        "TraceRecord", "time_ns outgoing kind data")):
+    """
+    One traced item. `time_ns` is on the monotonic clock of the capture;
+    `data` is the raw bytes, only decoded on request.
+    """
+
+    __slots__ = ()
+
+    @property
+    def packet(self):
+        """The EV2400Packet for a PACKET record, or None"""
+        if self.kind != PACKET:
+            return None
+        from .ev2400.packet import EV2400Packet
+        packet = EV2400Packet()
+        packet.add_bytes(bytearray(self.data))
+        return packet
+
+    def describe(self):
+        arrow = "--> " if self.outgoing else "<-- "
+        if self.kind == PACKET:
+            try:
+                return arrow + str(self.packet)
+            except Exception:
+                pass
+        return "{0}{1}: {2}".format(
+            arrow, KIND_NAMES.get(self.kind, "kind {0}".format(self.kind)),
+            " ".join("{0:02X}".format(x) for x in bytearray(self.data)))
+
+
+class TraceRecorder(object):
+    """
+    Keeps the last `capacity` traced items in memory.
+
+    Recording is one tuple append, so it is cheap enough to leave on. With
+    a `path`, a writer thread empties the buffer into that capture file each
+    time it fills, so the file is never written from inside a transaction;
+    flush() and close() write the rest. Recording after close() appends to
+    the same file. Without a path, the oldest items are dropped and save()
+    writes what is left.
+    """
+
+    def __init__(self, path=None, capacity=4096):
+        self.path = path
+        self.capacity = capacity
+        self.start_wall_ns = _wall_ns()
+        self.start_ns = _now_ns()
+        self.recorded = 0
+        self.written = 0
+
+        self._buffer = collections.deque(
+            maxlen=None if path else capacity)
+        self._file = None
+        self._started = False
+        self._lock = threading.Lock()
+
+        # Background writer for full buffers, started on first need
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def record(self, outgoing, data, kind=PACKET):
+        flags = (kind << _KIND_SHIFT) | (_OUTGOING if outgoing else 0)
+        self._buffer.append((_now_ns(), flags, bytes(data)))
+        self.recorded += 1
+        if (self.path and len(self._buffer) >= self.capacity
+                and not self._wake.is_set()):
+            self._wake_writer()
+
+    def _wake_writer(self):
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_loop, name="bqcomm-trace-writer")
+                self._writer.daemon = True
+                self._writer.start()
+        self._wake.set()
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            with self._writer_lock:
+                # close() has retired this writer
+                if self._writer is not threading.current_thread():
+                    return
+            self.flush()
+
+    def _take(self):
+        # Everything buffered so far, leaving the buffer empty
+        items = []
+        pop = self._buffer.popleft
+        try:
+            while True:
+                items.append(pop())
+        except IndexError:
+            pass
+        return items
+
+    def _encode(self, items):
+        parts = []
+        for time_ns, flags, data in items:
+            parts.append(_RECORD.pack(time_ns, flags, len(data)))
+            parts.append(data)
+        return b"".join(parts)
+
+    def _header(self):
+        return _HEADER.pack(MAGIC, self.start_wall_ns, self.start_ns)
+
+    def flush(self):
+        """Write the buffered items to the capture file, if there is one"""
+        if not self.path:
+            return
+        with self._lock:
+            items = self._take()
+            if self._file is None:
+                if self._started:
+                    self._file = open(self.path, "ab")
+                else:
+                    self._file = open(self.path, "wb")
+                    self._file.write(self._header())
+                    self._started = True
+            self._file.write(self._encode(items))
+            self._file.flush()
+            self.written += len(items)
+
+    def save(self, path):
+        """Write the items still in memory to a new capture file"""
+        items = list(self._buffer)
+        with open(path, "wb") as f:
+            f.write(self._header())
+            f.write(self._encode(items))
+
+    def close(self):
+        """Stop the writer thread, write what is left and close the file"""
+        with self._writer_lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._wake.set()
+            writer.join()
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def records(self):
+        """TraceRecords for the items still in memory"""
+        return [_decode_record(item) for item in list(self._buffer)]
+
+
+def _decode_record(item):
+    time_ns, flags, data = item
+    return TraceRecord(
+        time_ns, bool(flags & _OUTGOING), flags >> _KIND_SHIFT, data)
+
+
+class Capture(object):
+    """The records of a capture file, read back"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            raw = f.read()
+        if len(raw) < _HEADER.size:
+            raise ValueError("{0}: not a bqcomm capture".format(path))
+        magic, self.start_wall_ns, self.start_ns = _HEADER.unpack_from(raw)
+        if magic != MAGIC:
+            raise ValueError("{0}: not a bqcomm capture".format(path))
+
+        self.records = []
+        offset = _HEADER.size
+        while offset + _RECORD.size <= len(raw):
+            time_ns, flags, length = _RECORD.unpack_from(raw, offset)
+            offset += _RECORD.size
+            if offset + length > len(raw):
+                break  # Cut short, e.g. the process died mid-write
+            self.records.append(_decode_record(
+                (time_ns, flags, raw[offset:offset + length])))
+            offset += length
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def wall_time(self, record):
+        """datetime at which `record` was traced"""
+        ns = self.start_wall_ns + record.time_ns - self.start_ns
+        return datetime.datetime.fromtimestamp(ns / 1e9)
+
+    def lines(self):
+        """The records formatted like the old print-based trace"""
+        for record in self.records:
+            yield "{0} {1}".format(
+                self.wall_time(record).strftime("%m/%d/%y %H:%M:%S.%f"),
+                record.describe())
+
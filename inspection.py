@@ -0,0 +1,260 @@
+"""
+# Battery Inspection
+##### Project:      Siena Battery
+##### File:         inspection.py
+##### Description: SBS checks and shutdown shared by the Inspector GUI, the
+#####              station runner and the CLI. Nothing here imports tkinter.
+#####
+##### What to read, the limits and the actions come from a JSON plan (see
+##### plans/). A plan is compiled once into a schedule: each register is
+##### read once, and when the adapter can pipeline, the reads go out back
+##### to back, as many at a time as the adapter's window allows.
+"""
+import collections
+import json
+import os
+import time
+from concurrent import futures
+
+from bqcomm import ResponseTimeout
+
+# Setup constants
+BQ40Z50_ADDR = 0x17
+
+# Commands
+VOLT_CMD = 0x09
+TEMP_CMD = 0x08
+CURR_CMD = 0x0A
+MAXE_CMD = 0x0C
+RSOC_CMD = 0x0D
+RCAP_CMD = 0x0F
+CCNT_CMD = 0x17
+SN_CMD = 0x1C
+FCC_CMD = 0x10
+SHUTDOWN_CMD = [0x10,0x00]
+MFR_BLK_ACC_ADDR = 0x44
+
+# Fixed pause after every bus access, as the GUI used to do. Pass a delay
+# of 0 with a paced device (bqcomm.pacing) to let the pacer pick the gap;
+# with 0 on an unpaced EV2400 the reads are pipelined.
+CMD_DELAY = 0.1
+
+PLAN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "plans")
+DEFAULT_PLAN = os.path.join(PLAN_DIR, "siena_rev3.json")
+
+CheckResult = collections.namedtuple("CheckResult", "name value passed")
+
+_DECODERS = {
+    "u16": lambda v: v,
+    "s16": lambda v: v - 0x10000 if v & 0x8000 else v,
+}
+
+# Limit keyword -> test of (value, limit)
+_LIMITS = {
+    "min": lambda v, lim: v >= lim,
+    "max": lambda v, lim: v <= lim,
+    "above": lambda v, lim: v > lim,
+    "below": lambda v, lim: v < lim,
+    "equals": lambda v, lim: v == lim,
+}
+
+
+class PlanError(Exception):
+    pass
+
+
+def _int(value):
+    # Plans may give numbers as JSON ints or as strings like "0x44"
+    if isinstance(value, str):
+        return int(value, 0)
+    return int(value)
+
+
+class _Check(object):
+
+    def __init__(self, spec, read_index):
+        try:
+            self.name = spec["name"]
+            self.decode = _DECODERS[spec.get("decode", "u16")]
+        except KeyError as e:
+            raise PlanError("Bad check {0!r}: {1}".format(spec, e))
+        self.read_index = read_index
+        # The raw word is divided by scale before the limits are applied
+        self.scale = spec.get("scale", 1)
+        self.limits = [
+            (_LIMITS[key], spec[key]) for key in _LIMITS if key in spec
+        ]
+
+    def evaluate(self, raw):
+        value = self.decode(raw)
+        if self.scale != 1:
+            value = value / self.scale
+        passed = all(test(value, lim) for test, lim in self.limits)
+        return CheckResult(self.name, value, passed)
+
+
+class _Action(object):
+
+    def __init__(self, spec, address):
+        try:
+            self.name = spec["name"]
+            self.register = _int(spec["register"])
+            self.data = [_int(x) for x in spec["write_block"]]
+        except (KeyError, ValueError) as e:
+            raise PlanError("Bad action {0!r}: {1}".format(spec, e))
+        self.address = address
+        self.repeat = spec.get("repeat", 1)
+        self.interval = spec.get("interval", 0)
+
+    def run(self, device):
+        for i in range(self.repeat):
+            if i and self.interval:
+                time.sleep(self.interval)
+            device.smb_write_block(self.address, self.register, self.data)
+            # Writes may return before the gauge has answered; make sure this
+            # one went through, so a NACK is reported here and not by the
+            # next battery's first read
+            device.flush()
+
+
+class InspectionPlan(object):
+    """
+    Compiled plan: the distinct registers to read, in order, the checks that
+    evaluate them and the actions to run afterwards.
+    """
+
+    def __init__(self, spec):
+        self.name = spec.get("name", "unnamed")
+        self.address = _int(spec.get("address", BQ40Z50_ADDR))
+
+        self.registers = []
+        self.checks = []
+        index_of = {}
+        for check in spec.get("checks", []):
+            try:
+                register = _int(check["register"])
+            except (KeyError, ValueError) as e:
+                raise PlanError("Bad check {0!r}: {1}".format(check, e))
+            if register not in index_of:
+                index_of[register] = len(self.registers)
+                self.registers.append(register)
+            self.checks.append(_Check(check, index_of[register]))
+
+        self.actions = [
+            _Action(action, self.address)
+            for action in spec.get("actions", [])
+        ]
+
+    def __repr__(self):
+        return "InspectionPlan({0!r}: {1} reads, {2} checks, {3} actions)".format(
+            self.name, len(self.registers), len(self.checks), len(self.actions))
+
+    def read(self, device, delay=CMD_DELAY):
+        """Raw word for every register, pipelined if the device allows it"""
+        submit = getattr(device, "submit_smb_read_word", None)
+        if submit is not None and not delay:
+            timeout = getattr(device, "timeout", None)
+            window = max(
+                getattr(device, "window", None) or len(self.registers), 1)
+            values = []
+            pending = collections.deque()
+            try:
+                for reg in self.registers:
+                    # Never more in flight than the adapter takes at once
+                    if len(pending) >= window:
+                        values.append(_result(pending.popleft(), timeout))
+                    pending.append(submit(self.address, reg))
+                while pending:
+                    values.append(_result(pending.popleft(), timeout))
+            finally:
+                # After an error, free the slots of the reads still out
+                for future in pending:
+                    future.cancel()
+            return values
+
+        values = []
+        for reg in self.registers:
+            values.append(device.smb_read_word(self.address, reg))
+            time.sleep(delay)
+        return values
+
+    def run_checks(self, device, delay=CMD_DELAY):
+        raw = self.read(device, delay)
+        return [check.evaluate(raw[check.read_index]) for check in self.checks]
+
+    def run_actions(self, device):
+        for action in self.actions:
+            action.run(device)
+
+
+def _result(future, timeout):
+    try:
+        return future.result(timeout)
+    except futures.TimeoutError:
+        # If the response won the race, cancel() fails and we use it
+        if future.cancel():
+            raise ResponseTimeout("Timeout waiting for gauge response")
+        return future.result()
+
+
+def compile_plan(spec):
+    return InspectionPlan(spec)
+
+
+def load_plan(path=DEFAULT_PLAN):
+    with open(path) as f:
+        return compile_plan(json.load(f))
+
+
+_default_plan = None
+
+
+def default_plan():
+    global _default_plan
+    if _default_plan is None:
+        _default_plan = load_plan(DEFAULT_PLAN)
+    return _default_plan
+
+
+def run_checks(device, delay=CMD_DELAY, plan=None):
+    """Read every check register through `device` and test it"""
+    return (plan or default_plan()).run_checks(device, delay)
+
+
+def shutdown(device, plan=None):
+    (plan or default_plan()).run_actions(device)
+
+
+def inspect(device, do_shutdown=True, delay=CMD_DELAY, plan=None):
+    """
+    Run the checks and then, like the GUI, the plan's actions (shutdown)
+    whatever the outcome unless `do_shutdown` is False. Returns a dict;
+    errors are reported in it, not raised.
+
+    Anything a RegisterCache on `device` holds for the gauge is dropped
+    first: the battery may have been swapped since the last inspection.
+    An inspection therefore never uses cached values; the cache only
+    serves other reads, such as the GUI's polls, until the next one.
+    """
+    plan = plan or default_plan()
+    cache = getattr(device, "cache", None)
+    if cache is not None:
+        cache.invalidate(plan.address)
+    result = {"checks": [], "passed": False, "shutdown": False, "error": None}
+    try:
+        checks = plan.run_checks(device, delay)
+        result["checks"] = [c._asdict() for c in checks]
+        result["passed"] = all(c.passed for c in checks)
+        if do_shutdown and plan.actions:
+            if delay:
+                time.sleep(delay)
+            plan.run_actions(device)
+            result["shutdown"] = True
+    except Exception as e:
+        result["error"] = str(e) or type(e).__name__
+
+    # Record the bus-idle time the pacer settled on for this gauge
+    pacer = getattr(device, "pacer", None)
+    if pacer is not None:
+        result["bus_gap"] = pacer.gap(plan.address)
+    return result
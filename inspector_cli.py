@@ -0,0 +1,241 @@
+"""
+# Headless Inspector
+##### Project:      Siena Battery
+##### File:         inspector_cli.py
+##### Description: Run the battery checks and shutdown without the GUI and
+#####              print one JSON line per inspection. Does not import
+#####              tkinter, so it starts quickly on fixtures and scripts.
+"""
+import argparse
+import datetime
+import json
+import queue
+import sys
+import time
+
+import bqcomm
+from bqcomm import metrics, monitor
+from bqcomm.pacing import PacedDevice, Pacer
+from bqcomm.replay import ReplayDevice
+from bqcomm.retry import RetryingDevice
+from bqcomm.shared import IOWorker
+
+import inspection
+from station import adapter_serial
+
+
+def select_device(selector):
+    """Pick an adapter by index or serial number (default: the first)"""
+    devices = list(bqcomm.CommDevice.enumerate())
+    if not devices:
+        raise bqcomm.Error("No communication devices available")
+    if selector is None:
+        return devices[0]
+
+    for device in devices:
+        if adapter_serial(device) == selector:
+            return device
+    try:
+        return devices[int(selector)]
+    except (ValueError, IndexError):
+        raise bqcomm.Error("No adapter {0!r}".format(selector))
+
+
+def open_device(args, plan):
+    """
+    Open the selected adapter, wrapped for pacing and retries as asked.
+    Returns (device, adapter serial).
+    """
+    if args.replay:
+        device = ReplayDevice(args.replay, speed=args.replay_speed)
+    else:
+        device = select_device(args.adapter)
+    serial = adapter_serial(device)
+    device.open()
+    if args.capture:
+        if not hasattr(device, "enable_tracing"):
+            raise bqcomm.Error(
+                "{0!r} cannot capture its traffic".format(device))
+        device.enable_tracing(path=args.capture)
+    if not args.no_pacing:
+        pacer = Pacer()
+        pacer.set_min_gap(plan.address, args.min_gap)
+        # Retry in one layer only: the policies, unless they are off
+        device = PacedDevice(
+            device, pacer, retries=None if args.no_retry else 0)
+    if not args.no_retry:
+        device = RetryingDevice(device)
+    return device, serial
+
+
+def run_inspection(device, serial, run, args, plan):
+    """Inspect once and print the JSON record; True if the battery passed"""
+    start = time.time()
+    result = inspection.inspect(
+        device, not args.no_shutdown, args.delay, plan)
+    record = {
+        "adapter": serial,
+        "run": run,
+        "time": datetime.datetime.now().isoformat(),
+        "elapsed": round(time.time() - start, 4),
+    }
+    record.update(result)
+    print(json.dumps(record))
+    sys.stdout.flush()
+    if args.metrics:
+        metrics.registry().write_prometheus(args.metrics)
+    return result["passed"] and not result["error"]
+
+
+def watch(args, plan):
+    """
+    Print adapter and battery events as they happen and inspect every
+    battery that is inserted, until interrupted.
+    """
+    worker = IOWorker("inspector-io")
+    events = queue.Queue()
+    opened = {}
+
+    def connect():
+        device, serial = open_device(args, plan)
+        opened[device] = serial
+        return device
+
+    def disconnect(device):
+        opened.pop(device, None)
+        try:
+            device.close()
+        except Exception:
+            pass
+
+    health = monitor.HealthMonitor(
+        connect, plan.address, call=worker.call, disconnect=disconnect)
+    health.subscribe(events.put)
+    health.start()
+
+    all_passed = True
+    run = 0
+    try:
+        while True:
+            try:
+                event = events.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            print(json.dumps({
+                "event": event.kind,
+                "time": datetime.datetime.fromtimestamp(event.time).isoformat(),
+                "detail": event.detail,
+            }))
+            sys.stdout.flush()
+            if event.kind != monitor.BATTERY_INSERTED:
+                continue
+
+            device = health.adapter
+            if device is None:
+                continue
+            run += 1
+            passed = worker.call(
+                run_inspection, device, opened[device], run, args, plan)
+            all_passed = all_passed and passed
+            if args.repeat > 0 and run >= args.repeat:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        health.stop()
+        if health.adapter is not None:
+            worker.call(disconnect, health.adapter)
+        worker.stop()
+
+    return 0 if all_passed else 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Inspect a battery and print JSON Lines results")
+    parser.add_argument(
+        "-a", "--adapter",
+        help="adapter index or serial number (default: first found)")
+    parser.add_argument(
+        "--list", action="store_true",
+        help="list the connected adapters and exit")
+    parser.add_argument(
+        "--no-shutdown", action="store_true",
+        help="only run the checks")
+    parser.add_argument(
+        "-n", "--repeat", type=int, default=None,
+        help="number of inspections to run, 0 to loop until interrupted "
+             "(default: 1, or 0 with --watch)")
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="print adapter/battery events and inspect each battery inserted")
+    parser.add_argument(
+        "--interval", type=float, default=0.0,
+        help="seconds to wait between inspections")
+    parser.add_argument(
+        "--delay", type=float, default=0.0,
+        help="fixed seconds to pause after each bus access, on top of pacing")
+    parser.add_argument(
+        "--min-gap", type=float, default=0.0,
+        help="minimum bus-idle seconds between transactions to the gauge")
+    parser.add_argument(
+        "--no-pacing", action="store_true",
+        help="no adaptive pacing; with --delay 0 the reads are pipelined")
+    parser.add_argument(
+        "--no-retry", action="store_true",
+        help="no retry policies; only the pacer retries a failed read, once")
+    parser.add_argument(
+        "--plan", default=inspection.DEFAULT_PLAN,
+        help="inspection plan JSON (default: %(default)s)")
+    parser.add_argument(
+        "--capture", metavar="FILE",
+        help="record the adapter traffic to a bqcomm.trace capture file")
+    parser.add_argument(
+        "--replay", metavar="FILE",
+        help="answer from a capture file instead of an adapter")
+    parser.add_argument(
+        "--replay-speed", type=float, default=None,
+        help="1 to replay with the recorded response times, 2 for twice as "
+             "fast, etc. (default: as fast as possible)")
+    parser.add_argument(
+        "--metrics", metavar="FILE",
+        help="keep per-transaction adapter metrics and write them to FILE "
+             "in Prometheus text format after every inspection")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.enable()
+
+    if args.list:
+        for index, device in enumerate(bqcomm.CommDevice.enumerate()):
+            print(json.dumps({"index": index, "adapter": adapter_serial(device),
+                              "type": type(device).__name__}))
+        return 0
+
+    plan = inspection.load_plan(args.plan)
+    if args.repeat is None:
+        args.repeat = 0 if args.watch else 1
+    if args.watch:
+        return watch(args, plan)
+
+    device, serial = open_device(args, plan)
+
+    all_passed = True
+    run = 0
+    try:
+        while args.repeat <= 0 or run < args.repeat:
+            if run and args.interval:
+                time.sleep(args.interval)
+            run += 1
+            passed = run_inspection(device, serial, run, args, plan)
+            all_passed = all_passed and passed
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device.close()
+
+    return 0 if all_passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
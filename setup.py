@@ -39,10 +39,13 @@ setup(
     author="Michael O'Brien",
     url="",
     author_email="michaelobrien@ti.com",
+    # memoryview.toreadonly(), selectors and non-blocking hidraw I/O
+    python_requires=">=3.8",
     install_requires=[
         "six",
         # "aardvark_py",  # doesn't work with python 3.7 yet, so optional
-        "pywinusb",  # TODO: Other OSes
+        # Linux uses /dev/hidraw directly
+        'pywinusb; sys_platform == "win32"',
     ],
     packages=find_packages()
 )
@@ -0,0 +1,139 @@
+"""
+# Station Runner
+##### Project:      Siena Battery
+##### File:         station.py
+##### Description: Inspect and shut down the batteries on every connected
+#####              adapter at once, one I/O worker per adapter.
+"""
+import argparse
+import json
+import time
+
+import bqcomm
+from bqcomm.pacing import Pacer
+from bqcomm.shared import SharedAdapter
+
+import inspection
+
+
+def adapter_serial(device):
+    """Serial number of the adapter, or a description if it has none"""
+    get_serial = getattr(device, "get_serial_number", None)
+    if get_serial is not None:
+        try:
+            serial = get_serial()
+            if serial:
+                return str(serial)
+        except Exception:
+            pass
+    return repr(device)
+
+
+class StationRunner(object):
+    """
+    Opens every enumerated adapter (or the `devices` given) and runs the
+    inspection on all of them in parallel, each on its adapter's own worker.
+    Each adapter is paced on its own unless `pacing` is False, and failed
+    transactions are retried with the default policies unless `retry` is
+    False. Stations are keyed by adapter serial, made unique when two
+    adapters report the same one (or none).
+    """
+
+    def __init__(self, devices=None, pacing=True, retry=True):
+        if devices is None:
+            devices = bqcomm.CommDevice.enumerate()
+
+        self.adapters = {}
+        self.failed = {}
+        for device in devices:
+            serial = self._unique(adapter_serial(device), device)
+            pacer = Pacer() if pacing else None
+            shared = SharedAdapter(
+                bqcomm.Adapter(device, no_open=True, pacer=pacer,
+                               retry=retry or None))
+            try:
+                shared.open()
+            except Exception as e:
+                # Keep the rest of the bench running
+                shared.release()
+                self.failed[serial] = str(e) or type(e).__name__
+                continue
+            self.adapters[serial] = shared
+
+        if not self.adapters and not self.failed:
+            raise bqcomm.Error("No communication devices available")
+
+    def _taken(self, key):
+        return key in self.adapters or key in self.failed
+
+    def _unique(self, serial, device):
+        # E.g. hidraw adapters without HID_UNIQ all fall back to one name;
+        # the transport (device path) tells them apart
+        if not self._taken(serial):
+            return serial
+        transport = getattr(device, "device", None)
+        if transport is not None:
+            serial = "{0} {1!r}".format(serial, transport)
+        key = serial
+        n = 2
+        while self._taken(key):
+            key = "{0} #{1}".format(serial, n)
+            n += 1
+        return key
+
+    def run(self, do_shutdown=True, delay=0.0, plan=None):
+        """Inspect every station; returns {adapter serial: result dict}"""
+        pending = {}
+        for serial, shared in self.adapters.items():
+            pending[serial] = shared.submit(
+                inspection.inspect, shared.adapter.device, do_shutdown, delay,
+                plan)
+
+        results = {}
+        for serial, error in self.failed.items():
+            results[serial] = {
+                "checks": [], "passed": False, "shutdown": False,
+                "error": error,
+            }
+        for serial, future in pending.items():
+            results[serial] = future.result()
+        return results
+
+    def close(self):
+        for shared in self.adapters.values():
+            shared.close()
+        self.adapters = {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Inspect the battery on every connected adapter")
+    parser.add_argument(
+        "--no-shutdown", action="store_true",
+        help="only run the checks")
+    parser.add_argument(
+        "--no-pacing", action="store_true",
+        help="no adaptive pacing; the reads are pipelined")
+    parser.add_argument(
+        "--no-retry", action="store_true",
+        help="no retry policies; only the pacer retries a failed read, once")
+    parser.add_argument(
+        "--plan", default=inspection.DEFAULT_PLAN,
+        help="inspection plan JSON (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    plan = inspection.load_plan(args.plan)
+    runner = StationRunner(pacing=not args.no_pacing, retry=not args.no_retry)
+    try:
+        start = time.time()
+        results = runner.run(do_shutdown=not args.no_shutdown, plan=plan)
+        elapsed = time.time() - start
+        for serial in sorted(results):
+            print(json.dumps(dict(adapter=serial, **results[serial])))
+        print("{0} stations in {1:.2f} s".format(len(results), elapsed))
+    finally:
+        runner.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import pytest
+
+from bqcomm import sim
+from bqcomm.ev2400 import EV2400
+from bqcomm.ev2400.transport import Transport
+
+
+class SilentTransport(Transport):
+    # An adapter that takes every report and never answers
+
+    def __init__(self):
+        self.sent = 0
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def set_raw_data_handler(self, handler):
+        pass
+
+    def send(self, report):
+        self.sent += 1
+
+
+class DeafGauge(sim.Bq40z50):
+    # Answers reads but NACKs every block write, counting them
+
+    writes = 0
+
+    def write_block(self, cmd, data):
+        self.writes += 1
+        raise sim.Nack()
+
+
+@pytest.fixture
+def deaf_gauge():
+    """A simulated gauge that answers reads but NACKs every block write"""
+    return DeafGauge()
+
+
+@pytest.fixture
+def silent_ev2400():
+    """An open EV2400 whose adapter never answers, with a short timeout"""
+    ev2400 = EV2400(SilentTransport(), no_open=True)
+    ev2400.open()
+    ev2400.timeout = 0.1
+    yield ev2400
+    ev2400.close()
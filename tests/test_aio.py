@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from bqcomm import sim
+from bqcomm.aio import AsyncAdapter
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def open_ev2400():
+    ev2400 = sim.SimEV2400(sim.SimTransport(), no_open=True)
+    ev2400.open()
+    return ev2400
+
+
+def test_pipelined_reads_past_the_window():
+    ev2400 = open_ev2400()
+
+    async def main():
+        async with AsyncAdapter(ev2400) as adapter:
+            reads = [adapter.smb_read_word(GAUGE, 0x09)
+                     for _ in range(3 * ev2400.window)]
+            return await asyncio.gather(*reads)
+
+    assert asyncio.run(main()) == [11400] * (3 * ev2400.window)
+    assert ev2400.in_flight == 0
+
+
+def test_blocking_device_runs_on_the_worker():
+    device = sim.SimDevice()
+
+    async def main():
+        async with AsyncAdapter(device) as adapter:
+            await adapter.open()
+            voltage = await adapter.smb_read_word(GAUGE, 0x09)
+            block = await adapter.smb_read_block(GAUGE, 0x21)
+            return voltage, block
+
+    voltage, block = asyncio.run(main())
+    assert voltage == 11400
+    assert bytes(block) == b"bq40z50-R2"
+    assert device.transactions == 2
+
+
+def test_silent_adapter_times_out_and_frees_its_slots(silent_ev2400):
+    async def main():
+        adapter = AsyncAdapter(silent_ev2400, timeout=0.05)
+        reads = [adapter.smb_read_word(GAUGE, 0x09)
+                 for _ in range(silent_ev2400.window + 2)]
+        return await asyncio.gather(*reads, return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, asyncio.TimeoutError) for r in results)
+    assert silent_ev2400.in_flight == 0
@@ -0,0 +1,34 @@
+from bqcomm import Adapter, sim
+from bqcomm.ev2400 import ResponseTimeout
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def test_batch_timeout_is_a_response_timeout():
+    transport = sim.SimTransport({GAUGE: sim.Bq40z50()}, latency=0.2)
+    ev2400 = sim.SimEV2400(transport, no_open=True)
+    ev2400.open()
+    ev2400.timeout = 0.05
+    adapter = Adapter(ev2400)
+    try:
+        with adapter.batch() as b:
+            b.smb_read_word(GAUGE, 0x09)
+        assert isinstance(b.result.errors[0], ResponseTimeout)
+    finally:
+        ev2400.close()
+
+
+def test_batch_past_the_window_times_out_on_a_silent_adapter(silent_ev2400):
+    adapter = Adapter(silent_ev2400)
+    count = silent_ev2400.window + 4
+    sent = silent_ev2400.device.sent
+    with adapter.batch() as b:
+        for _ in range(count):
+            b.smb_read_word(GAUGE, 0x09)
+
+    assert len(b.result) == count
+    assert all(isinstance(e, ResponseTimeout) for e in b.result.errors)
+    assert silent_ev2400.in_flight == 0
+    # Every operation went out; none was refused for want of a free slot
+    assert silent_ev2400.device.sent - sent == count
+    assert silent_ev2400.timeouts == 0
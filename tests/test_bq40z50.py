@@ -0,0 +1,32 @@
+from bqcomm import bq40z50, sim
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def test_default_snapshot_is_one_block_write_and_read():
+    device = sim.SimDevice({GAUGE: sim.Bq40z50()})
+    device.open()
+
+    values = bq40z50.Telemetry(device, GAUGE).snapshot()
+    assert device.transactions == 2
+    assert values["bat_voltage"] == 11400
+    assert values["cell_voltage_1"] is not None
+    assert len(values) == len(bq40z50.DA_STATUS_1.fields)
+
+
+def test_unsupported_block_falls_back_to_words():
+    gauge = sim.Bq40z50()
+    device = sim.SimDevice({GAUGE: gauge})
+    device.open()
+    unknown = bq40z50.MacBlock(0x0099, "Unknown", "<2H", (
+        ("bat_voltage", "voltage"),
+        ("pack_voltage", None),
+    ))
+    telemetry = bq40z50.Telemetry(device, GAUGE, blocks=(unknown,))
+
+    assert telemetry.snapshot() == {"bat_voltage": 11400,
+                                    "pack_voltage": None}
+    # The block is not tried again: one word read only
+    before = device.transactions
+    telemetry.snapshot()
+    assert device.transactions - before == 1
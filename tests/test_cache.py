@@ -0,0 +1,42 @@
+import time
+
+import inspection
+from bqcomm import Adapter, bq40z50, sim
+from bqcomm.cache import RegisterCache
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def checks(result):
+    return dict((c["name"], c["value"]) for c in result["checks"])
+
+
+def test_cache_is_reset_between_batteries():
+    gauges = {GAUGE: sim.Bq40z50()}
+    cache = RegisterCache(bq40z50.CACHE_POLICIES)
+    adapter = Adapter(sim.SimDevice(gauges), cache=cache)
+    adapter.open()
+    plan = inspection.default_plan()
+
+    first = inspection.inspect(adapter.device, False, 0, plan)
+    assert checks(first)["serial_number"] == 1234
+
+    # Swap in another battery with no shutdown in between
+    gauges[GAUGE] = sim.Bq40z50({0x1C: 4321, 0x17: 7, 0x10: 5000})
+    second = inspection.inspect(adapter.device, False, 0, plan)
+    values = checks(second)
+    assert values["serial_number"] == 4321
+    assert values["cycle_count"] == 7
+    assert values["full_charge_capacity"] == 5000
+
+
+def test_ttl_ignores_wall_clock_steps(monkeypatch):
+    cache = RegisterCache({0x17: 60})
+    hit, generation = cache.get(GAUGE, 0x17, "word")
+    assert not hit
+    cache.put(GAUGE, 0x17, "word", 7, generation)
+
+    # E.g. NTP stepping the clock a day ahead
+    wall = time.time() + 86400
+    monkeypatch.setattr(time, "time", lambda: wall)
+    assert cache.get(GAUGE, 0x17, "word") == (True, 7)
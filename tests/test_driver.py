@@ -0,0 +1,23 @@
+import time
+
+import pytest
+
+from bqcomm import ResponseTimeout, sim
+from bqcomm.ev2400.packet import EV2400Packet
+
+Tags = EV2400Packet.Tags
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def test_full_window_times_out_on_a_silent_adapter(silent_ev2400):
+    for _ in range(silent_ev2400.window):
+        silent_ev2400.submit(EV2400Packet(Tags.GET_VERSION))
+
+    start = time.monotonic()
+    with pytest.raises(ResponseTimeout):
+        silent_ev2400.submit(EV2400Packet(Tags.GET_VERSION))
+    assert time.monotonic() - start < 1.0
+
+    # The send lock was let go, so waiting calls still time out normally
+    with pytest.raises(ResponseTimeout):
+        silent_ev2400.smb_read_word(GAUGE, 0x09)
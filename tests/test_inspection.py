@@ -0,0 +1,55 @@
+import inspection
+from bqcomm import sim
+
+PLAN = {
+    "name": "test",
+    "checks": [{"name": "voltage", "register": "0x09", "min": 6000}],
+    "actions": [{"name": "shutdown", "register": "0x44",
+                 "write_block": ["0x10", "0x00"], "repeat": 2}],
+}
+
+
+def open_ev2400(gauge):
+    device = sim.SimEV2400(
+        sim.SimTransport({sim.Bq40z50.ADDRESS: gauge}), no_open=True)
+    device.open()
+    return device
+
+
+def test_shutdown_on_sim_ev2400():
+    gauge = sim.Bq40z50()
+    device = open_ev2400(gauge)
+    try:
+        result = inspection.inspect(
+            device, delay=0, plan=inspection.compile_plan(PLAN))
+    finally:
+        device.close()
+    assert result["passed"] and result["shutdown"]
+    assert result["error"] is None
+    assert gauge.is_shutdown
+
+
+def test_nacked_async_shutdown_is_reported(deaf_gauge):
+    device = open_ev2400(deaf_gauge)
+    try:
+        assert device.async_writes
+        result = inspection.inspect(
+            device, delay=0, plan=inspection.compile_plan(PLAN))
+        # Nothing left over to be blamed on the next battery
+        assert device.unacked_writes == 0
+        assert device.smb_read_word(sim.Bq40z50.ADDRESS, 0x09) == 11400
+    finally:
+        device.close()
+    assert result["passed"]
+    assert not result["shutdown"]
+    assert "Nack" in result["error"]
+    assert not deaf_gauge.is_shutdown
+
+
+def test_pipelined_inspection_reports_a_silent_adapter(silent_ev2400):
+    plan = inspection.default_plan()
+    assert len(plan.registers) > silent_ev2400.window
+
+    result = inspection.inspect(silent_ev2400, False, 0, plan)
+    assert result["error"] and not result["passed"]
+    assert silent_ev2400.in_flight == 0
@@ -0,0 +1,74 @@
+import pytest
+
+import bqcomm
+from bqcomm import metrics, sim
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+@pytest.fixture
+def registry():
+    yield metrics.enable()
+    metrics.disable()
+
+
+def samples(registry, name, **labels):
+    found = registry.snapshot().get("bqcomm_" + name, [])
+    return [s for s in found
+            if all(s["labels"].get(k) == v for k, v in labels.items())]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram(buckets=(0.001, 0.01, 0.1))
+    for value in (0.0005, 0.001, 0.005, 0.05, 0.5):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    # A value on a bound counts towards that bucket ("le")
+    assert snapshot["buckets"] == [(0.001, 2), (0.01, 3), (0.1, 4)]
+    assert snapshot["count"] == 5
+    assert snapshot["sum"] == pytest.approx(0.5565)
+
+
+def test_prometheus_text_format():
+    registry = metrics.Registry()
+    counter = registry.counter(
+        "requests_total", "Requests", tag="A", adapter='x"1')
+    counter.inc(3)
+    registry.histogram("rtt_seconds", "RTT", buckets=(0.5, 1.0)).observe(0.75)
+    lines = registry.prometheus().splitlines()
+
+    assert "# TYPE bqcomm_requests_total counter" in lines
+    assert 'bqcomm_requests_total{adapter="x\\"1",tag="A"} 3' in lines
+    assert 'bqcomm_rtt_seconds_bucket{le="0.5"} 0' in lines
+    assert 'bqcomm_rtt_seconds_bucket{le="1"} 1' in lines
+    assert 'bqcomm_rtt_seconds_bucket{le="+Inf"} 1' in lines
+    assert "bqcomm_rtt_seconds_sum 0.75" in lines
+    assert "bqcomm_rtt_seconds_count 1" in lines
+
+
+def test_instrument_types_cannot_be_mixed():
+    registry = metrics.Registry()
+    registry.counter("x")
+    with pytest.raises(ValueError):
+        registry.histogram("x")
+
+
+def test_ev2400_transactions_are_counted(registry):
+    gauge = sim.Bq40z50()
+    ev2400 = sim.SimEV2400(sim.SimTransport({GAUGE: gauge}), no_open=True)
+    ev2400.open()
+    try:
+        for _ in range(3):
+            ev2400.smb_read_word(GAUGE, 0x09)
+        gauge.remove()
+        with pytest.raises(bqcomm.Error):
+            ev2400.smb_read_word(GAUGE, 0x09)
+    finally:
+        ev2400.close()
+
+    labels = {"kind": "ev2400", "tag": "SMB_RD_WORD"}
+    assert samples(registry, "requests_total", **labels)[0]["value"] == 4
+    assert samples(registry, "round_trip_seconds", **labels)[0]["count"] == 3
+    errors = samples(registry, "errors_total", **labels)
+    assert [(e["labels"]["error"], e["value"]) for e in errors] == [
+        ("NACK", 1)]
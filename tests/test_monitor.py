@@ -0,0 +1,85 @@
+from bqcomm import monitor, sim
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+class UnpluggableDevice(sim.SimDevice):
+    # A simulated adapter that stops answering once closed
+
+    def get_version(self):
+        if not self.is_open:
+            raise sim.Error("Simulated adapter is not open")
+        return super(UnpluggableDevice, self).get_version()
+
+
+class Bench(object):
+    # Hands the monitor a simulated adapter, or fails while unplugged
+
+    def __init__(self):
+        self.gauge = sim.Bq40z50()
+        self.device = None
+        self.plugged = True
+
+    def connect(self):
+        if not self.plugged:
+            raise sim.Error("No adapter")
+        self.device = UnpluggableDevice({GAUGE: self.gauge})
+        self.device.open()
+        return self.device
+
+
+def watch(bench):
+    health = monitor.HealthMonitor(
+        bench.connect, GAUGE, min_interval=0.5, max_interval=4.0)
+    events = []
+    health.subscribe(lambda event: events.append(event.kind))
+    return health, events
+
+
+def test_interval_backs_off_while_nothing_changes():
+    bench = Bench()
+    health, events = watch(bench)
+
+    assert health.tick() == 0.5
+    assert events == [monitor.ADAPTER_UP, monitor.BATTERY_INSERTED]
+    assert [health.tick() for _ in range(4)] == [1.0, 2.0, 4.0, 4.0]
+    assert len(events) == 2
+
+    # One read per healthy tick
+    before = health.transactions
+    health.tick()
+    assert health.transactions == before + 1
+
+    bench.gauge.remove()
+    assert health.tick() == 0.5
+    assert events[-1] == monitor.BATTERY_REMOVED
+    assert health.tick() == 1.0
+
+
+def test_adapter_loss_is_reported_and_reconnected():
+    bench = Bench()
+    health, events = watch(bench)
+    health.tick()
+
+    bench.plugged = False
+    bench.device.close()
+    assert health.tick() == 0.5
+    assert events[-2:] == [monitor.ADAPTER_DOWN, monitor.BATTERY_REMOVED]
+    assert not health.adapter_up
+    # Nothing to talk to: back off without touching the bus
+    before = health.transactions
+    assert health.tick() == 1.0
+    assert health.transactions == before
+
+    bench.plugged = True
+    assert health.tick() == 0.5
+    assert events[-2:] == [monitor.ADAPTER_UP, monitor.BATTERY_INSERTED]
+
+
+def test_poke_resets_the_interval():
+    health, _ = watch(Bench())
+    for _ in range(4):
+        health.tick()
+    assert health.interval == 4.0
+    health.poke()
+    assert health.interval == 0.5
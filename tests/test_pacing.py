@@ -0,0 +1,40 @@
+import pytest
+
+from bqcomm import Adapter, sim
+from bqcomm.ev2400 import WriteError
+from bqcomm.pacing import PacedDevice, Pacer
+
+GAUGE = sim.Bq40z50.ADDRESS
+MAC = sim.Bq40z50.MANUFACTURER_BLOCK_ACCESS
+
+
+def test_failed_write_is_not_retried(deaf_gauge):
+    pacer = Pacer(initial_gap=0)
+    adapter = Adapter(sim.SimDevice({GAUGE: deaf_gauge}), pacer=pacer)
+    adapter.open()
+    gap = pacer.gap(GAUGE)
+    with pytest.raises(sim.Nack):
+        adapter.smb_write_block(GAUGE, MAC, [0x10, 0x00])
+    with pytest.raises(sim.Nack):
+        adapter.device.smb_write_block(GAUGE, MAC, [0x10, 0x00])
+    assert deaf_gauge.writes == 2
+    stats = pacer.stats()[GAUGE]
+    assert stats["retries"] == 0 and stats["failures"] == 0
+    assert pacer.gap(GAUGE) == gap
+
+
+def test_deferred_write_error_is_not_swallowed(deaf_gauge):
+    ev2400 = sim.SimEV2400(sim.SimTransport({GAUGE: deaf_gauge}), no_open=True)
+    ev2400.open()
+    pacer = Pacer(initial_gap=0)
+    device = PacedDevice(ev2400, pacer)
+    try:
+        device.smb_write_block(GAUGE, MAC, [0x10, 0x00])
+        with pytest.raises(WriteError):
+            device.smb_read_word(GAUGE, 0x09)
+        assert device.smb_read_word(GAUGE, 0x09) == 11400
+    finally:
+        ev2400.close()
+    assert deaf_gauge.writes == 1
+    stats = pacer.stats()[GAUGE]
+    assert stats["retries"] == 0 and stats["floor"] == 0
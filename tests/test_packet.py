@@ -0,0 +1,112 @@
+import random
+
+from bqcomm.ev2400.packet import (CRC8_POLY, Crc8, EV2400Packet, PacketStream,
+                                  crc8)
+
+Tags = EV2400Packet.Tags
+
+
+def bitwise_crc8(data, crc=0):
+    # The shift-and-xor definition the lookup table is built from
+    for byte in bytearray(data):
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ CRC8_POLY) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+    return crc
+
+
+def test_crc8_matches_the_bitwise_definition():
+    rng = random.Random(1)
+    assert crc8(b"123456789") == bitwise_crc8(b"123456789") == 0xF4
+    for byte in range(256):
+        assert crc8([byte]) == bitwise_crc8([byte])
+    for _ in range(200):
+        data = bytes(rng.randrange(256) for _ in range(rng.randrange(64)))
+        start = rng.randrange(256)
+        assert crc8(data, start) == bitwise_crc8(data, start)
+        assert crc8(bytearray(data)) == crc8(memoryview(data))
+
+
+def test_incremental_crc8_matches_one_shot():
+    data = bytes(range(100))
+    crc = Crc8()
+    for i in range(0, len(data), 7):
+        crc.update(data[i:i + 7])
+    assert crc.value == crc8(data)
+
+
+def test_packet_round_trips_through_its_wire_bytes():
+    packet = EV2400Packet(Tags.SMB_RD_WORD, [0x0B, 0x09], packet_id=0x1234,
+                          retry=2)
+    wire = bytes(packet.raw_bytes)
+    assert wire[0] == EV2400Packet.HEADER and wire[-1] == EV2400Packet.TRAILER
+
+    received = EV2400Packet()
+    assert received.add_bytes(wire + b"\x00\x00") == len(wire)
+    assert received.complete
+    received.validate()
+    assert received.tag == Tags.SMB_RD_WORD[Tags.CMD]
+    assert received.packet_id == 0x1234
+    assert received.retry_count == 2
+    assert list(received.payload) == [0x0B, 0x09]
+    assert received.crc == crc8(wire[EV2400Packet.TAG:EV2400Packet.CRC])
+
+
+def wire(packet_id, payload=(0x0B, 0x09, 0x48, 0x2C, 0x00)):
+    packet = EV2400Packet(Tags.SMB_RD_WORD[Tags.RSP], list(payload),
+                          packet_id=packet_id)
+    return bytes(packet.raw_bytes)
+
+
+def feed(stream, data, chunk=PacketStream.REPORT_SIZE - 2):
+    # Send `data` as HID input reports; returns the packet IDs received
+    ids = []
+    for offset in range(0, len(data), chunk):
+        part = data[offset:offset + chunk]
+        report = bytearray(PacketStream.REPORT_SIZE)
+        report[0] = PacketStream.REPORT_ID
+        report[1] = len(part)
+        report[2:2 + len(part)] = part
+        ids.extend(p.packet_id for p in stream.on_data_received(report))
+    return ids
+
+
+def test_stream_splits_packets_across_reports():
+    stream = PacketStream(None, None)
+    data = b"".join(wire(i, range(60)) for i in range(1, 6))
+    assert feed(stream, data, chunk=7) == [1, 2, 3, 4, 5]
+    assert stream.rx_discarded_bytes == 0 and stream.rx_resyncs == 0
+
+
+def test_stream_resyncs_after_garbage():
+    stream = PacketStream(None, None)
+    garbage = bytes([0x01, EV2400Packet.HEADER, 0x99, 0x02, 0x03])
+    assert feed(stream, garbage + wire(1) + wire(2)) == [1, 2]
+    assert stream.rx_discarded_bytes == len(garbage)
+    assert stream.rx_resyncs > 0
+
+
+def test_stream_drops_a_packet_with_a_bad_crc():
+    stream = PacketStream(None, None)
+    bad = bytearray(wire(1))
+    bad[EV2400Packet.CRC] ^= 0xFF
+    assert feed(stream, bytes(bad) + wire(2)) == [2]
+    assert stream.rx_discarded_bytes == len(bad)
+
+    # A false header whose packet never completes is given up on as soon as
+    # a good packet follows it
+    truncated = wire(3)[:EV2400Packet.PREAMBLE_SIZE + 1]
+    assert feed(stream, truncated + wire(4), chunk=5) == [4]
+
+
+def test_stream_counts_bad_reports():
+    stream = PacketStream(None, None)
+    wrong_id = bytearray([0x00, 4, 1, 2, 3, 4])
+    overlong = bytearray([PacketStream.REPORT_ID, 9])
+    assert stream.on_data_received(wrong_id) == []
+    assert stream.on_data_received(overlong) == []
+    assert stream.rx_bad_reports == 2
+    assert feed(stream, wire(7)) == [7]
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+import inspection
+from bqcomm import Error, sim
+from bqcomm.replay import ReplayDevice, ReplayMismatch
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def quick_plan():
+    # The default plan without the pause between the shutdown writes
+    with open(inspection.DEFAULT_PLAN) as f:
+        spec = json.load(f)
+    for action in spec.get("actions", []):
+        action.pop("interval", None)
+    return inspection.compile_plan(spec)
+
+
+def record(path, gauge, fn):
+    """Run fn(ev2400) on a simulated EV2400, capturing to `path`"""
+    ev2400 = sim.SimEV2400(sim.SimTransport({GAUGE: gauge}), no_open=True)
+    ev2400.enable_tracing(path=str(path))
+    ev2400.open()
+    try:
+        return fn(ev2400)
+    finally:
+        ev2400.close()
+
+
+def test_replay_reproduces_an_inspection(tmp_path):
+    path = tmp_path / "inspection.bqtrace"
+    plan = quick_plan()
+    gauge = sim.Bq40z50()
+    recorded = record(
+        path, gauge, lambda d: inspection.inspect(d, delay=0, plan=plan))
+    assert recorded["shutdown"] and gauge.is_shutdown
+
+    replay = ReplayDevice(str(path))
+    replay.open()
+    assert inspection.inspect(replay, delay=0, plan=plan) == recorded
+    assert replay.remaining == 0
+
+
+def test_replay_returns_recorded_errors(tmp_path):
+    path = tmp_path / "absent.bqtrace"
+    gauge = sim.Bq40z50()
+    gauge.remove()
+
+    def read(device):
+        with pytest.raises(Error) as recorded:
+            device.smb_read_word(GAUGE, 0x09)
+        return recorded.value
+
+    recorded = record(path, gauge, read)
+    replay = ReplayDevice(str(path))
+    replay.open()
+    replayed = read(replay)
+    assert replayed.args == recorded.args
+
+
+def test_replay_rejects_other_requests(tmp_path):
+    path = tmp_path / "voltage.bqtrace"
+    record(path, sim.Bq40z50(), lambda d: d.smb_read_word(GAUGE, 0x09))
+
+    replay = ReplayDevice(str(path))
+    replay.open()
+    with pytest.raises(ReplayMismatch):
+        replay.smb_read_word(GAUGE, 0x0A)
+    assert replay.smb_read_word(GAUGE, 0x09) == 11400
+    with pytest.raises(ReplayMismatch):
+        replay.smb_read_word(GAUGE, 0x09)
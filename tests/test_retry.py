@@ -0,0 +1,58 @@
+import pytest
+
+from bqcomm import Adapter, Error, ResponseTimeout, WriteError, sim
+from bqcomm.pacing import Pacer
+from bqcomm.retry import (DEFERRED_WRITE, HOST_TIMEOUT, NACK, RetryingDevice,
+                          error_class)
+
+GAUGE = sim.Bq40z50.ADDRESS
+MAC = sim.Bq40z50.MANUFACTURER_BLOCK_ACCESS
+
+
+def open_adapter(gauge, **kwargs):
+    adapter = Adapter(sim.SimDevice({GAUGE: gauge}), **kwargs)
+    adapter.open()
+    return adapter
+
+
+@pytest.mark.parametrize("pacer", [None, Pacer(initial_gap=0)])
+def test_nacked_write_is_sent_once(pacer, deaf_gauge):
+    adapter = open_adapter(deaf_gauge, pacer=pacer, retry=True)
+    with pytest.raises(sim.Nack):
+        adapter.smb_write_block(GAUGE, MAC, [0x10, 0x00])
+    assert deaf_gauge.writes == 1
+    with pytest.raises(sim.Nack):
+        adapter.device.smb_write_block(GAUGE, MAC, [0x10, 0x00])
+    assert deaf_gauge.writes == 2
+
+
+def test_transient_read_nack_is_retried():
+    gauge = sim.Bq40z50(min_gap=0.001)
+    adapter = open_adapter(gauge, retry=True)
+    device = adapter.device
+    assert isinstance(device, RetryingDevice)
+    for i in range(5):
+        assert adapter.smb_read_word(GAUGE, 0x09) == 11400
+    stats = device.stats()
+    assert stats["retries"] > 0
+    assert stats["recovered"] > 0 and stats["exhausted"] == 0
+
+
+@pytest.mark.parametrize("pacer", [None, Pacer()])
+def test_absent_battery_fails_fast(pacer):
+    # With a pacer too, as the GUI, CLI and station build it
+    gauge = sim.Bq40z50()
+    gauge.remove()
+    adapter = open_adapter(gauge, pacer=pacer, retry=True)
+    for i in range(3):
+        with pytest.raises(sim.Nack):
+            adapter.smb_read_word(GAUGE, 0x09)
+    # Three tries for the first read, then one each
+    assert gauge.accesses == 3 + 2
+
+
+def test_error_classes():
+    assert error_class(Error("Nack received", 0x93)) == NACK
+    assert error_class(ResponseTimeout()) == HOST_TIMEOUT
+    assert error_class(WriteError("Nack received", 0x93)) == DEFERRED_WRITE
+    assert error_class(Error("Malformed response packet")) == "OTHER"
@@ -0,0 +1,44 @@
+import pytest
+
+from bqcomm import Adapter, Error, sim
+from bqcomm.pacing import Pacer
+from bqcomm.shared import SharedAdapter
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def test_released_adapter_raises_instead_of_blocking():
+    shared = SharedAdapter(sim.SimDevice({GAUGE: sim.Bq40z50()}))
+    shared.open()
+    assert shared.device.smb_read_word(GAUGE, 0x09) > 0
+    shared.release()
+
+    # The last user stopped the worker, so nothing would run these
+    with pytest.raises(Error):
+        shared.device.smb_read_word(GAUGE, 0x09)
+    with pytest.raises(Error):
+        shared.submit(shared.adapter.close)
+
+
+def test_worker_stays_up_while_shared():
+    device = sim.SimDevice({GAUGE: sim.Bq40z50()})
+    first = SharedAdapter(device)
+    second = SharedAdapter(device)
+    first.open()
+    first.release()
+
+    assert second.device.smb_read_word(GAUGE, 0x09) > 0
+    second.close()
+    with pytest.raises(Error):
+        second.device.smb_read_word(GAUGE, 0x09)
+
+
+def test_wrapped_adapters_share_one_worker():
+    device = sim.SimDevice({GAUGE: sim.Bq40z50()})
+    paced = SharedAdapter(Adapter(device, pacer=Pacer()))
+    retried = SharedAdapter(Adapter(device, retry=True))
+    try:
+        assert paced._worker is retried._worker
+    finally:
+        paced.release()
+        retried.release()
@@ -0,0 +1,16 @@
+import station
+from bqcomm import sim
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def test_adapters_with_the_same_serial_are_all_kept():
+    devices = [sim.SimDevice({GAUGE: sim.Bq40z50()}) for _ in range(3)]
+    runner = station.StationRunner(devices, pacing=False)
+    try:
+        assert len(runner.adapters) == 3
+        results = runner.run(do_shutdown=False)
+        assert len(results) == 3
+        assert all(r["error"] is None for r in results.values())
+    finally:
+        runner.close()
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from bqcomm import sim, trace
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+class WatchedRecorder(trace.TraceRecorder):
+    # Notes which threads wrote to the capture file
+
+    def __init__(self, *args, **kwargs):
+        super(WatchedRecorder, self).__init__(*args, **kwargs)
+        self.flushed_by = set()
+
+    def flush(self):
+        self.flushed_by.add(threading.current_thread())
+        super(WatchedRecorder, self).flush()
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_full_buffer_is_written_off_the_recording_thread(tmp_path):
+    path = str(tmp_path / "ring.bqtrace")
+    recorder = WatchedRecorder(path, capacity=4)
+    for i in range(4):
+        recorder.record(True, [i])
+
+    assert wait_for(lambda: recorder.written == 4)
+    assert threading.current_thread() not in recorder.flushed_by
+    recorder.close()
+    assert len(trace.Capture(path)) == 4
+
+
+def test_recording_after_close_appends(tmp_path):
+    path = str(tmp_path / "reopen.bqtrace")
+    recorder = trace.TraceRecorder(path, capacity=100)
+    recorder.record(True, [1])
+    recorder.close()
+    recorder.record(False, [2])
+    recorder.close()
+
+    records = trace.Capture(path).records
+    assert [bytearray(r.data) for r in records] == [b"\x01", b"\x02"]
+
+
+def test_ev2400_close_closes_the_capture_file(tmp_path):
+    path = str(tmp_path / "ev2400.bqtrace")
+    ev2400 = sim.SimEV2400(
+        sim.SimTransport({GAUGE: sim.Bq40z50()}), no_open=True)
+    ev2400.open()
+    recorder = ev2400.enable_tracing(path=path)
+    ev2400.smb_read_word(GAUGE, 0x09)
+    ev2400.close()
+
+    assert recorder._file is None
+    assert len(trace.Capture(path)) >= 2
@@ -0,0 +1,92 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import bqcomm
+from bqcomm import sim
+from bqcomm.ev2400 import EV2400
+from bqcomm.ev2400.transport import HidrawTransport
+
+GAUGE = sim.Bq40z50.ADDRESS
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.fixture
+def hidraw():
+    """
+    A HidrawTransport on one end of a SOCK_SEQPACKET socketpair, with the
+    simulated EV2400 firmware answering on the other
+    """
+    host, adapter = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    firmware = sim.SimTransport()
+    firmware.set_raw_data_handler(adapter.send)
+    firmware.open()
+
+    def bridge():
+        while True:
+            try:
+                report = adapter.recv(4096)
+            except OSError:
+                return
+            if not report:
+                return
+            firmware.send(report)
+
+    thread = threading.Thread(target=bridge)
+    thread.daemon = True
+    thread.start()
+
+    transport = HidrawTransport(host.detach())
+    yield transport, adapter
+    transport.close()
+    adapter.close()
+    firmware.close()
+
+
+def test_reports_round_trip(hidraw):
+    transport, _ = hidraw
+    ev2400 = EV2400(transport, no_open=True)
+    ev2400.open()
+    assert ev2400.get_version() == "v1.02"
+    assert ev2400.smb_read_word(GAUGE, 0x09) == 11400
+
+
+def test_close_stops_the_reader_thread(hidraw):
+    transport, adapter = hidraw
+    transport.open()
+    thread = transport._thread
+    assert thread.is_alive()
+
+    transport.close()
+    assert not thread.is_alive()
+    assert transport.fd is None
+    # The adapter end sees the host end go away
+    assert adapter.recv(4096) == b""
+    transport.close()  # Closing twice is harmless
+
+
+def test_send_after_close_raises(hidraw):
+    transport, _ = hidraw
+    transport.open()
+    transport.close()
+    with pytest.raises(bqcomm.Error):
+        transport.send(bytearray(transport.report_size))
+
+
+def test_adapter_going_away_is_reported(hidraw):
+    transport, adapter = hidraw
+    transport.open()
+    adapter.shutdown(socket.SHUT_RDWR)
+
+    assert wait_for(lambda: not transport._thread.is_alive())
+    assert transport.error
+    with pytest.raises(bqcomm.Error):
+        transport.send(bytearray(transport.report_size))